@@ -1,4 +1,5 @@
 from orpheus.core import Orpheus
+from orpheus.warmup import ModuleWarmup
 import traceback
 import subprocess
 import os
@@ -7,9 +8,21 @@ from collections import defaultdict
 
 
 class OrpheusManager:
-    def __init__(self):
+    def __init__(self, warmup: bool = None):
         self.orpheus = Orpheus()
         self.active_sessions = {}
+        # With module_warmup the modules are loaded and logged into in the background instead of by the first request
+        if warmup is None:
+            warmup = self.orpheus.settings['global']['advanced'].get('module_warmup', False)
+        self.warmup = ModuleWarmup(self.orpheus) if warmup else None
+        if self.warmup:
+            self.warmup.start()
+
+    def health(self) -> dict:
+        """Readiness of the modules, always ready without the warm-up as modules are loaded on first use"""
+        if not self.warmup:
+            return {'ready': True, 'warmup': False, 'modules': {}}
+        return {**self.warmup.report(), 'warmup': True}
 
     async def test_login(self, platform: str, username: str, password: str) -> bool:
         """Test if credentials are valid for a platform"""
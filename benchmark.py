@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""Micro benchmarks of Orpheus internals, run `python benchmark.py -h` for the list"""
+import argparse
+import asyncio
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from utils.utils import DOWNLOAD_BUFFER_SIZE, DOWNLOAD_CHUNK_SIZE, PartWriter
+
+
+class FakeContent:
+    """Stands in for an aiohttp response body, handing out the same chunk over and over"""
+
+    def __init__(self, size, chunk_size):
+        self.size = size
+        self.chunk = os.urandom(chunk_size)
+
+    async def iter_chunked(self, chunk_size):
+        left = self.size
+        while left > 0:
+            yield self.chunk[:min(chunk_size, left)]
+            left -= chunk_size
+
+
+async def write_per_chunk(location, content, chunk_size):
+    """The previous write path: one thread pool hop per chunk, like aiofiles"""
+    loop = asyncio.get_event_loop()
+    with open(location, 'wb') as f:
+        async for chunk in content.iter_chunked(chunk_size):
+            await loop.run_in_executor(None, f.write, chunk)
+
+
+async def write_buffered(location, content, chunk_size, buffer_size):
+    writer = PartWriter(location, size=content.size, journal={}, buffer_size=buffer_size)
+    try:
+        async for chunk in content.iter_chunked(chunk_size):
+            await writer.write(chunk)
+        await writer.flush()
+    finally:
+        writer.close()
+
+
+def measure(coroutine):
+    cpu, wall = time.process_time(), time.perf_counter()
+    asyncio.run(coroutine)
+    return time.process_time() - cpu, time.perf_counter() - wall
+
+
+def benchmark_writes(args):
+    size = int(args.size * 1024 * 1024)
+    gigabytes = size / 1024 ** 3
+    directory = tempfile.mkdtemp(prefix='orpheus-benchmark-', dir=args.directory)
+    try:
+        location = os.path.join(directory, 'track')
+        runs = [
+            ('per chunk, 8 KiB chunks', lambda: write_per_chunk(location, FakeContent(size, 8 * 1024), 8 * 1024)),
+            (f'per chunk, {args.chunk_size // 1024} KiB chunks', lambda: write_per_chunk(location, FakeContent(size, args.chunk_size), args.chunk_size)),
+            (f'buffered, {args.chunk_size // 1024} KiB chunks, {args.buffer_size // 1024} KiB buffer',
+             lambda: write_buffered(location, FakeContent(size, args.chunk_size), args.chunk_size, args.buffer_size)),
+        ]
+        print(f'Writing {args.size:g} MiB to {directory}, best of {args.repeat}')
+        for name, run in runs:
+            results = []
+            for _ in range(args.repeat):
+                for suffix in ('', '.part', '.part.json'):
+                    if os.path.exists(location + suffix):
+                        os.remove(location + suffix)
+                results.append(measure(run()))
+            cpu, wall = min(results)
+            print(f'  {name:<45} {cpu / gigabytes:7.2f} CPU s/GB  {size / wall / 1024 ** 2:8.1f} MiB/s')
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+STARTUP_SCRIPT = '''
+import time
+start = time.perf_counter()
+from orpheus.core import Orpheus
+try:
+    Orpheus()
+except SystemExit:  # No modules or new settings, the discovery has been done by then
+    pass
+print(time.perf_counter() - start)
+'''
+
+
+def measure_startup():
+    """Seconds to import orpheus.core and construct Orpheus, in a fresh interpreter so no import is cached"""
+    result = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_startup(args):
+    manifest_location = os.path.join('config', 'module_manifest.bin')
+    cold = []
+    for _ in range(args.repeat):
+        if os.path.exists(manifest_location):
+            os.remove(manifest_location)
+        cold.append(measure_startup())
+    warm = [measure_startup() for _ in range(args.repeat)]
+    print(f'Orpheus startup with {len(os.listdir("modules"))} module folders, best of {args.repeat}')
+    print(f'  {"importing every module interface":<45} {min(cold) * 1000:8.1f} ms')
+    print(f'  {"from the module manifest":<45} {min(warm) * 1000:8.1f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Orpheus micro benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    writes = subparsers.add_parser('writes', help='CPU time of the download write path per GB')
+    writes.add_argument('--size', type=float, default=512, help='MiB written per run (default: 512)')
+    writes.add_argument('--chunk-size', type=int, default=DOWNLOAD_CHUNK_SIZE, help='Bytes per received chunk')
+    writes.add_argument('--buffer-size', type=int, default=DOWNLOAD_BUFFER_SIZE, help='Bytes per write of the buffered path')
+    writes.add_argument('--repeat', type=int, default=3, help='Runs per write path, the best one is shown')
+    writes.add_argument('--directory', default=None, help='Where to write, defaults to the system temp directory')
+    writes.set_defaults(function=benchmark_writes)
+
+    startup = subparsers.add_parser('startup', help='Time to construct Orpheus with and without the module manifest')
+    startup.add_argument('--repeat', type=int, default=5, help='Runs per case, the best one is shown')
+    startup.set_defaults(function=benchmark_startup)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
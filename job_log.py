@@ -0,0 +1,114 @@
+import gzip
+import itertools
+import json
+import os
+import sys
+import threading
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional
+
+
+class LogEntry:
+    __slots__ = ("seq", "timestamp", "level", "message")
+
+    def __init__(self, seq: int, timestamp: str, level: str, message: str):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.level = sys.intern(level)  # A handful of distinct levels shared by every line
+        self.message = message
+
+    def to_dict(self) -> Dict:
+        return {"seq": self.seq, "timestamp": self.timestamp, "level": self.level, "message": self.message}
+
+
+class JobLog:
+    """A job's most recent log lines in a bounded ring buffer, older lines are spilled to a gzip file
+
+    Every spill appends a gzip member to the file, a gzip reader sees the members as one stream of JSON lines. sync()
+    writes the buffered lines as well while keeping them in memory, so a crash only loses the lines since the last sync."""
+
+    def __init__(self, location: str, capacity: int = 1000):
+        self.location = location
+        self.capacity = capacity
+        self.lines = deque()
+        self.lock = threading.Lock()  # Guards the ring buffer and the file
+        self.synced_seq = 0  # Buffered lines up to this sequence number are on disk already
+
+    def append(self, entry: LogEntry):
+        with self.lock:
+            self.lines.append(entry)
+            if len(self.lines) >= self.capacity:
+                # Spill in large batches, a gzip member per line would compress badly
+                self._spill(self.capacity // 2)
+
+    def flush(self):
+        """Spill every buffered line, called once the job has finished so it holds no log lines in memory"""
+        with self.lock:
+            self._spill(len(self.lines))
+
+    def sync(self):
+        """Write the buffered lines that are not on disk yet, they stay buffered for reads"""
+        with self.lock:
+            entries = [e for e in self.lines if e.seq > self.synced_seq]
+            if entries:
+                self.write(entries)
+                self.synced_seq = entries[-1].seq
+
+    def _spill(self, count: int):
+        if not count:
+            return
+        entries = [self.lines.popleft() for _ in range(count)]
+        entries = [e for e in entries if e.seq > self.synced_seq]
+        if entries:
+            self.write(entries)
+
+    def write(self, entries: Iterable[LogEntry]):
+        data = "".join(json.dumps([e.seq, e.timestamp, e.level, e.message]) + "\n" for e in entries)
+        os.makedirs(os.path.dirname(self.location) or ".", exist_ok=True)
+        with open(self.location, "ab") as f:
+            f.write(gzip.compress(data.encode("utf-8")))
+
+    def _read_file(self) -> Iterator[LogEntry]:
+        if not os.path.isfile(self.location):
+            return
+        with gzip.open(self.location, "rt", encoding="utf-8") as f:
+            for line in f:
+                yield LogEntry(*json.loads(line))
+
+    def read(self, since: int = 0, limit: Optional[int] = None, tail: Optional[int] = None) -> List[Dict]:
+        """Lines with a sequence number above since, oldest first
+
+        limit pages forwards from since, tail only keeps the last lines."""
+        with self.lock:
+            buffered = list(self.lines)
+            first_buffered = buffered[0].seq if buffered else None
+            spilled = ()
+            # The file is only read when the cursor is older than the ring buffer
+            if first_buffered is None or since < first_buffered - 1:
+                spilled = (e for e in self._read_file()
+                           if e.seq > since and (first_buffered is None or e.seq < first_buffered))
+
+            entries = itertools.chain(spilled, (e for e in buffered if e.seq > since))
+            if tail is not None:
+                entries = deque(entries, maxlen=tail) if tail > 0 else ()
+            if limit is not None:
+                entries = itertools.islice(entries, limit)
+            return [e.to_dict() for e in entries]
+
+    def last_seq(self) -> int:
+        """Sequence number of the last line, on disk or buffered"""
+        with self.lock:
+            if self.lines:
+                return self.lines[-1].seq
+            last = 0
+            for entry in self._read_file():
+                last = entry.seq
+            return last
+
+    def delete(self):
+        with self.lock:
+            self.lines.clear()
+            try:
+                os.remove(self.location)
+            except FileNotFoundError:
+                pass
@@ -1,12 +1,27 @@
 import asyncio
+import contextvars
+import heapq
+import io
+import itertools
+import re
+import sys
+import time
 import uuid
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional
+from urllib.parse import urlparse
 from datetime import datetime
 from enum import Enum
-import subprocess
 import threading
 import os
-import json
+
+from job_log import JobLog, LogEntry
+from job_store import JobStore
+from orpheus.core import Orpheus, orpheus_core_download, parse_media_urls, get_third_party_modules
+from utils import metrics
+from utils.exceptions import DownloadCancelled
+from utils.models import ManualEnum, ProgressEvent, ProgressEventEnum
 
 
 class JobStatus(Enum):
@@ -14,6 +29,10 @@ class JobStatus(Enum):
     RUNNING = "running"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
 
 
 class JobType(Enum):
@@ -21,34 +40,232 @@ class JobType(Enum):
     ALBUM_DOWNLOAD = "album_download"
 
 
+class QueueFullError(Exception):
+    """Raised when the job queue has no room for another job, the API answers 503"""
+    status_code = 503
+
+
+class UserQueueFullError(QueueFullError):
+    """Raised when a single user has too many queued jobs, the API answers 429"""
+    status_code = 429
+
+
 class DownloadJob:
+    # How often a running job persists and publishes byte-level progress, state changes are always saved at once
+    progress_save_interval = 1.0
+    # Progress arrives on the SessionLoop and the downloader's pools, its saves run here instead of blocking them
+    progress_saver = ThreadPoolExecutor(1, thread_name_prefix="orpheus-job-progress")
+    # How often a running job writes its buffered log lines to disk at the latest, besides with every progress save
+    log_sync_interval = 5.0
+
     def __init__(self, job_id: str, job_type: JobType, url: str, platform: str, formats: List[str],
-                 user_id: str = None):
+                 user_id: str = None, priority: int = 0):
         self.job_id = job_id
         self.job_type = job_type
         self.url = url
         self.platform = platform
         self.formats = formats  # Keep this for display purposes but won't use in download
         self.user_id = user_id
+        self.priority = priority
         self.status = JobStatus.QUEUED
         self.created_at = datetime.now()
         self.started_at = None
         self.completed_at = None
         self.error_message = None
         self.progress = 0
-        self.logs = []
-        self.process = None
+        self.tracks_total = 0
+        self.tracks_completed = 0
+        self.tracks_skipped = 0
+        self.tracks_failed = 0
+        self.bytes_downloaded = 0
+        self.speed = 0  # Bytes per second
+        self.eta = None  # Seconds
+        self.logs_count = 0
+        self.worker_name = None
         self.file_paths = []
+        self.cancel_event = threading.Event()
+        self.finished_tracks = set()  # Downloaded or already existing track ids, skipped when the job runs again
+        self.track_states: Dict[str, str] = {}
+        self.track_bytes: Dict[str, List] = {}  # track_id -> [received, total or None] while downloading
+        self.progress_started_at = None
+        self.progress_saved_at = 0.0
+        self.queued_at = None  # time.monotonic() when last handed to the scheduler
+        self.coalesce_key = None
+        self.coalesced_with = None  # Id of the job whose download this job shares
+        self.followers: List["DownloadJob"] = []  # Jobs sharing this job's download
+        self.detached = False  # Cancelled by its own user while the download goes on for its followers
+        self.store: Optional[JobStore] = None
+        self.log: Optional[JobLog] = None
+        self.events: Optional["JobEventBroker"] = None
+        self.log_lock = threading.Lock()
+        # Progress arrives from the SessionLoop, the downloader's pools and the ffmpeg workers at the same time
+        self.progress_lock = threading.RLock()
+        self.save_lock = threading.Lock()  # A save's snapshot and write are not overtaken by another save
+        self.save_pending = False  # A progress save is queued on progress_saver, guarded by progress_lock
+        self.log_synced_at = 0.0
+        self.log_sync_pending = False  # A log sync is queued on progress_saver, guarded by log_lock
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "DownloadJob":
+        """Rebuild a job from its to_dict() representation, as kept by the JobStore"""
+        job = cls(data["job_id"], JobType(data["job_type"]), data["url"], data["platform"], data["formats"],
+                  data["user_id"], data["priority"])
+        job.status = JobStatus(data["status"])
+        job.created_at = datetime.fromisoformat(data["created_at"])
+        job.started_at = datetime.fromisoformat(data["started_at"]) if data["started_at"] else None
+        job.completed_at = datetime.fromisoformat(data["completed_at"]) if data["completed_at"] else None
+        job.error_message = data["error_message"]
+        job.progress = data["progress"]
+        for key in ("tracks_total", "tracks_completed", "tracks_skipped", "tracks_failed", "bytes_downloaded"):
+            setattr(job, key, data.get(key) or 0)
+        job.worker_name = data["worker_name"]
+        job.file_paths = data["file_paths"]
+        job.logs_count = data["logs_count"]
+        job.coalesced_with = data.get("coalesced_with")
+        return job
 
     def add_log(self, message: str, level: str = "INFO"):
-        log_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "level": level,
-            "message": message
-        }
-        self.logs.append(log_entry)
+        with self.log_lock:  # Lines come from the worker, the SessionLoop and the downloader's pools
+            self.logs_count += 1
+            entry = LogEntry(self.logs_count, datetime.now().isoformat(), level, message)
+            sync = False
+            if self.log:
+                self.log.append(entry)  # In the order of the line numbers
+                now = time.monotonic()
+                if not self.log_sync_pending and now - self.log_synced_at >= self.log_sync_interval:
+                    self.log_synced_at = now
+                    self.log_sync_pending = sync = True
+        if sync:  # Lines come from the SessionLoop as well, the file is written on progress_saver
+            self.progress_saver.submit(self._sync_log)
+        if self.events:
+            self.events.publish("log", {"job_id": self.job_id, "user_id": self.user_id, **entry.to_dict()})
+
+    def _sync_log(self):
+        with self.log_lock:
+            self.log_sync_pending = False
+            log = self.log
+        try:
+            if log:
+                log.sync()  # Recovered jobs keep the lines that explain how they stopped
+        except Exception as e:
+            print(f"Saving the log of job {self.job_id} failed: {e}")
+
+    def handle_progress(self, event: ProgressEvent):
+        """Progress callback for the Downloader, keeps per-track state and derives percent, throughput and ETA"""
+        with self.progress_lock:
+            if self.progress_started_at is None:
+                self.progress_started_at = time.monotonic()
+
+            kind = event.event
+            track_id = event.track_id or f"unknown-{len(self.track_states)}"
+            if kind is ProgressEventEnum.tracks_queued:
+                self.tracks_total += event.count
+            elif kind is ProgressEventEnum.track_started:
+                self.track_states[track_id] = "running"
+                self.track_bytes[track_id] = [0, None]
+            elif kind is ProgressEventEnum.bytes_received:
+                received = self.track_bytes.setdefault(track_id, [0, None])
+                received[0] += event.bytes
+                received[1] = event.total_bytes or received[1]
+                self.bytes_downloaded += event.bytes
+            else:
+                received = self.track_bytes.pop(track_id, [0, None])[0]
+                if event.track_id and kind in (ProgressEventEnum.track_done, ProgressEventEnum.track_skipped):
+                    self.finished_tracks.add(event.track_id)
+                if kind is ProgressEventEnum.track_done:
+                    self.track_states[track_id] = "completed"
+                    # Tracks that were moved from a module's temp file report their size only once finished
+                    self.bytes_downloaded += max(event.bytes - received, 0)
+                    if event.location and event.location not in self.file_paths:
+                        self.file_paths.append(event.location)
+                elif kind is ProgressEventEnum.track_skipped:
+                    self.track_states[track_id] = "skipped"
+                elif kind is ProgressEventEnum.track_failed:
+                    self.track_states[track_id] = "failed"
+                elif kind is ProgressEventEnum.track_rate_limited:
+                    self.track_states[track_id] = "deferred"  # Retried later in the same download
+                self.tracks_completed = sum(1 for state in self.track_states.values() if state == "completed")
+                self.tracks_skipped = sum(1 for state in self.track_states.values() if state == "skipped")
+                self.tracks_failed = sum(1 for state in self.track_states.values() if state == "failed")
+
+        self.update_progress(force=kind is not ProgressEventEnum.bytes_received)
+
+    def reset_progress(self):
+        """Forget the progress of an earlier, interrupted run before the job runs again"""
+        with self.progress_lock:
+            self.tracks_total = self.tracks_completed = self.tracks_skipped = self.tracks_failed = 0
+            self.bytes_downloaded = self.speed = 0
+            self.eta = None
+            self.progress = 0
+            self.track_states, self.track_bytes = {}, {}
+            self.progress_started_at = None
+
+    def update_progress(self, force: bool = False):
+        with self.progress_lock:
+            total = max(self.tracks_total, len(self.track_states))
+            if not total:
+                return
+
+            finished = self.tracks_completed + self.tracks_skipped + self.tracks_failed
+            partial = sum(received / size for received, size in self.track_bytes.values() if size)
+            fraction = min((finished + partial) / total, 1.0)
+            elapsed = time.monotonic() - self.progress_started_at
+            if elapsed > 0:
+                self.speed = int(self.bytes_downloaded / elapsed)
+            self.eta = int(elapsed * (1 - fraction) / fraction) if 0 < fraction < 1 else None
+            # 100 is only reported once the job has actually completed
+            self.progress = min(int(fraction * 100), 99)
+
+            now = time.monotonic()
+            if self.save_pending or (not force and now - self.progress_saved_at < self.progress_save_interval):
+                return  # A queued save picks up this progress as well
+            self.progress_saved_at = now
+            self.save_pending = True
+        self.progress_saver.submit(self._save_progress)
+
+    def _save_progress(self):
+        with self.progress_lock:
+            self.save_pending = False  # Progress from here on needs another save
+        self._sync_log()
+        try:
+            self.save()
+        except Exception as e:
+            print(f"Saving the progress of job {self.job_id} failed: {e}")
+
+    def save(self):
+        """Persist the job and announce the new state to event subscribers"""
+        with self.save_lock:
+            with self.progress_lock:
+                data = self.to_dict()
+                finished_tracks = set(self.finished_tracks)
+            if self.log and self.status in FINISHED_STATUSES:
+                # A finished job keeps no log lines in memory, and the saved logs_count covers lines on disk
+                self.log.flush()
+            if not self.detached:
+                if self.store:
+                    self.store.save_job(data, finished_tracks)
+                if self.events:
+                    self.events.publish("job", data)
+        for follower in list(self.followers):
+            follower.mirror(self)
+
+    def mirror(self, primary: "DownloadJob"):
+        """Take over the state of the job whose download this job shares"""
+        with primary.progress_lock, self.progress_lock:
+            for key in ("status", "started_at", "completed_at", "error_message", "progress", "tracks_total",
+                        "tracks_completed", "tracks_skipped", "tracks_failed", "bytes_downloaded", "speed", "eta",
+                        "worker_name"):
+                setattr(self, key, getattr(primary, key))
+            self.track_states = dict(primary.track_states)
+            self.file_paths = list(primary.file_paths)
+            self.finished_tracks = set(primary.finished_tracks)
+        self.save()
 
     def to_dict(self):
+        with self.progress_lock:
+            return self._to_dict()
+
+    def _to_dict(self):
         return {
             "job_id": self.job_id,
             "job_type": self.job_type.value,
@@ -56,138 +273,766 @@ class DownloadJob:
             "platform": self.platform,
             "formats": self.formats,
             "user_id": self.user_id,
+            "priority": self.priority,
             "status": self.status.value,
             "created_at": self.created_at.isoformat(),
             "started_at": self.started_at.isoformat() if self.started_at else None,
             "completed_at": self.completed_at.isoformat() if self.completed_at else None,
             "error_message": self.error_message,
             "progress": self.progress,
-            "file_paths": self.file_paths,
-            "logs_count": len(self.logs)
+            "tracks_total": max(self.tracks_total, len(self.track_states)),
+            "tracks_completed": self.tracks_completed,
+            "tracks_skipped": self.tracks_skipped,
+            "tracks_failed": self.tracks_failed,
+            "bytes_downloaded": self.bytes_downloaded,
+            "speed": self.speed,
+            "eta": self.eta,
+            "worker_name": self.worker_name,
+            "file_paths": list(self.file_paths),
+            "logs_count": self.logs_count,
+            "coalesced_with": self.coalesced_with
         }
 
 
-class JobManager:
+class JobSubscription:
+    """One event stream consumer, events are delivered on the event loop that subscribed"""
+
+    def __init__(self, job_id: str = None, user_id: str = None, include_logs: bool = False, max_pending: int = 1000):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.include_logs = include_logs
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.overflowed = False
+
+    def matches(self, event: str, data: Dict) -> bool:
+        if event == "log" and not self.include_logs:
+            return False
+        if self.job_id and data.get("job_id") != self.job_id:
+            return False
+        return not self.user_id or data.get("user_id") == self.user_id
+
+    def push(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # A slow client gets a resync event and reloads its state instead of unbounded buffering
+            self.overflowed = True
+
+    async def get(self):
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return None, "resync", {}
+        return await self.queue.get()
+
+
+class JobEventBroker:
+    """Fans job state changes and log lines out to subscribers, publishing is safe from any thread"""
+
     def __init__(self):
-        self.jobs: Dict[str, DownloadJob] = {}
+        self.lock = threading.Lock()
+        self.subscribers: List[JobSubscription] = []
+        self.sequence = itertools.count(1)
+
+    def subscribe(self, job_id: str = None, user_id: str = None, include_logs: bool = False) -> JobSubscription:
+        subscription = JobSubscription(job_id, user_id, include_logs)
+        with self.lock:
+            self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: JobSubscription):
+        with self.lock:
+            if subscription in self.subscribers:
+                self.subscribers.remove(subscription)
+
+    def publish(self, event: str, data: Dict):
+        with self.lock:
+            subscribers = [subscriber for subscriber in self.subscribers if subscriber.matches(event, data)]
+        if not subscribers:
+            return
+
+        item = (next(self.sequence), event, data)
+        for subscriber in subscribers:
+            try:
+                subscriber.loop.call_soon_threadsafe(subscriber.push, item)
+            except RuntimeError:  # The subscriber's event loop is gone
+                self.unsubscribe(subscriber)
+
+
+class JobOutput:
+    """The job print() output is routed to, with the start of a line that is still being written"""
+
+    def __init__(self, job: DownloadJob):
+        self.job = job
+        self.buffers: Dict[int, str] = {}  # Per thread, the job's tracks print from the loop thread and pools at once
+
+
+class JobOutputRouter(io.TextIOBase):
+    """Routes print() output of a running job into its log, also from the SessionLoop and pool threads it uses
+
+    The job is kept in a context variable, which SessionLoop.run() and the ContextThreadPoolExecutors carry over to
+    every coroutine and pool call made for it, so concurrent jobs never mix their lines."""
+    ansi_escape = re.compile(r'\x1b\[[0-9;]*m')
+    current: contextvars.ContextVar = contextvars.ContextVar('job_output', default=None)
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    @classmethod
+    def install(cls):
+        if not isinstance(sys.stdout, cls):
+            sys.stdout = cls(sys.stdout)
+        return sys.stdout
+
+    def attach(self, job: DownloadJob):
+        """Route the output of the calling thread, and everything it starts from now on, into job's log"""
+        return self.current.set(JobOutput(job))
+
+    def detach(self, token=None):
+        output = self.current.get()
+        if output:
+            for buffer in list(output.buffers.values()):
+                self._log(output, buffer)
+            output.buffers.clear()
+        if token is not None:
+            self.current.reset(token)
+        else:
+            self.current.set(None)
+
+    def write(self, text):
+        output = self.current.get()
+        if output is None:
+            return self.stream.write(text)
+
+        thread = threading.get_ident()
+        *lines, output.buffers[thread] = (output.buffers.get(thread, '') + text).split('\n')
+        for line in lines:
+            self._log(output, line)
+        return len(text)
+
+    def _log(self, output: JobOutput, line: str):
+        # Progress bars redraw with carriage returns, only the last state is worth keeping
+        line = self.ansi_escape.sub('', line.split('\r')[-1]).strip()
+        if line:
+            output.job.add_log(line)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class JobScheduler:
+    """Bounded job queue that hands out jobs by priority, round-robin between users, within concurrency caps"""
+
+    def __init__(self, max_running: int = 2, max_queued: int = 500, max_queued_per_user: int = 100,
+                 platform_limit: int = 2, platform_limits: Optional[Dict[str, int]] = None):
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.max_queued_per_user = max_queued_per_user
+        self.platform_limit = platform_limit
+        self.platform_limits = platform_limits or {}
+
+        self.condition = threading.Condition()
+        self.pending: Dict[str, list] = {}  # user_id -> heap of (-priority, sequence, job)
+        self.user_order: List[str] = []  # users with pending jobs, next to be served first
+        self.sequence = itertools.count()
+        self.queued = 0
+        self.running = 0
+        self.running_by_platform = defaultdict(int)
+
+    def _platform_has_capacity(self, platform: str) -> bool:
+        limit = self.platform_limits.get(platform, self.platform_limit)
+        return self.running_by_platform[platform] < limit
+
+    def enqueue(self, job: DownloadJob):
+        user = job.user_id or ""
+        with self.condition:
+            if self.queued >= self.max_queued:
+                raise QueueFullError(f"Job queue is full ({self.max_queued} jobs waiting), try again later")
+            heap = self.pending.setdefault(user, [])
+            if len(heap) >= self.max_queued_per_user:
+                raise UserQueueFullError(f"Too many queued jobs for this user ({self.max_queued_per_user}), try again later")
+
+            if not heap:
+                self.user_order.append(user)
+            heapq.heappush(heap, (-job.priority, next(self.sequence), job))
+            job.queued_at = time.monotonic()
+            self.queued += 1
+            self.condition.notify()
+
+    def _pop_eligible(self) -> Optional[DownloadJob]:
+        if self.running >= self.max_running:
+            return None
+
+        for user in self.user_order:
+            heap = self.pending[user]
+            eligible = [entry for entry in heap if self._platform_has_capacity(entry[2].platform)]
+            if not eligible:
+                continue
+
+            entry = min(eligible)
+            heap.remove(entry)
+            heapq.heapify(heap)
+            # Move the user to the back so other users get the next slot
+            self.user_order.remove(user)
+            if heap:
+                self.user_order.append(user)
+            else:
+                del self.pending[user]
+            return entry[2]
+        return None
+
+    def acquire(self) -> DownloadJob:
+        """Block until a job may start, then reserve its global and platform slot"""
+        with self.condition:
+            while True:
+                job = self._pop_eligible()
+                if job:
+                    self.queued -= 1
+                    self.running += 1
+                    self.running_by_platform[job.platform] += 1
+                    if job.queued_at is not None:
+                        metrics.job_queue_wait_seconds.observe(time.monotonic() - job.queued_at, platform=job.platform)
+                    return job
+                self.condition.wait()
+
+    def release(self, job: DownloadJob):
+        with self.condition:
+            self.running -= 1
+            self.running_by_platform[job.platform] -= 1
+            self.condition.notify_all()
+
+    def discard(self, job: DownloadJob) -> bool:
+        """Take a job out of the queue, False if a worker already picked it up"""
+        user = job.user_id or ""
+        with self.condition:
+            heap = self.pending.get(user, [])
+            entry = next((entry for entry in heap if entry[2] is job), None)
+            if entry is None:
+                return False
+
+            heap.remove(entry)
+            heapq.heapify(heap)
+            if not heap:
+                del self.pending[user]
+                self.user_order.remove(user)
+            self.queued -= 1
+            return True
+
+    def stats(self) -> Dict:
+        with self.condition:
+            return {
+                "queued": self.queued,
+                "running": self.running,
+                "running_by_platform": {k: v for k, v in self.running_by_platform.items() if v},
+            }
+
+
+class JobRetention:
+    """Picks finished jobs to evict: older than max_age_hours, or beyond the newest max_per_user of a user
+
+    Finished jobs are filed in time-ordered buckets of bucket_seconds, so expiry pops whole buckets instead of
+    scanning every job. Each user's finished jobs are kept in completion order for the per-user cap. A limit
+    of 0 disables that rule."""
+
+    def __init__(self, max_age_hours: float = 168, max_per_user: int = 200, bucket_seconds: int = 60):
+        self.max_age_hours = max_age_hours
+        self.max_per_user = max_per_user
+        self.bucket_seconds = bucket_seconds
+
+        self.lock = threading.Lock()
+        self.buckets: Dict[int, List[str]] = {}  # bucket number -> job ids finished in it
+        self.bucket_keys: List[int] = []  # heap of bucket numbers
+        self.by_user: Dict[str, deque] = defaultdict(deque)  # user -> job ids, oldest first
+        self.user_counts: Dict[str, int] = defaultdict(int)
+        self.finished: Dict[str, str] = {}  # job_id -> user of jobs not evicted yet
+        self.over_limit: List[str] = []  # Evicted by the per-user cap, deleted by the next sweep
+        self.evicted = {"age": 0, "per_user": 0}
+
+    def add(self, job_id: str, user_id: Optional[str], finished_at: datetime):
+        user = user_id or ""
+        key = int(finished_at.timestamp() // self.bucket_seconds)
+        with self.lock:
+            if job_id in self.finished:
+                return
+            self.finished[job_id] = user
+            if key not in self.buckets:
+                self.buckets[key] = []
+                heapq.heappush(self.bucket_keys, key)
+            self.buckets[key].append(job_id)
+
+            jobs = self.by_user[user]
+            jobs.append(job_id)
+            self.user_counts[user] += 1
+            while self.max_per_user and self.user_counts[user] > self.max_per_user:
+                oldest = jobs.popleft()
+                if self._forget(oldest):
+                    self.over_limit.append(oldest)
+                    self.evicted["per_user"] += 1
+                    metrics.jobs_evicted_total.inc(reason="per_user")
+
+    def discard(self, job_id: str):
+        """Forget a job that was removed by hand"""
+        with self.lock:
+            self._forget(job_id)
+
+    def _forget(self, job_id: str) -> bool:
+        user = self.finished.pop(job_id, None)
+        if user is None:
+            return False
+        self.user_counts[user] -= 1
+        jobs = self.by_user[user]
+        # Ids of jobs that are gone are dropped lazily, they collect at the old end of the deque
+        while jobs and jobs[0] not in self.finished:
+            jobs.popleft()
+        if not jobs:
+            del self.by_user[user], self.user_counts[user]
+        return True
+
+    def expired(self, now: datetime = None) -> List[str]:
+        """Job ids to delete, both expired by age and evicted by the per-user cap since the last call"""
+        with self.lock:
+            job_ids, self.over_limit = self.over_limit, []
+            if self.max_age_hours:
+                cutoff = int(((now or datetime.now()).timestamp() - self.max_age_hours * 3600) // self.bucket_seconds)
+                while self.bucket_keys and self.bucket_keys[0] < cutoff:
+                    for job_id in self.buckets.pop(heapq.heappop(self.bucket_keys)):
+                        if self._forget(job_id):
+                            job_ids.append(job_id)
+                            self.evicted["age"] += 1
+                            metrics.jobs_evicted_total.inc(reason="age")
+            return job_ids
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {"finished_jobs": len(self.finished), "evicted": dict(self.evicted)}
+
+
+class DownloadWorkerPool:
+    """Long-lived worker threads that each keep a warm Orpheus instance with its loaded modules"""
+
+    def __init__(self, manager, scheduler: JobScheduler):
+        self.manager = manager
+        self.scheduler = scheduler
+        self.threads: List[threading.Thread] = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            JobOutputRouter.install()
+            # One thread per global slot, the scheduler decides which job each of them picks up
+            for i in range(self.scheduler.max_running):
+                thread = threading.Thread(target=self._worker_loop, name=f"orpheus-worker-{i + 1}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _worker_loop(self):
+        orpheus = None
+        while True:
+            job = self.scheduler.acquire()
+            try:
+                if orpheus is None:
+                    try:
+                        # Modules are imported and logged into once per worker, not once per job
+                        orpheus = Orpheus()
+                    except (Exception, SystemExit) as e:
+                        self.manager.fail_job(job, f"Could not initialise Orpheus: {e}")
+                        continue
+
+                self.manager.run_job(job, orpheus)
+            finally:
+                self.scheduler.release(job)
+
+
+class JobManager:
+    def __init__(self, workers: int = 2, store_location: str = os.path.join("config", "jobs.db"),
+                 log_directory: str = os.path.join("config", "job_logs")):
+        self.jobs: Dict[str, DownloadJob] = {}  # Jobs created or recovered by this process
+        self.active_keys: Dict[tuple, DownloadJob] = {}  # Coalescing key -> the active job that downloads it
         self.job_lock = threading.Lock()
+        self.orpheus: Optional[Orpheus] = None  # Resolves job URLs into coalescing keys
+        self.store = JobStore(store_location)
+        self.log_directory = log_directory
+        self.events = JobEventBroker()
+        self.retention = JobRetention()
+        self.sweep_interval = 60
+        self.sweeper: Optional[threading.Thread] = None
+        self.scheduler = JobScheduler(max_running=workers)
+        self.pool = DownloadWorkerPool(self, self.scheduler)
 
-    def create_job(self, job_type: JobType, url: str, platform: str, formats: List[str], user_id: str = None) -> str:
-        job_id = str(uuid.uuid4())
-        job = DownloadJob(job_id, job_type, url, platform, formats, user_id)
+        metrics.jobs_queued.set_function(lambda: self.scheduler.queued)
+        metrics.jobs_running.set_function(
+            lambda: {(platform,): count for platform, count in list(self.scheduler.running_by_platform.items())})
+        metrics.download_speed_bytes.set_function(self.download_speed)
+
+    def configure(self, settings: dict, orpheus: Orpheus = None):
+        """Apply the global "jobs" settings, must be called before the first job is started
+
+        With an Orpheus instance jobs are coalesced by the media they resolve to, otherwise by their URL."""
+        self.orpheus = orpheus or self.orpheus
+        scheduler = self.scheduler
+        scheduler.max_running = max(1, int(settings.get("workers", scheduler.max_running)))
+        scheduler.max_queued = int(settings.get("max_queued_jobs", scheduler.max_queued))
+        scheduler.max_queued_per_user = int(settings.get("max_queued_jobs_per_user", scheduler.max_queued_per_user))
+        scheduler.platform_limit = int(settings.get("platform_limit", scheduler.platform_limit))
+        scheduler.platform_limits = {k.lower(): int(v) for k, v in settings.get("platform_limits", {}).items()}
+        self.retention.max_age_hours = float(settings.get("finished_job_retention_hours", self.retention.max_age_hours))
+        self.retention.max_per_user = int(settings.get("max_finished_jobs_per_user", self.retention.max_per_user))
+
+    def start_retention(self):
+        """Load finished jobs into the retention policy and start the background sweeper"""
+        if self.sweeper:
+            return
+        for data in self.store.list_finished_jobs([status.value for status in FINISHED_STATUSES]):
+            self.retention.add(data["job_id"], data["user_id"], datetime.fromisoformat(data["completed_at"]))
+        self.sweeper = threading.Thread(target=self._sweep_loop, name="orpheus-job-sweeper", daemon=True)
+        self.sweeper.start()
+
+    def _sweep_loop(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Job retention sweep failed: {e}")
+            time.sleep(self.sweep_interval)
 
+    def sweep(self) -> int:
+        """Delete the finished jobs, and their logs, that the retention policy evicted"""
+        job_ids = self.retention.expired()
+        if not job_ids:
+            return 0
+        self._delete_jobs(job_ids)
+        return len(job_ids)
+
+    def _delete_jobs(self, job_ids: List[str]):
+        with self.job_lock:
+            for job_id in job_ids:
+                self.jobs.pop(job_id, None)
+        self.store.delete_jobs(job_ids)
+        for job_id in job_ids:
+            JobLog(os.path.join(self.log_directory, f"{job_id}.log.gz")).delete()
+
+    def _job_finished(self, job: DownloadJob):
+        """Hand a finished job, and the jobs sharing its download, over to the retention policy"""
+        with self.job_lock:
+            self.jobs.pop(job.job_id, None)
+            if self.active_keys.get(job.coalesce_key) is job:
+                del self.active_keys[job.coalesce_key]
+            followers, job.followers = job.followers, []
+        if not job.detached:  # A detached job was handed over when it was cancelled
+            self.retention.add(job.job_id, job.user_id, job.completed_at or datetime.now())
+            metrics.jobs_finished_total.inc(platform=job.platform, status=job.status.value)
+        for follower in followers:
+            follower.add_log(f"Shared download of job {job.job_id} {job.status.value}")
+            follower.mirror(job)
+            self._job_finished(follower)
+
+    def coalesce_key(self, url: str) -> tuple:
+        """Normalised (platform, media type, media id, quality) of a URL, active jobs with equal keys share a download"""
+        url = url.strip()
+        if not self.orpheus:
+            return None, None, url, None
+        quality = self.orpheus.settings['global']['general']['download_quality']
+        service_name = self.orpheus.netloc_router.resolve(urlparse(url).netloc)
+        if service_name and service_name not in self.orpheus.loaded_modules and \
+                self.orpheus.module_settings[service_name].url_decoding is ManualEnum.manual:
+            return service_name, None, url, quality  # Parsing would import the module and log in, on submit
+        try:
+            media = [(service_name, item) for service_name, items in parse_media_urls(self.orpheus, [url]).items()
+                     for item in items]
+        except Exception:
+            media = []  # Left for the download to report
+        if len(media) != 1:
+            return None, None, url, quality
+        service_name, item = media[0]
+        return service_name, item.media_type.name, str(item.media_id), quality
+
+    def _register(self, job: DownloadJob):
+        """Keep an active job in memory, a job for media another active job downloads becomes its follower"""
+        job.coalesce_key = self.coalesce_key(job.url)
         with self.job_lock:
-            self.jobs[job_id] = job
+            self.jobs[job.job_id] = job
+            primary = self.active_keys.setdefault(job.coalesce_key, job)
+            if primary is not job:
+                primary.followers.append(job)
+            job.coalesced_with = primary.job_id if primary is not job else None
+
+    def create_job(self, job_type: JobType, url: str, platform: str, formats: List[str], user_id: str = None,
+                   priority: int = 0) -> str:
+        job_id = str(uuid.uuid4())
+        job = DownloadJob(job_id, job_type, url, platform.lower(), formats, user_id, priority)
+        self._attach(job)
+        self._register(job)
+        job.save()
 
         job.add_log(f"Job created for {job_type.value}: {url}")
         return job_id
 
+    def _attach(self, job: DownloadJob):
+        job.store, job.events = self.store, self.events
+        job.log = JobLog(os.path.join(self.log_directory, f"{job.job_id}.log.gz"))
+
+    def migrate_legacy_logs(self):
+        """Move log lines from the job_logs table of earlier versions into per-job log files"""
+        for job_id, rows in self.store.get_legacy_logs().items():
+            log = JobLog(os.path.join(self.log_directory, f"{job_id}.log.gz"))
+            log.delete()
+            log.write(LogEntry(row["seq"], row["timestamp"], row["level"], row["message"]) for row in rows)
+        self.store.drop_legacy_logs()
+
     def get_job(self, job_id: str) -> Optional[DownloadJob]:
         with self.job_lock:
-            return self.jobs.get(job_id)
+            job = self.jobs.get(job_id)
+        if job:
+            return job
 
-    def get_all_jobs(self, user_id: str = None) -> List[Dict]:
+        data = self.store.get_job(job_id)
+        if not data:
+            return None
+        job = DownloadJob.from_dict(data)
+        self._attach(job)
+        return job
+
+    def get_all_jobs(self, user_id: str = None, status: str = None, limit: int = 100, offset: int = 0) -> List[Dict]:
+        """One page of jobs, newest first, read from the store's indexes"""
+        rows = self.store.list_jobs(user_id, [status] if status else None, limit, offset)
         with self.job_lock:
-            jobs = list(self.jobs.values())
-            if user_id:
-                jobs = [job for job in jobs if job.user_id == user_id]
-            return [job.to_dict() for job in jobs]
+            live = {row["job_id"]: self.jobs.get(row["job_id"]) for row in rows}
+        # Running jobs have fresher progress in memory than in their last saved row
+        return [live[row["job_id"]].to_dict() if live[row["job_id"]] else row for row in rows]
 
-    def get_job_logs(self, job_id: str) -> List[Dict]:
+    def count_jobs(self, user_id: str = None, status: str = None) -> int:
+        return self.store.count_jobs(user_id, [status] if status else None)
+
+    def get_job_logs(self, job_id: str, since: int = 0, limit: Optional[int] = None,
+                     tail: Optional[int] = None) -> Optional[List[Dict]]:
+        """Log lines after the since cursor, paged by limit or only the last tail lines"""
         job = self.get_job(job_id)
-        return job.logs if job else []
+        if not job:
+            return None
+        return job.log.read(since, limit, tail)
 
     def clear_completed_jobs(self) -> int:
-        """Clear all completed and failed jobs, return count of cleared jobs"""
-        with self.job_lock:
-            jobs_to_remove = []
-            for job_id, job in self.jobs.items():
-                if job.status in [JobStatus.COMPLETED, JobStatus.FAILED]:
-                    jobs_to_remove.append(job_id)
+        """Clear all completed, failed and cancelled jobs, return count of cleared jobs"""
+        job_ids = self.store.delete_jobs_with_status([status.value for status in FINISHED_STATUSES])
+        for job_id in job_ids:
+            self.retention.discard(job_id)
+            JobLog(os.path.join(self.log_directory, f"{job_id}.log.gz")).delete()
+        return len(job_ids)
 
-            for job_id in jobs_to_remove:
-                del self.jobs[job_id]
+    def recover_jobs(self) -> int:
+        """Re-enqueue jobs that were queued or running when the previous process stopped"""
+        recovered = 0
+        for data in self.store.list_jobs(statuses=[JobStatus.QUEUED.value, JobStatus.RUNNING.value], limit=-1):
+            job = DownloadJob.from_dict(data)
+            self._attach(job)
+            # Lines spilled after the last save are on disk, continue numbering after them
+            job.logs_count = max(job.logs_count, job.log.last_seq())
+            job.finished_tracks = set(self.store.get_finished_tracks(job.job_id))
+            if job.status is JobStatus.RUNNING:
+                job.add_log("Job was interrupted by a restart, re-queueing", "WARNING")
+            job.status = JobStatus.QUEUED
+            job.started_at = None
+            job.worker_name = None
+            self._register(job)
+            job.save()
 
-            return len(jobs_to_remove)
+            try:
+                self.start_download_job(job.job_id)
+                recovered += 1
+            except QueueFullError as e:
+                self.fail_job(job, str(e))
+        return recovered
 
     def start_download_job(self, job_id: str):
-        """Start a download job in the background"""
+        """Queue a download job for the worker pool, raises QueueFullError when there is no room"""
+        job = self.get_job(job_id)
+        if not job:
+            return
+        if job.coalesced_with:
+            job.add_log(f"Job {job.coalesced_with} is already downloading the same media, sharing its download")
+            return
 
-        def run_download():
-            job = self.get_job(job_id)
-            if not job:
+        self.pool.start()
+        try:
+            self.scheduler.enqueue(job)
+        except QueueFullError:
+            with self.job_lock:
+                self.jobs.pop(job_id, None)
+            self.store.delete_jobs([job_id])
+            self._hand_over(job)
+            raise
+        job.add_log(f"Job queued with priority {job.priority}")
+
+    def _hand_over(self, job: DownloadJob):
+        """Let the first follower of a job that will not run download the media for the other followers"""
+        with self.job_lock:
+            if self.active_keys.get(job.coalesce_key) is job:
+                del self.active_keys[job.coalesce_key]
+            followers, job.followers = job.followers, []
+            if not followers:
                 return
+            successor = followers[0]
+            successor.followers = followers[1:]
+            successor.coalesced_with = None
+            for follower in successor.followers:
+                follower.coalesced_with = successor.job_id
+            self.active_keys[job.coalesce_key] = successor
 
-            try:
-                job.status = JobStatus.RUNNING
-                job.started_at = datetime.now()
-                job.add_log("Starting download...")
+        successor.add_log(f"Job {job.job_id} stopped before it started, this job downloads the media instead")
+        successor.save()
+        try:
+            self.scheduler.enqueue(successor)
+        except QueueFullError as e:
+            self.fail_job(successor, str(e))
+
+    def download_speed(self) -> int:
+        """Combined throughput of the running jobs in bytes per second"""
+        with self.job_lock:
+            jobs = list(self.jobs.values())
+        return sum(job.speed for job in jobs if job.status is JobStatus.RUNNING and not job.coalesced_with)
+
+    def get_queue_stats(self) -> Dict:
+        return {**self.scheduler.stats(), "retention": self.retention.stats()}
+
+    def cancel_job(self, job_id: str) -> bool:
+        """Cancel a queued job, or make a running one stop at its next chunk or track and remove its partial files"""
+        job = self.get_job(job_id)
+        if not job or job.status not in (JobStatus.QUEUED, JobStatus.RUNNING):
+            return False
 
-                # Path to the orpheus.py script
-                orpheus_script_path = os.path.join(os.getcwd(), "orpheus.py")
+        if job.coalesced_with:
+            # Only this job stops waiting, the shared download goes on unless nobody is left waiting for it
+            with self.job_lock:
+                primary = self.active_keys.get(job.coalesce_key)
+                if primary and job in primary.followers:
+                    primary.followers.remove(job)
+                abandoned = primary is not None and primary.detached and not primary.followers
+            if abandoned:
+                primary.cancel_event.set()
+            self.mark_cancelled(job)
+            return True
+        if job.status is JobStatus.QUEUED and self.scheduler.discard(job):
+            self._hand_over(job)
+            self.mark_cancelled(job)
+            return True
+        with self.job_lock:
+            shared = bool(job.followers)
+        if shared:
+            self._detach(job)
+            return True
+        # Already handed to a worker, run_job finishes the cancellation
+        job.cancel_event.set()
+        job.add_log("Cancellation requested", "WARNING")
+        return True
 
-                if not os.path.exists(orpheus_script_path):
-                    raise Exception(f"orpheus.py script not found at {orpheus_script_path}")
+    def _detach(self, job: DownloadJob):
+        """Cancel a running job for its own user while its download goes on for the jobs sharing it"""
+        completed_at = datetime.now()
+        job.add_log(f"Job cancelled, the download goes on for {len(job.followers)} jobs sharing it", "WARNING")
+        with job.progress_lock:
+            data = {**job.to_dict(), "status": JobStatus.CANCELLED.value, "completed_at": completed_at.isoformat(),
+                    "eta": None}
+            finished_tracks = set(job.finished_tracks)
+        job.detached = True  # From now on its saves only update the followers
+        job.log.flush()
+        self.store.save_job(data, finished_tracks)
+        self.events.publish("job", data)
+        with self.job_lock:
+            self.jobs.pop(job.job_id, None)
+        self.retention.add(job.job_id, job.user_id, completed_at)
+        metrics.jobs_finished_total.inc(platform=job.platform, status=JobStatus.CANCELLED.value)
 
-                # Simply run orpheus.py with the URL - formats are configured in OrpheusManager config
-                job.add_log(f"Starting download for {job.job_type.value}")
-                job.add_log(f"URL: {job.url}")
-                job.add_log("Note: Formats are configured in OrpheusManager config folder")
+    def retry_job(self, job_id: str) -> Optional[str]:
+        """Queue a new job for a failed or cancelled one, skipping the tracks it already finished"""
+        job = self.get_job(job_id)
+        if not job or job.status not in (JobStatus.FAILED, JobStatus.CANCELLED):
+            return None
 
-                # Build simple command with just the URL
-                cmd = ["python", orpheus_script_path, job.url]
+        new_job_id = self.create_job(job.job_type, job.url, job.platform, job.formats, job.user_id, job.priority)
+        new_job = self.get_job(new_job_id)
+        new_job.finished_tracks = set(self.store.get_finished_tracks(job_id))
+        new_job.add_log(f"Retry of job {job_id}, skipping {len(new_job.finished_tracks)} finished tracks")
+        new_job.save()
+        self.start_download_job(new_job_id)
+        return new_job_id
 
-                job.add_log(f"Running command: {' '.join(cmd)}")
+    def remove_job(self, job_id: str) -> bool:
+        """Remove a finished job and its logs, active jobs have to be cancelled first"""
+        job = self.get_job(job_id)
+        if not job or job.status in (JobStatus.QUEUED, JobStatus.RUNNING):
+            return False
 
-                # Start the process
-                process = subprocess.Popen(
-                    cmd,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                    cwd=os.getcwd()
-                )
+        with self.job_lock:
+            self.jobs.pop(job_id, None)
+        self.retention.discard(job_id)
+        job.log.delete()
+        return self.store.delete_jobs([job_id]) > 0
 
-                job.process = process
+    def mark_cancelled(self, job: DownloadJob):
+        job.status = JobStatus.CANCELLED
+        job.completed_at = datetime.now()
+        job.eta = None
+        job.add_log("Job cancelled", "WARNING")
+        job.save()
+        self._job_finished(job)
 
-                # Monitor the process
-                stdout, stderr = process.communicate()
+    def fail_job(self, job: DownloadJob, error_message: str):
+        job.status = JobStatus.FAILED
+        job.completed_at = datetime.now()
+        job.error_message = error_message
+        job.add_log(f"Job failed: {error_message}", "ERROR")
+        job.save()
+        self._job_finished(job)
 
-                if process.returncode == 0:
-                    job.add_log("Download completed successfully")
-                    job.add_log(f"Output: {stdout}")
+    def run_job(self, job: DownloadJob, orpheus: Orpheus):
+        """Run a job on the calling worker thread using its warm Orpheus instance"""
+        output = JobOutputRouter.install()
+        if job.cancel_event.is_set():
+            self.mark_cancelled(job)
+            return
 
-                    # Try to extract file path from output
-                    if "Downloaded to:" in stdout:
-                        file_path = stdout.split("Downloaded to:")[-1].strip()
-                        job.file_paths.append(file_path)
-                        job.add_log(f"File saved to: {file_path}")
+        started = time.monotonic()
+        try:
+            job.status = JobStatus.RUNNING
+            job.started_at = datetime.now()
+            job.worker_name = threading.current_thread().name
+            job.reset_progress()
+            job.save()
+            job.add_log(f"Starting download for {job.job_type.value} on {job.worker_name}")
+            job.add_log(f"URL: {job.url}")
 
-                    # Look for other common output patterns that indicate successful download
-                    if "Download completed" in stdout or "Successfully downloaded" in stdout:
-                        job.add_log("Download verification: Success indicators found in output")
+            output_token = output.attach(job)
+            try:
+                media_to_download = parse_media_urls(orpheus, [job.url])
+                path = orpheus.settings['global']['general']['download_path']
+                if path[-1] == '/': path = path[:-1]
+                os.makedirs(path, exist_ok=True)
 
-                else:
-                    job.add_log("Download failed", "ERROR")
-                    job.add_log(f"Error output: {stderr}", "ERROR")
-                    job.add_log(f"Return code: {process.returncode}", "ERROR")
-                    raise Exception(f"Download process failed with return code {process.returncode}: {stderr}")
+                orpheus_core_download(orpheus, media_to_download, get_third_party_modules(orpheus), 'default', path,
+                                      use_ansi_colors=False, cleanup_temp=False, progress_callback=job.handle_progress,
+                                      cancel_event=job.cancel_event, skip_tracks=job.finished_tracks)
+            finally:
+                output.detach(output_token)
 
-                job.status = JobStatus.COMPLETED
-                job.completed_at = datetime.now()
-                job.progress = 100
-                job.add_log("Job completed successfully")
+            job.status = JobStatus.COMPLETED
+            job.completed_at = datetime.now()
+            job.progress = 100
+            job.eta = None
+            job.add_log("Job completed successfully")
+            job.save()
+            self._job_finished(job)
 
-            except Exception as e:
-                job.status = JobStatus.FAILED
-                job.completed_at = datetime.now()
-                job.error_message = str(e)
-                job.add_log(f"Job failed: {str(e)}", "ERROR")
-
-        # Start the download in a separate thread
-        thread = threading.Thread(target=run_download)
-        thread.daemon = True
-        thread.start()
+        except DownloadCancelled:
+            self.mark_cancelled(job)
+        except (Exception, SystemExit) as e:
+            self.fail_job(job, str(e))
+        finally:
+            metrics.job_duration_seconds.observe(time.monotonic() - started, platform=job.platform,
+                                                 status=job.status.value)
 
 
 # Global job manager instance
@@ -0,0 +1,190 @@
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional
+
+
+class JobStore:
+    """Durable SQLite (WAL mode) storage for download jobs, their logs are kept by job_log.JobLog"""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            job_type TEXT NOT NULL,
+            url TEXT NOT NULL,
+            platform TEXT,
+            formats TEXT,
+            user_id TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            completed_at TEXT,
+            error_message TEXT,
+            progress INTEGER NOT NULL DEFAULT 0,
+            worker_name TEXT,
+            file_paths TEXT,
+            logs_count INTEGER NOT NULL DEFAULT 0,
+            tracks_total INTEGER NOT NULL DEFAULT 0,
+            tracks_completed INTEGER NOT NULL DEFAULT 0,
+            tracks_skipped INTEGER NOT NULL DEFAULT 0,
+            tracks_failed INTEGER NOT NULL DEFAULT 0,
+            bytes_downloaded INTEGER NOT NULL DEFAULT 0,
+            finished_tracks TEXT,
+            coalesced_with TEXT
+        );
+        CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+        CREATE INDEX IF NOT EXISTS jobs_user_created ON jobs (user_id, created_at);
+        CREATE INDEX IF NOT EXISTS jobs_created ON jobs (created_at);
+    """
+
+    # Columns added after the first release of the schema, created on databases that predate them
+    added_columns = {
+        "tracks_total": "INTEGER NOT NULL DEFAULT 0",
+        "tracks_completed": "INTEGER NOT NULL DEFAULT 0",
+        "tracks_skipped": "INTEGER NOT NULL DEFAULT 0",
+        "tracks_failed": "INTEGER NOT NULL DEFAULT 0",
+        "bytes_downloaded": "INTEGER NOT NULL DEFAULT 0",
+        "finished_tracks": "TEXT",
+        "coalesced_with": "TEXT",
+    }
+
+    def __init__(self, location: str):
+        directory = os.path.dirname(location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.location = location
+        self.lock = threading.Lock()
+        # Shared by the API and worker threads, every use is serialised by self.lock
+        self.connection = sqlite3.connect(location, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.schema)
+        self._migrate()
+
+    def _migrate(self):
+        existing = {row["name"] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        for column, definition in self.added_columns.items():
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    def save_job(self, job: Dict, finished_tracks: Iterable[str] = None):
+        """Insert or update a job from its to_dict() representation and the ids of its finished tracks"""
+        row = dict(job)
+        row["formats"] = json.dumps(row.get("formats") or [])
+        row["file_paths"] = json.dumps(row.get("file_paths") or [])
+        row["finished_tracks"] = json.dumps(sorted(finished_tracks or []))
+        with self.lock:
+            self.connection.execute("""
+                INSERT INTO jobs (job_id, job_type, url, platform, formats, user_id, priority, status, created_at,
+                                  started_at, completed_at, error_message, progress, worker_name, file_paths, logs_count,
+                                  tracks_total, tracks_completed, tracks_skipped, tracks_failed, bytes_downloaded,
+                                  finished_tracks, coalesced_with)
+                VALUES (:job_id, :job_type, :url, :platform, :formats, :user_id, :priority, :status, :created_at,
+                        :started_at, :completed_at, :error_message, :progress, :worker_name, :file_paths, :logs_count,
+                        :tracks_total, :tracks_completed, :tracks_skipped, :tracks_failed, :bytes_downloaded,
+                        :finished_tracks, :coalesced_with)
+                ON CONFLICT (job_id) DO UPDATE SET
+                    status = excluded.status, started_at = excluded.started_at, completed_at = excluded.completed_at,
+                    error_message = excluded.error_message, progress = excluded.progress,
+                    worker_name = excluded.worker_name, file_paths = excluded.file_paths,
+                    logs_count = excluded.logs_count, tracks_total = excluded.tracks_total,
+                    tracks_completed = excluded.tracks_completed, tracks_skipped = excluded.tracks_skipped,
+                    tracks_failed = excluded.tracks_failed, bytes_downloaded = excluded.bytes_downloaded,
+                    finished_tracks = excluded.finished_tracks, coalesced_with = excluded.coalesced_with
+            """, row)
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        del job["finished_tracks"]  # Only needed to resume a job, see get_finished_tracks
+        job["formats"] = json.loads(job["formats"] or "[]")
+        job["file_paths"] = json.loads(job["file_paths"] or "[]")
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def get_finished_tracks(self, job_id: str) -> List[str]:
+        """Ids of the tracks a job downloaded or found already downloaded"""
+        with self.lock:
+            row = self.connection.execute("SELECT finished_tracks FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0] or "[]") if row else []
+
+    def list_jobs(self, user_id: str = None, statuses: Iterable[str] = None, limit: int = 100,
+                  offset: int = 0) -> List[Dict]:
+        """Newest jobs first, served from the status/user/created_at indexes"""
+        where, params = self._filters(user_id, statuses)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT * FROM jobs {where} ORDER BY created_at DESC LIMIT ? OFFSET ?", (*params, limit, offset)
+            ).fetchall()
+        return [self._row_to_job(row) for row in rows]
+
+    def list_finished_jobs(self, statuses: Iterable[str]) -> List[Dict]:
+        """job_id, user_id and completed_at of finished jobs, oldest first"""
+        where, params = self._filters(statuses=statuses)
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT job_id, user_id, COALESCE(completed_at, created_at) AS completed_at FROM jobs {where} "
+                "ORDER BY completed_at", params
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count_jobs(self, user_id: str = None, statuses: Iterable[str] = None) -> int:
+        where, params = self._filters(user_id, statuses)
+        with self.lock:
+            return self.connection.execute(f"SELECT COUNT(*) FROM jobs {where}", params).fetchone()[0]
+
+    @staticmethod
+    def _filters(user_id: str = None, statuses: Iterable[str] = None):
+        clauses, params = [], []
+        if user_id:
+            clauses.append("user_id = ?")
+            params.append(user_id)
+        if statuses:
+            statuses = list(statuses)
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def get_legacy_logs(self) -> Dict[str, List[Dict]]:
+        """Log lines in the job_logs table used by earlier versions, by job id"""
+        with self.lock:
+            if not self.connection.execute(
+                    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'job_logs'").fetchone():
+                return {}
+            logs = {}
+            for row in self.connection.execute(
+                    "SELECT job_id, seq, timestamp, level, message FROM job_logs ORDER BY job_id, seq"):
+                logs.setdefault(row["job_id"], []).append(dict(row))
+        return logs
+
+    def drop_legacy_logs(self):
+        with self.lock:
+            self.connection.execute("DROP TABLE IF EXISTS job_logs")
+
+    def delete_jobs_with_status(self, statuses: Iterable[str]) -> List[str]:
+        """Delete every job in one of the given statuses, returns the deleted job ids"""
+        where, params = self._filters(statuses=statuses)
+        with self.lock:
+            job_ids = [row[0] for row in self.connection.execute(f"SELECT job_id FROM jobs {where}", params)]
+        self.delete_jobs(job_ids)
+        return job_ids
+
+    def delete_jobs(self, job_ids: Iterable[str]) -> int:
+        job_ids = [(job_id,) for job_id in job_ids]
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                deleted = self.connection.executemany("DELETE FROM jobs WHERE job_id = ?", job_ids).rowcount
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+        return deleted
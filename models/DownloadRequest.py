@@ -1,7 +1,11 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
 class DownloadRequest(BaseModel):
     url: str
     platform: str
-    type: str
\ No newline at end of file
+    type: str
+    user_id: Optional[str] = None
+    priority: int = 0
\ No newline at end of file
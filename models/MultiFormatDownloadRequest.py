@@ -8,4 +8,5 @@ class MultiFormatDownloadRequest(BaseModel):
     platform: str
     type: str  # "track" or "album"
     formats: List[str] = ["configured"]  # Placeholder - formats come from config
-    user_id: Optional[str] = None
\ No newline at end of file
+    user_id: Optional[str] = None
+    priority: int = 0  # Higher runs first among the same user's queued jobs
\ No newline at end of file
@@ -206,84 +206,24 @@ def main():
                 print(f'Download must be done as orpheus.py [download] [module] [{media_types}] [media ID 1] [media ID 2] ...')
                 exit() # TODO: replace with InvalidInput
         else:  # if no specific modes are detected, parse as urls, but first try loading as a list of URLs
-            arguments = tuple(open(args.arguments[0], 'r')) if len(args.arguments) == 1 and os.path.exists(args.arguments[0]) else args.arguments
-            # Strip whitespace from lines read from file
-            if isinstance(arguments, tuple) and len(args.arguments) == 1 and os.path.exists(args.arguments[0]):
-                arguments = tuple(line.strip() for line in arguments if line.strip()) # Also filter out empty lines
-            
-            media_to_download = {}
-            for link in arguments:
-                link = link.strip() # Ensure individual link is also stripped if coming from args
-                if not link: # Skip empty lines that might still be present if not from file
-                    continue
-
-                if link.startswith('http'):
-                    url = urlparse(link)
-                    components = url.path.split('/')
-
-                    service_name = None
-                    for i in orpheus.module_netloc_constants:
-                        if re.findall(i, url.netloc): service_name = orpheus.module_netloc_constants[i]
-                    if not service_name:
-                        raise Exception(f'URL location "{url.netloc}" is not found in modules!')
-                    if service_name not in media_to_download: media_to_download[service_name] = []
-
-                    if orpheus.module_settings[service_name].url_decoding is ManualEnum.manual:
-                        module = orpheus.load_module(service_name)
-                        media_to_download[service_name].append(module.custom_url_parse(link))
-                    else:
-                        if not components or len(components) <= 2:
-                            print(f'\tInvalid URL: "{link}"')
-                            exit() # TODO: replace with InvalidInput
-                        
-                        url_constants = orpheus.module_settings[service_name].url_constants
-                        if not url_constants:
-                            url_constants = {
-                                'track': DownloadTypeEnum.track,
-                                'album': DownloadTypeEnum.album,
-                                'playlist': DownloadTypeEnum.playlist,
-                                'artist': DownloadTypeEnum.artist
-                            }
-
-                        type_matches = [media_type for url_check, media_type in url_constants.items() if url_check in components]
-
-                        if not type_matches:
-                            print(f'Invalid URL: "{link}"')
-                            exit()
-
-                        media_to_download[service_name].append(MediaIdentification(media_type=type_matches[-1], media_id=components[-1]))
+            try:
+                if len(args.arguments) == 1 and os.path.exists(args.arguments[0]):
+                    with open(args.arguments[0], 'r') as f:  # Parsed line by line, empty lines are skipped
+                        media_to_download = parse_media_urls(orpheus, f)
                 else:
-                    raise Exception(f'Invalid argument: "{link}"')
+                    media_to_download = parse_media_urls(orpheus, args.arguments)
+            except InvalidInput as e:
+                print(f'\t{e}')
+                exit()
 
         # Prepare the third-party modules similar to above
-        tpm = {ModuleModes.covers: '', ModuleModes.lyrics: '', ModuleModes.credits: ''}
-        for i in tpm:
-            moduleselected = getattr(args, i.name).lower()
-            if moduleselected == 'default':
-                moduleselected = orpheus.settings['global']['module_defaults'][i.name]
-            if moduleselected == 'default':
-                moduleselected = None
-            tpm[i] = moduleselected
+        tpm = get_third_party_modules(orpheus, {i: getattr(args, i.name) for i in (ModuleModes.covers, ModuleModes.lyrics, ModuleModes.credits)})
         sdm = args.separatedownload.lower()
 
         if not media_to_download:
             print('No links given')
 
-        # Beatport quality workaround: high and low quality fail, fallback to lossless FLAC
-        original_quality = None
-        beatport_quality_override = False
-        if 'beatport' in media_to_download and orpheus.settings['global']['general']['download_quality'] in ['high', 'low']:
-            original_quality = orpheus.settings['global']['general']['download_quality']
-            orpheus.settings['global']['general']['download_quality'] = 'lossless'
-            beatport_quality_override = True
-            print(f' Beatport: Automatically switching from "{original_quality}" to "lossless" quality')
-
-        try:
-            orpheus_core_download(orpheus, media_to_download, tpm, sdm, path)
-        finally:
-            # Restore original quality setting if we overrode it
-            if beatport_quality_override and original_quality:
-                orpheus.settings['global']['general']['download_quality'] = original_quality
+        orpheus_core_download(orpheus, media_to_download, tpm, sdm, path)
 
 
 if __name__ == "__main__":
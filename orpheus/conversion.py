@@ -0,0 +1,109 @@
+import os
+import subprocess
+import threading
+import time
+
+import ffmpeg
+
+from utils import metrics
+from utils.exceptions import DownloadCancelled
+from utils.utils import ContextThreadPoolExecutor
+
+
+class ConversionExecutor:
+    """Process-wide queue of ffmpeg conversions, run by one worker per CPU core
+
+    Every conversion is its own ffmpeg process, so worker threads are enough to keep all cores busy while the
+    downloaders' own threads stay free for API calls and file work. Submitting blocks while max_pending
+    conversions are already waiting, and a conversion whose cancel_event is set is dropped from the queue or has
+    its ffmpeg process killed."""
+
+    poll_interval = 0.25
+
+    def __init__(self, workers: int = 0, max_pending: int = 0):
+        self.workers = workers or os.cpu_count() or 2
+        self.max_pending = max_pending or self.workers * 2
+        self.slots = threading.BoundedSemaphore(self.workers + self.max_pending)
+        self.pool = ContextThreadPoolExecutor(self.workers, thread_name_prefix='orpheus-ffmpeg')
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+
+    def _wait(self, cancel_event):
+        while not self.slots.acquire(timeout=self.poll_interval):
+            if cancel_event and cancel_event.is_set():
+                raise DownloadCancelled()
+
+    def run(self, stream, cancel_event: threading.Event = None, audio_seconds: float = None, codec: str = ''):
+        """Run an ffmpeg-python output stream, blocking the caller until it has finished
+
+        Raises ffmpeg.Error like stream.run(), or DownloadCancelled once cancel_event is set. audio_seconds, the
+        length of the track, is used to report the conversion speed as a real-time factor."""
+        self._wait(cancel_event)
+        with self.lock:
+            self.queued += 1
+        queued_at = time.perf_counter()
+        try:
+            future = self.pool.submit(self._run, stream, cancel_event, queued_at, audio_seconds, codec)
+        except BaseException:
+            self._dequeue()
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def _dequeue(self):
+        with self.lock:
+            self.queued -= 1
+
+    def _run(self, stream, cancel_event, queued_at, audio_seconds, codec):
+        self._dequeue()
+        metrics.conversion_queue_seconds.observe(time.perf_counter() - queued_at)
+        if cancel_event and cancel_event.is_set():
+            raise DownloadCancelled()
+
+        with self.lock:
+            self.running += 1
+        started = time.perf_counter()
+        try:
+            process = stream.run_async(pipe_stdout=True, pipe_stderr=True)
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=self.poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    if cancel_event and cancel_event.is_set():
+                        process.kill()
+                        process.communicate()
+                        raise DownloadCancelled()
+            if process.returncode:
+                raise ffmpeg.Error('ffmpeg', stdout, stderr)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+        elapsed = time.perf_counter() - started
+        metrics.conversion_seconds.observe(elapsed, codec=codec)
+        if audio_seconds and elapsed > 0:
+            metrics.converted_audio_seconds_total.inc(audio_seconds, codec=codec)
+            metrics.conversion_realtime_factor.observe(audio_seconds / elapsed, codec=codec)
+        return stdout, stderr
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'queued': self.queued, 'running': self.running}
+
+
+conversion_executor = None
+conversion_executor_lock = threading.Lock()
+
+
+def get_conversion_executor(workers: int = 0) -> ConversionExecutor:
+    """The process-wide ConversionExecutor, sized by the first caller, 0 workers means one per CPU core"""
+    global conversion_executor
+    with conversion_executor_lock:
+        if conversion_executor is None:
+            conversion_executor = ConversionExecutor(int(workers or 0))
+            metrics.conversions_queued.set_function(lambda: conversion_executor.stats()['queued'])
+            metrics.conversions_running.set_function(lambda: conversion_executor.stats()['running'])
+        return conversion_executor
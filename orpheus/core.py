@@ -1,10 +1,13 @@
-import importlib, json, logging, os, pickle, requests, urllib3, base64, shutil
+import importlib, json, logging, os, pickle, re, requests, urllib3, base64, shutil, hashlib, threading, uuid
 from datetime import datetime
+from urllib.parse import urlparse
 
+from orpheus.module_manifest import ModuleManifest
 from orpheus.music_downloader import Downloader
 from utils.models import *
 from utils.utils import *
 from utils.exceptions import *
+from utils import metrics
 
 os.environ['CURL_CA_BUNDLE'] = ''  # Hack to disable SSL errors for requests module for easier debugging
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)  # Make SSL warnings hidden
@@ -28,10 +31,24 @@ def true_current_utc_timestamp():
     return int(datetime.utcnow().timestamp()) + timestamp_correction_term
 
 
+def bearer_expiry(bearer: str):
+    """The exp timestamp of an enable_jwt_system bearer token, None if it can't be read"""
+    for part in bearer.split('.')[:2]:
+        try:
+            expiry = json.loads(base64.urlsafe_b64decode(part + '=' * (-len(part) % 4)))['exp']
+        except Exception:
+            continue
+        if isinstance(expiry, (int, float)):
+            return expiry
+    return None
+
+
 class Orpheus:
     def __init__(self, private_mode=False):
         self.extensions, self.extension_list, self.module_list, self.module_settings, self.module_netloc_constants, self.loaded_modules = {}, set(), set(), {}, {}, {}
         self.gui_handlers = {}
+        self.extension_interfaces = {}  # Imported once, for both the settings and the extension class
+        self.module_locks, self.module_locks_lock = {}, threading.Lock()
 
         self.default_global_settings = {
             "general": {
@@ -75,13 +92,23 @@ class Orpheus:
                 "external_format": 'png',
                 "external_compression": "low",
                 "external_resolution": 3000,
-                "save_animated_cover": True
+                "save_animated_cover": True,
+                "cache_size": 256
             },
             "playlist": {
                 "save_m3u": True,
                 "paths_m3u": "absolute",
                 "extended_m3u": True
             },
+            "jobs": {
+                "workers": 2,
+                "max_queued_jobs": 500,
+                "max_queued_jobs_per_user": 100,
+                "platform_limit": 2,
+                "platform_limits": {},
+                "finished_job_retention_hours": 168,
+                "max_finished_jobs_per_user": 200
+            },
             "advanced": {
                 "advanced_login_system": False,
                 "codec_conversions": {
@@ -101,6 +128,10 @@ class Orpheus:
                     }
                 },
                 "conversion_keep_original": False,
+                "conversion_workers": 0,
+                "stream_conversion": False,
+                "download_connections": 1,
+                "module_warmup": False,
                 "ffmpeg_path": "ffmpeg",
                 "cover_variance_threshold": 8,
                 "debug_mode": False,
@@ -113,7 +144,8 @@ class Orpheus:
 
         self.data_folder_base = 'config'
         self.settings_location = os.path.join(self.data_folder_base, 'settings.json')
-        self.session_storage_location = os.path.join(self.data_folder_base, 'loginstorage.bin')
+        self.session_storage_location = os.path.join(self.data_folder_base, 'loginstorage.db')
+        self.legacy_session_storage_location = os.path.join(self.data_folder_base, 'loginstorage.bin')  # Imported once
 
         os.makedirs('config', exist_ok=True)
         self.settings = json.loads(open(self.settings_location, 'r').read()) if os.path.exists(self.settings_location) else {}
@@ -138,9 +170,11 @@ class Orpheus:
         os.makedirs('extensions', exist_ok=True)
         for extension in os.listdir('extensions'):  # Loading extensions
             if os.path.isdir(f'extensions/{extension}') and os.path.exists(f'extensions/{extension}/interface.py'):
-                class_ = getattr(importlib.import_module(f'extensions.{extension}.interface'), 'OrpheusExtension', None)
+                interface = importlib.import_module(f'extensions.{extension}.interface')
+                class_ = getattr(interface, 'OrpheusExtension', None)
                 if class_:
                     self.extension_list.add(extension)
+                    self.extension_interfaces[extension] = interface
                     logging.debug(f'Orpheus: {extension} extension detected')
                 else:
                     raise Exception('Error loading extension: "{extension}"')
@@ -153,8 +187,10 @@ class Orpheus:
             exit()
         logging.debug('Orpheus: Modules detected: ' + ", ".join(module_list))
 
+        # Module information comes from the manifest, the interfaces themselves are only imported by load_module
+        module_manifest = ModuleManifest(os.path.join(self.data_folder_base, 'module_manifest.bin'))
         for module in module_list:  # Loading module information into module_settings
-            module_information: ModuleInformation = getattr(importlib.import_module(f'modules.{module}.interface'), 'module_information', None)
+            module_information: ModuleInformation = module_manifest.module_information(module)
             if module_information and not ModuleFlags.private in module_information.flags and not private_mode:
                 self.module_list.add(module)
                 self.module_settings[module] = module_information
@@ -162,6 +198,8 @@ class Orpheus:
             else:
                 raise Exception(f'Error loading module information from module: "{module}"') # TODO: replace with InvalidModuleError
 
+        module_manifest.save(module_list)
+
         duplicates = set()
         for module in self.module_list: # Detecting duplicate url constants
             module_info: ModuleInformation = self.module_settings[module]
@@ -182,17 +220,18 @@ class Orpheus:
                     else:
                         duplicates.add(sorted([module, self.module_netloc_constants[constant]]))
         if duplicates: raise Exception('Multiple modules installed that connect to the same service names: ' + ', '.join(' and '.join(duplicates)))
+        self.netloc_router = NetlocRouter(self.module_netloc_constants)
 
         self.update_module_storage()
 
-        for i in self.extension_list:
-            extension_settings: ExtensionInformation = getattr(importlib.import_module(f'extensions.{i}.interface'), 'extension_settings', None)
+        for extension in self.extension_list:
+            extension_settings: ExtensionInformation = getattr(self.extension_interfaces[extension], 'extension_settings', None)
             settings = self.settings['extensions'][extension_settings.extension_type][extension] \
                 if extension_settings.extension_type in self.settings['extensions'] \
                 and extension in self.settings['extensions'][extension_settings.extension_type] else extension_settings.settings
             extension_type = extension_settings.extension_type
             self.extensions[extension_type] = self.extensions[extension_type] if extension_type in self.extensions else {}
-            self.extensions[extension_type][extension] = class_(settings)
+            self.extensions[extension_type][extension] = self.extension_interfaces[extension].OrpheusExtension(settings)
 
         [self.load_module(module) for module in self.module_list if ModuleFlags.startup_load in self.module_settings[module].flags]
 
@@ -206,6 +245,12 @@ class Orpheus:
 
     def load_module(self, module: str):
         module = module.lower()
+        with self.module_locks_lock:
+            module_lock = self.module_locks.setdefault(module, threading.Lock())
+        with module_lock:  # Loads and logs in once when several threads, like the module warm-up, ask at once
+            return self._load_module(module)
+
+    def _load_module(self, module: str):
         if module not in self.module_list:
             raise Exception(f'"{module}" does not exist in modules.') # TODO: replace with InvalidModuleError
         if module not in self.loaded_modules:
@@ -238,6 +283,10 @@ class Orpheus:
                 )
 
                 loaded_module = class_(module_controller)
+                for method in ('get_track_info', 'get_track_download'):
+                    if hasattr(loaded_module, method):
+                        setattr(loaded_module, method, metrics.api_request_seconds.wrap(
+                            getattr(loaded_module, method), platform=module, method=method))
                 self.loaded_modules[module] = loaded_module
 
                 # Check if module has settings
@@ -270,123 +319,277 @@ class Orpheus:
         else:
             return self.loaded_modules[module]
 
+    def settings_fingerprint(self):
+        """Hash of the settings schema and the size and modification time of settings.json, None without the file"""
+        try:
+            stat = os.stat(self.settings_location)
+        except OSError:
+            return None
+        extension_settings = {i: getattr(self.extension_interfaces[i], 'extension_settings', None) for i in self.extension_list}
+        schema = {
+            'global': self.default_global_settings,
+            'extensions': {i: [info.extension_type, info.settings] for i, info in extension_settings.items() if info},
+            'modules': {i: [self.module_settings[i].global_settings, self.module_settings[i].session_settings]
+                        for i in self.module_list}
+        }
+        fingerprint = json.dumps([schema, stat.st_mtime_ns, stat.st_size], sort_keys=True, default=repr)
+        return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
     def update_module_storage(self): # Should be refactored eventually
         ## Settings
-        old_settings, new_settings, global_settings, extension_settings, module_settings, new_setting_detected = {}, {}, {}, {}, {}, False
-
-        for i in ['global', 'extensions', 'modules']:
-            old_settings[i] = self.settings[i] if i in self.settings else {}
-
-        for setting_type in self.default_global_settings:
-            if setting_type in old_settings['global']:
-                global_settings[setting_type] = {}
-                for setting in self.default_global_settings[setting_type]:
-                    # Also check if the type is identical
-                    if (setting in old_settings['global'][setting_type] and
-                            isinstance(self.default_global_settings[setting_type][setting],
-                                       type(old_settings['global'][setting_type][setting]))):
-                        global_settings[setting_type][setting] = old_settings['global'][setting_type][setting]
-                    else:
-                        global_settings[setting_type][setting] = self.default_global_settings[setting_type][setting]
-                        new_setting_detected = True
-            else:
-                global_settings[setting_type] = self.default_global_settings[setting_type]
-                new_setting_detected = True
-
-        for i in self.extension_list:
-            extension_information: ExtensionInformation = getattr(importlib.import_module(f'extensions.{i}.interface'), 'extension_settings', None)
-            extension_type = extension_information.extension_type
-            extension_settings[extension_type] = {} if 'extension_type' not in extension_information else extension_information[extension_type]
-            old_settings['extensions'][extension_type] = {} if extension_type not in old_settings['extensions'] else old_settings['extensions'][extension_type]
-            extension_settings[extension_type][i] = {} # This code regenerates the settings
-            for j in extension_information.settings:
-                if i in old_settings['extensions'][extension_type] and j in old_settings['extensions'][extension_type][i]:
-                    extension_settings[extension_type][i][j] = old_settings['extensions'][extension_type][i][j]
+        session_store = get_session_store(self.session_storage_location)
+        settings_fingerprint = self.settings_fingerprint()
+        if settings_fingerprint and session_store.get_meta('settings_fingerprint') == settings_fingerprint:
+            # Neither settings.json nor the settings of Orpheus, its modules and extensions changed since the last check
+            new_settings, new_setting_detected = self.settings, False
+        else:
+            old_settings, new_settings, global_settings, extension_settings, module_settings, new_setting_detected = {}, {}, {}, {}, {}, False
+
+            for i in ['global', 'extensions', 'modules']:
+                old_settings[i] = self.settings[i] if i in self.settings else {}
+
+            for setting_type in self.default_global_settings:
+                if setting_type in old_settings['global']:
+                    global_settings[setting_type] = {}
+                    for setting in self.default_global_settings[setting_type]:
+                        # Also check if the type is identical
+                        if (setting in old_settings['global'][setting_type] and
+                                isinstance(self.default_global_settings[setting_type][setting],
+                                           type(old_settings['global'][setting_type][setting]))):
+                            global_settings[setting_type][setting] = old_settings['global'][setting_type][setting]
+                        else:
+                            global_settings[setting_type][setting] = self.default_global_settings[setting_type][setting]
+                            new_setting_detected = True
                 else:
-                    extension_settings[extension_type][i][j] = extension_information.settings[j]
+                    global_settings[setting_type] = self.default_global_settings[setting_type]
                     new_setting_detected = True
 
-        advanced_login_mode = global_settings['advanced']['advanced_login_system']
-        for i in self.module_list:
-            module_settings[i] = {} # This code regenerates the settings
-            if advanced_login_mode:
-                settings_to_parse = self.module_settings[i].global_settings
-            else:
-                settings_to_parse = {**self.module_settings[i].global_settings, **self.module_settings[i].session_settings}
-            if settings_to_parse:
-                for j in settings_to_parse:
-                    if i in old_settings['modules'] and j in old_settings['modules'][i]:
-                        module_settings[i][j] = old_settings['modules'][i][j]
+            for i in self.extension_list:
+                extension_information: ExtensionInformation = getattr(self.extension_interfaces[i], 'extension_settings', None)
+                extension_type = extension_information.extension_type
+                extension_settings[extension_type] = {} if 'extension_type' not in extension_information else extension_information[extension_type]
+                old_settings['extensions'][extension_type] = {} if extension_type not in old_settings['extensions'] else old_settings['extensions'][extension_type]
+                extension_settings[extension_type][i] = {} # This code regenerates the settings
+                for j in extension_information.settings:
+                    if i in old_settings['extensions'][extension_type] and j in old_settings['extensions'][extension_type][i]:
+                        extension_settings[extension_type][i][j] = old_settings['extensions'][extension_type][i][j]
                     else:
-                        module_settings[i][j] = settings_to_parse[j]
+                        extension_settings[extension_type][i][j] = extension_information.settings[j]
                         new_setting_detected = True
-            else:
-                module_settings.pop(i)
 
-        new_settings['global'] = global_settings
-        new_settings['extensions'] = extension_settings
-        new_settings['modules'] = module_settings
+            advanced_login_mode = global_settings['advanced']['advanced_login_system']
+            for i in self.module_list:
+                module_settings[i] = {} # This code regenerates the settings
+                if advanced_login_mode:
+                    settings_to_parse = self.module_settings[i].global_settings
+                else:
+                    settings_to_parse = {**self.module_settings[i].global_settings, **self.module_settings[i].session_settings}
+                if settings_to_parse:
+                    for j in settings_to_parse:
+                        if i in old_settings['modules'] and j in old_settings['modules'][i]:
+                            module_settings[i][j] = old_settings['modules'][i][j]
+                        else:
+                            module_settings[i][j] = settings_to_parse[j]
+                            new_setting_detected = True
+                else:
+                    module_settings.pop(i)
+
+            new_settings['global'] = global_settings
+            new_settings['extensions'] = extension_settings
+            new_settings['modules'] = module_settings
+
+            if new_settings != self.settings:
+                temp_location = f'{self.settings_location}.{uuid.uuid4().hex}.tmp'
+                with open(temp_location, 'w') as f:
+                    f.write(json.dumps(new_settings, indent = 4, sort_keys = False))
+                os.replace(temp_location, self.settings_location)
+            session_store.set_meta('settings_fingerprint', self.settings_fingerprint())
+
+        advanced_login_mode = new_settings['global']['advanced']['advanced_login_system']
+        module_settings = new_settings['modules']
 
         ## Sessions
-        sessions = pickle.load(open(self.session_storage_location, 'rb')) if os.path.exists(self.session_storage_location) else {}
-
-        if not ('advancedmode' in sessions and 'modules' in sessions and sessions['advancedmode'] == advanced_login_mode):
-            sessions = {'advancedmode': advanced_login_mode, 'modules':{}}
-
-        # in format {advancedmode, modules: {modulename: {default, type, custom_data, sessions: [sessionname: {##}]}}}
-        # where ## is 'custom_session' plus if jwt 'access, refresh' (+ emailhash in simple)
-        # in the special case of simple mode, session is always called default
-        new_module_sessions = {}
-        for i in self.module_list:
-            # Clear storage if type changed
-            new_module_sessions[i] = sessions['modules'][i] if i in sessions['modules'] else {'selected':'default', 'sessions':{'default':{}}}
-
-            if self.module_settings[i].global_storage_variables: new_module_sessions[i]['custom_data'] = \
-                {j:new_module_sessions[i]['custom_data'][j] for j in self.module_settings[i].global_storage_variables \
-                    if 'custom_data' in new_module_sessions[i] and j in new_module_sessions[i]['custom_data']}
-
-            for current_session in new_module_sessions[i]['sessions'].values():
-                # For simple login type only, as it does not apply to advanced login
-                if self.module_settings[i].login_behaviour is ManualEnum.orpheus and not advanced_login_mode:
-                    hashes = {k:hash_string(str(v)) for k,v in module_settings[i].items()}
-                    if current_session.get('hashes'):
-                        clear_session = any(k not in hashes or hashes[k] != v for k,v in current_session['hashes'].items() if k in self.module_settings[i].session_settings)
+        def update_sessions(sessions):
+            if not sessions and os.path.exists(self.legacy_session_storage_location):
+                sessions = pickle.load(open(self.legacy_session_storage_location, 'rb'))
+
+            if not ('advancedmode' in sessions and 'modules' in sessions and sessions['advancedmode'] == advanced_login_mode):
+                sessions = {'advancedmode': advanced_login_mode, 'modules':{}}
+
+            # in format {advancedmode, modules: {modulename: {default, type, custom_data, sessions: [sessionname: {##}]}}}
+            # where ## is 'custom_session' plus if jwt 'access, refresh' (+ emailhash in simple)
+            # in the special case of simple mode, session is always called default
+            new_module_sessions = {}
+            for i in self.module_list:
+                # Clear storage if type changed
+                new_module_sessions[i] = sessions['modules'][i] if i in sessions['modules'] else {'selected':'default', 'sessions':{'default':{}}}
+
+                if self.module_settings[i].global_storage_variables: new_module_sessions[i]['custom_data'] = \
+                    {j:new_module_sessions[i]['custom_data'][j] for j in self.module_settings[i].global_storage_variables \
+                        if 'custom_data' in new_module_sessions[i] and j in new_module_sessions[i]['custom_data']}
+
+                for current_session in new_module_sessions[i]['sessions'].values():
+                    # For simple login type only, as it does not apply to advanced login
+                    if self.module_settings[i].login_behaviour is ManualEnum.orpheus and not advanced_login_mode:
+                        hashes = {k:hash_string(str(v)) for k,v in module_settings[i].items()}
+                        if current_session.get('hashes'):
+                            clear_session = any(k not in hashes or hashes[k] != v for k,v in current_session['hashes'].items() if k in self.module_settings[i].session_settings)
+                        else:
+                            clear_session = True
                     else:
-                        clear_session = True
-                else:
-                    clear_session = False
-                current_session['clear_session'] = clear_session
-
-                if ModuleFlags.enable_jwt_system in self.module_settings[i].flags:
-                    if 'bearer' in current_session and current_session['bearer'] and not clear_session:
-                        # Clears bearer token if it's expired
-                        try:
-                            time_left_until_refresh = json.loads(base64.b64decode(current_session['bearer'].split('.')[0]))['exp'] - true_current_utc_timestamp()
-                            current_session['bearer'] = current_session['bearer'] if time_left_until_refresh > 0 else ''
-                        except:
-                            pass
+                        clear_session = False
+                    current_session['clear_session'] = clear_session
+
+                    if ModuleFlags.enable_jwt_system in self.module_settings[i].flags:
+                        if 'bearer' in current_session and current_session['bearer'] and not clear_session:
+                            # Clears bearer token if it's expired
+                            expiry = bearer_expiry(current_session['bearer'])
+                            if expiry is not None and expiry - true_current_utc_timestamp() <= 0:
+                                current_session['bearer'] = ''
+                        else:
+                            current_session['bearer'] = ''
+                            current_session['refresh'] = ''
                     else:
-                        current_session['bearer'] = ''
-                        current_session['refresh'] = ''
-                else:
-                    if 'bearer' in current_session: current_session.pop('bearer')
-                    if 'refresh' in current_session: current_session.pop('refresh')
+                        if 'bearer' in current_session: current_session.pop('bearer')
+                        if 'refresh' in current_session: current_session.pop('refresh')
 
-                if self.module_settings[i].session_storage_variables: current_session['custom_data'] = \
-                    {j:current_session['custom_data'][j] for j in self.module_settings[i].session_storage_variables \
-                        if 'custom_data' in current_session and j in current_session['custom_data'] and not clear_session}
-                elif 'custom_data' in current_session: current_session.pop('custom_data')
+                    if self.module_settings[i].session_storage_variables: current_session['custom_data'] = \
+                        {j:current_session['custom_data'][j] for j in self.module_settings[i].session_storage_variables \
+                            if 'custom_data' in current_session and j in current_session['custom_data'] and not clear_session}
+                    elif 'custom_data' in current_session: current_session.pop('custom_data')
 
-        pickle.dump({'advancedmode': advanced_login_mode, 'modules': new_module_sessions}, open(self.session_storage_location, 'wb'))
-        open(self.settings_location, 'w').write(json.dumps(new_settings, indent = 4, sort_keys = False))
+            return {'advancedmode': advanced_login_mode, 'modules': new_module_sessions}
+
+        session_store.rewrite(update_sessions)  # Only the sessions that changed are written
 
         if new_setting_detected:
             print('New settings detected, or the configuration has been reset. Please update settings.json')
             exit()
 
 
-def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_party_modules, separate_download_module, output_path, use_ansi_colors=True):
-    downloader = Downloader(orpheus_session.settings['global'], orpheus_session.module_controls, oprinter, output_path, use_ansi_colors)
+class NetlocRouter:
+    """Resolves URL hosts to modules by their netloc constants, compiled once instead of a regex search per module
+
+    A host is searched with every constant like re.findall(constant, netloc) and the module of the last matching
+    constant wins. All constants are combined into one regex of lookaheads, in reverse order, so one search finds
+    that module, and every resolved host is remembered as most URL lists only use a handful of hosts."""
+
+    max_hosts = 4096
+
+    def __init__(self, netloc_constants: dict):
+        self.modules = list(netloc_constants.values())
+        self.hosts = {}  # netloc -> module or None
+        patterns = [(re.compile(constant), module) for constant, module in netloc_constants.items()]
+        if any(pattern.groups or pattern.flags & ~re.UNICODE for pattern, _ in patterns):
+            # Groups would shift the numbering of backreferences and inline flags must start a regex, so these
+            # constants are searched one by one
+            self.pattern, self.patterns = None, patterns
+        else:
+            self.pattern = re.compile('^(?:' + '|'.join(
+                f'(?=.*?(?P<m{i}>{constant}))' for i, constant in reversed(list(enumerate(netloc_constants)))) + ')',
+                re.DOTALL) if netloc_constants else None
+            self.patterns = None
+
+    def _search(self, netloc):
+        if self.patterns is not None:
+            service_name = None
+            for pattern, module in self.patterns:
+                if pattern.search(netloc): service_name = module
+            return service_name
+        match = self.pattern.match(netloc) if self.pattern else None
+        if not match:
+            return None
+        return self.modules[int(match.lastgroup[1:])]
+
+    def resolve(self, netloc: str):
+        """The module for a URL's netloc, None if no module handles it"""
+        try:
+            return self.hosts[netloc]
+        except KeyError:
+            pass
+        service_name = self._search(netloc)
+        if len(self.hosts) >= self.max_hosts:
+            self.hosts.clear()
+        self.hosts[netloc] = service_name
+        return service_name
+
+
+def parse_media_urls(orpheus_session: Orpheus, links):
+    """Resolve URLs into the {module: [MediaIdentification]} mapping used by orpheus_core_download
+
+    links can be any iterable of URLs, like an open file, which is read line by line."""
+    media_to_download = {}
+    for link in links:
+        link = link.strip()
+        if not link:  # Skip empty lines, e.g. from a list of URLs
+            continue
+        if not link.startswith('http'):
+            raise InvalidInput(f'Invalid argument: "{link}"')
+
+        url = urlparse(link)
+        components = url.path.split('/')
+
+        service_name = orpheus_session.netloc_router.resolve(url.netloc)
+        if not service_name:
+            raise Exception(f'URL location "{url.netloc}" is not found in modules!')
+        if service_name not in media_to_download: media_to_download[service_name] = []
+
+        if orpheus_session.module_settings[service_name].url_decoding is ManualEnum.manual:
+            module = orpheus_session.load_module(service_name)
+            media_to_download[service_name].append(module.custom_url_parse(link))
+        else:
+            if not components or len(components) <= 2:
+                raise InvalidInput(f'Invalid URL: "{link}"')
+
+            url_constants = orpheus_session.module_settings[service_name].url_constants
+            if not url_constants:
+                url_constants = {
+                    'track': DownloadTypeEnum.track,
+                    'album': DownloadTypeEnum.album,
+                    'playlist': DownloadTypeEnum.playlist,
+                    'artist': DownloadTypeEnum.artist
+                }
+
+            type_matches = [media_type for url_check, media_type in url_constants.items() if url_check in components]
+            if not type_matches:
+                raise InvalidInput(f'Invalid URL: "{link}"')
+
+            media_to_download[service_name].append(MediaIdentification(media_type=type_matches[-1], media_id=components[-1]))
+
+    return media_to_download
+
+
+def get_third_party_modules(orpheus_session: Orpheus, overrides=None):
+    """Select the lyrics/covers/credits modules, falling back to module_defaults from settings"""
+    overrides = overrides or {}
+    tpm = {ModuleModes.covers: '', ModuleModes.lyrics: '', ModuleModes.credits: ''}
+    for i in tpm:
+        moduleselected = overrides.get(i, 'default').lower()
+        if moduleselected == 'default':
+            moduleselected = orpheus_session.settings['global']['module_defaults'][i.name]
+        if moduleselected == 'default':
+            moduleselected = None
+        tpm[i] = moduleselected
+    return tpm
+
+
+def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_party_modules, separate_download_module, output_path, use_ansi_colors=True, cleanup_temp=True, progress_callback=None, cancel_event=None, skip_tracks=None):
+    # Beatport quality workaround: high and low quality fail, fallback to lossless FLAC
+    original_quality = orpheus_session.settings['global']['general']['download_quality']
+    if 'beatport' in media_to_download and original_quality in ['high', 'low']:
+        orpheus_session.settings['global']['general']['download_quality'] = 'lossless'
+        print(f' Beatport: Automatically switching from "{original_quality}" to "lossless" quality')
+    try:
+        _core_download(orpheus_session, media_to_download, third_party_modules, separate_download_module, output_path, use_ansi_colors, progress_callback, cancel_event, skip_tracks)
+    finally:
+        # Restore original quality setting if we overrode it
+        orpheus_session.settings['global']['general']['download_quality'] = original_quality
+        # In-process workers share temp/ with other running jobs, so only the CLI wipes it
+        if cleanup_temp and os.path.exists('temp'): shutil.rmtree('temp')
+
+
+def _core_download(orpheus_session: Orpheus, media_to_download, third_party_modules, separate_download_module, output_path, use_ansi_colors, progress_callback=None, cancel_event=None, skip_tracks=None):
+    downloader = Downloader(orpheus_session.settings['global'], orpheus_session.module_controls, oprinter, output_path, use_ansi_colors, progress_callback, cancel_event, skip_tracks)
     downloader.full_settings = orpheus_session.settings  # Add access to full settings including modules
     os.makedirs('temp', exist_ok=True)
 
@@ -394,6 +597,7 @@ def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_par
         total_items_in_batch = len(items)
         
         for index, media in enumerate(items, start=1):
+            downloader.check_cancelled()
             if ModuleModes.download not in orpheus_session.module_settings[mainmodule].module_supported_modes:
                 raise Exception(f'{mainmodule} does not support track downloading') # TODO: replace with ModuleDoesNotSupportAbility
 
@@ -430,6 +634,7 @@ def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_par
                     downloader.download_album(media_id, extra_kwargs=media.extra_kwargs)
                 elif mediatype is DownloadTypeEnum.track:
                     downloader.set_indent_number(1)  # Set proper indentation for track downloads
+                    downloader.report_progress(ProgressEventEnum.tracks_queued, count=1)
                     
                     # For single track downloads, show Pass 1 only for Spotify (which has retry passes)
                     pass_indicator = f" (Pass 1)" if (total_items_in_batch > 1 and mainmodule.lower() == 'spotify') else ""
@@ -505,6 +710,4 @@ def orpheus_core_download(orpheus_session: Orpheus, media_to_download, third_par
             else:
                 # Show "no tracks deferred" message only for multiple track downloads
                 downloader.print('No tracks were deferred due to rate limiting.', drop_level=0)
-                print()  # Add blank line after message
-
-    if os.path.exists('temp'): shutil.rmtree('temp')
\ No newline at end of file
+                print()  # Add blank line after message
\ No newline at end of file
@@ -0,0 +1,178 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+from utils import metrics
+from utils.utils import download_file_async, get_session_loop, silentremove
+
+
+class CoverCache:
+    """Downloaded and resized covers by URL and artwork settings, in memory and on disk
+
+    Tracks of an album mostly share one cover, with the cache it is fetched and resized once instead of once per
+    track. The memory tier holds the encoded bytes of the most recently used covers up to memory_bytes, the disk
+    tier keeps covers across downloads and runs up to disk_bytes, evicting the least recently used files. Concurrent
+    requests for the same cover wait for a single download, which runs in its own task so cancelling one of them
+    doesn't cancel it for the others. Everything but save() runs on the shared SessionLoop."""
+
+    def __init__(self, directory: str = os.path.join("config", "cover_cache"), memory_bytes: int = 32 * 1024 * 1024,
+                 disk_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.memory = OrderedDict()  # key -> bytes, least recently used first
+        self.memory_size = 0
+        self.in_flight = {}  # key -> asyncio.Task fetching the bytes
+        self.disk_size = None  # Bytes of the disk tier, counted on first use
+        self.disk_lock = threading.Lock()  # Disk writes run on several executor threads
+
+    @staticmethod
+    def key(url: str, artwork_settings: dict = None) -> str:
+        settings = json.dumps(artwork_settings or {}, sort_keys=True)
+        return hashlib.sha256(f'{url}\n{settings}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _remember(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        if key in self.memory:
+            self.memory_size -= len(self.memory.pop(key))
+        self.memory[key] = data
+        self.memory_size += len(data)
+        while self.memory_size > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_size -= len(evicted)
+
+    def _disk_entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # The modification time orders the eviction
+            return data
+        except OSError:
+            return None
+
+    def _write_disk(self, key, data):
+        if not self.disk_bytes or len(data) > self.disk_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self.disk_lock:
+            if self.disk_size is None:
+                self.disk_size = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self.disk_size += len(data)
+            if self.disk_size > self.disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # Called with disk_lock held
+        entries = sorted(self._disk_entries())
+        self.disk_size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.disk_size <= self.disk_bytes * 0.9:  # Some headroom, so not every new cover scans the directory
+                break
+            silentremove(path)
+            self.disk_size -= size
+
+    async def get_async(self, session, url: str, artwork_settings: dict = None) -> bytes:
+        """The cover at url, resized according to artwork_settings like download_file_async does"""
+        key = self.key(url, artwork_settings)
+        data = self.memory.get(key)
+        if data is not None:
+            self.memory.move_to_end(key)
+            metrics.cover_cache_requests_total.inc(result='memory')
+            return data
+        task = self.in_flight.get(key)
+        if task is not None:
+            metrics.cover_cache_requests_total.inc(result='shared')
+        else:
+            task = self.in_flight[key] = asyncio.ensure_future(self._fetch_async(session, url, key, artwork_settings))
+            task.add_done_callback(lambda done: self._fetched(key, done))
+        # Shielded, a cancelled caller stops waiting while the fetch goes on for the others and the cache
+        return await asyncio.shield(task)
+
+    def _fetched(self, key, task):
+        if self.in_flight.get(key) is task:
+            del self.in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved, waiters get it from their own await
+
+    async def _fetch_async(self, session, url, key, artwork_settings):
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, self._read_disk, key) if self.disk_bytes else None
+        if data is not None:
+            metrics.cover_cache_requests_total.inc(result='disk')
+        else:
+            metrics.cover_cache_requests_total.inc(result='miss')
+            os.makedirs(self.directory, exist_ok=True)
+            download_path = os.path.join(self.directory, f'{key}.download')  # Resumable like any download
+            try:
+                await download_file_async(session, url, download_path, artwork_settings=artwork_settings, kind='cover')
+                data = await loop.run_in_executor(None, _read_file, download_path)
+            finally:
+                silentremove(download_path)
+            await loop.run_in_executor(None, self._write_disk, key, data)
+        self._remember(key, data)
+        return data
+
+    async def save_async(self, session, url: str, location: str, artwork_settings: dict = None) -> str:
+        """Write the cover at url to location, returns location"""
+        data = await self.get_async(session, url, artwork_settings)
+        await asyncio.get_event_loop().run_in_executor(None, _write_file, location, data)
+        return location
+
+    def save(self, url: str, location: str, artwork_settings: dict = None) -> str:
+        """save_async() for code that is not async"""
+        async def save():
+            session = await session_loop.get_session()
+            return await self.save_async(session, url, location, artwork_settings)
+
+        session_loop = get_session_loop()
+        return session_loop.run(save())
+
+
+def _read_file(location):
+    with open(location, 'rb') as f:
+        return f.read()
+
+
+def _write_file(location, data):
+    with open(location, 'wb') as f:
+        f.write(data)
+
+
+cover_cache = None
+cover_cache_lock = threading.Lock()
+
+
+def get_cover_cache(disk_megabytes: int = 256) -> CoverCache:
+    """The process-wide CoverCache, its disk tier sized by the first caller, 0 keeps covers in memory only"""
+    global cover_cache
+    with cover_cache_lock:
+        if cover_cache is None:
+            cover_cache = CoverCache(disk_bytes=int(disk_megabytes or 0) * 1024 * 1024)
+        return cover_cache
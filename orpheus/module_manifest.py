@@ -0,0 +1,93 @@
+import hashlib
+import importlib
+import logging
+import os
+import pickle
+import uuid
+
+from utils.models import ModuleInformation
+
+MANIFEST_VERSION = 1
+
+
+def _file_signature(location):
+    stat = os.stat(location)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _file_hash(location):
+    with open(location, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ModuleManifest:
+    """module_information of every installed module, kept in a file so startup doesn't import all of them
+
+    Importing a module interface pulls in its whole dependency tree, while startup only needs the metadata: netloc
+    constants, flags, supported modes and the settings schema. An entry is reused while the interface file keeps its
+    modification time and size, or else its contents hash, so only new and edited modules are imported. The manifest
+    is dropped as a whole when utils/models.py changes, as the entries are pickled ModuleInformation objects."""
+
+    def __init__(self, location: str = os.path.join('config', 'module_manifest.bin')):
+        self.location = location
+        self.models_signature = (MANIFEST_VERSION, *_file_signature(importlib.import_module('utils.models').__file__))
+        self.entries = {}  # module -> {'signature', 'sha256', 'information'}
+        self.dirty = False
+        try:
+            with open(location, 'rb') as f:
+                manifest = pickle.load(f)
+            if manifest.get('models') == self.models_signature:
+                self.entries = manifest['modules']
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug(f'Orpheus: discarding module manifest: {e}')
+
+    def module_information(self, module: str) -> ModuleInformation:
+        """The module's module_information, importing its interface only when the cached entry is stale"""
+        location = os.path.join('modules', module, 'interface.py')
+        signature = _file_signature(location)
+        entry = self.entries.get(module)
+        if entry and entry['signature'] == signature:
+            return entry['information']
+
+        sha256 = _file_hash(location)
+        if entry and entry['sha256'] == sha256:  # Touched but not edited, e.g. by a checkout
+            entry['signature'] = signature
+            self.dirty = True
+            return entry['information']
+
+        module_information = getattr(importlib.import_module(f'modules.{module}.interface'), 'module_information', None)
+        if module_information is None:
+            self.entries.pop(module, None)
+            return None
+        try:
+            pickle.dumps(module_information)
+        except Exception as e:  # Whatever can't be stored is read by importing, like before
+            logging.debug(f'Orpheus: module information of {module} can not be cached: {e}')
+            self.entries.pop(module, None)
+        else:
+            self.entries[module] = {'signature': signature, 'sha256': sha256, 'information': module_information}
+        self.dirty = True
+        return module_information
+
+    def save(self, modules=None):
+        """Write the manifest if anything changed, forgetting modules that are no longer installed"""
+        if modules is not None:
+            for module in set(self.entries) - set(modules):
+                del self.entries[module]
+                self.dirty = True
+        if not self.dirty:
+            return
+        os.makedirs(os.path.dirname(self.location) or '.', exist_ok=True)
+        temp_location = f'{self.location}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(temp_location, 'wb') as f:
+                pickle.dump({'models': self.models_signature, 'modules': self.entries}, f)
+            os.replace(temp_location, self.location)
+        except OSError as e:  # A read-only config folder only costs the imports next time
+            logging.debug(f'Orpheus: could not write the module manifest: {e}')
+            if os.path.exists(temp_location):
+                os.remove(temp_location)
+            return
+        self.dirty = False
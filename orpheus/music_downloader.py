@@ -9,14 +9,18 @@ import uuid
 import time
 import re
 import platform
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+from concurrent.futures import Future, as_completed
 
 from ffmpeg import Error
 
+from orpheus.conversion import get_conversion_executor
+from orpheus.cover_cache import get_cover_cache
 from orpheus.tagging import tag_file
 from utils.models import *
 from utils.utils import *
 from utils.exceptions import *
+from utils import metrics
 
 # --- Modular Spotify Import ---
 try:
@@ -155,8 +159,94 @@ def json_enum_serializer(obj):
     raise TypeError(f'Object of type {obj.__class__.__name__} is not JSON serializable')
 
 
+class SharedTrack:
+    __slots__ = ('done', 'location')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.location = None  # Finished file, None when the download failed
+
+
+class SharedTracks:
+    """Tracks being downloaded by any Downloader of this process, keyed by (service, track id, quality)
+
+    Jobs for overlapping media, such as an album and one of its tracks, run in separate Downloaders. The second one
+    to reach a track waits for the first and copies its file instead of downloading the track again."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tracks = {}
+
+    def claim(self, key):
+        """Returns (shared_track, owned), the owner downloads the track and has to release it"""
+        with self.lock:
+            track = self.tracks.get(key)
+            if track is None:
+                track = self.tracks[key] = SharedTrack()
+                return track, True
+            return track, False
+
+    def release(self, key, location=None):
+        with self.lock:
+            track = self.tracks.pop(key, None)
+        if track:
+            track.location = location
+            track.done.set()
+
+
+shared_tracks = SharedTracks()
+
+
+class TransferredTrack:
+    """A track whose audio and artwork were downloaded, handed from the transfer stage to conversion and tagging"""
+    __slots__ = ('track_id', 'track_info', 'location', 'bytes_downloaded', 'artwork_path', 'm3u_playlist', 'converted', 'album_cover')
+
+    def __init__(self, track_id, track_info, location, bytes_downloaded, artwork_path, m3u_playlist, converted=False, album_cover=None):
+        self.track_id = track_id
+        self.track_info = track_info
+        self.location = location
+        self.bytes_downloaded = bytes_downloaded
+        self.artwork_path = artwork_path
+        self.m3u_playlist = m3u_playlist
+        self.converted = converted  # Converted while it was downloaded, see Downloader._stream_convert_async
+        self.album_cover = album_cover  # Future of the album's cover, the artwork once it has been downloaded
+
+
+class DownloadPipeline:
+    """Bounded stages of the concurrent downloader, so network and CPU work overlap instead of queueing in one slot
+
+    - metadata: get_track_info/get_track_download calls on their own threads
+    - transfer: audio and artwork downloads, limited to concurrent_downloads
+    - cpu: ffmpeg conversion and tagging, ffmpeg runs as a subprocess so threads keep every core busy
+    - finalize: m3u entries and temp file cleanup, on a single thread
+
+    Metadata is fetched at most one transfer window ahead, so signed download URLs do not expire while queued.
+    Create it inside the running event loop."""
+
+    def __init__(self, transfers, cpu_workers=None):
+        import asyncio
+        self.transfer = asyncio.Semaphore(transfers)
+        # Tracks between the start of their metadata fetch and the end of their transfer
+        self.network = asyncio.Semaphore(transfers * 2)
+        self.metadata_pool = ContextThreadPoolExecutor(transfers, thread_name_prefix='orpheus-metadata')
+        self.cpu_pool = ContextThreadPoolExecutor(cpu_workers or os.cpu_count() or 2, thread_name_prefix='orpheus-cpu')
+        self.finalize_pool = ContextThreadPoolExecutor(1, thread_name_prefix='orpheus-finalize')
+
+    def shutdown(self):
+        for pool in (self.metadata_pool, self.cpu_pool, self.finalize_pool):
+            pool.shutdown(wait=False)
+
+
 class Downloader:
-    def __init__(self, settings, module_controls, oprinter, path, use_ansi_colors=True):
+    # Outcome label of the tracks_total and track_download_seconds metrics
+    track_results = {
+        ProgressEventEnum.track_done: 'done',
+        ProgressEventEnum.track_skipped: 'skipped',
+        ProgressEventEnum.track_failed: 'failed',
+        ProgressEventEnum.track_rate_limited: 'rate_limited',
+    }
+
+    def __init__(self, settings, module_controls, oprinter, path, use_ansi_colors=True, progress_callback=None, cancel_event=None, skip_tracks=None):
         self.global_settings = settings
         self.module_controls = module_controls
         self.oprinter = oprinter
@@ -173,6 +263,13 @@ class Downloader:
         self.load_module = module_controls['module_loader']
         self.full_settings = None  # Will be set by core.py
         self.use_ansi_colors = use_ansi_colors
+        self.progress_callback = progress_callback  # Receives a ProgressEvent for every track state change
+        self.cancel_event = cancel_event  # threading.Event, set to abort the download as soon as possible
+        self.skip_tracks = skip_tracks or set()  # Track ids finished by an earlier run, reported as skipped
+        self.partial_files = {}  # track_id -> location of tracks being written
+        self.temp_files = set()
+        self.asset_futures = []  # Album assets downloading alongside the tracks, see _download_asset
+        self.track_started_at = {}  # track_id -> perf_counter() of its track_started event, for metrics
 
         self.print = self.oprinter.oprint
         self.set_indent_number = self.oprinter.set_indent_number
@@ -232,13 +329,139 @@ class Downloader:
                 'reset': RESET
             }
 
+    def report_progress(self, event: ProgressEventEnum, track_id=None, **kwargs):
+        """Send a structured progress event to the progress callback, if there is one"""
+        self.record_metrics(event, track_id, kwargs)
+        if not self.progress_callback:
+            return
+        try:
+            self.progress_callback(ProgressEvent(event, str(track_id) if track_id is not None else None, **kwargs))
+        except Exception:
+            pass  # Progress reporting must never break a download
+
+    def record_metrics(self, event: ProgressEventEnum, track_id, details):
+        platform = self.service_name or 'unknown'
+        if event is ProgressEventEnum.track_started:
+            self.track_started_at[track_id] = time.perf_counter()
+        elif event is ProgressEventEnum.bytes_received:
+            metrics.downloaded_bytes_total.inc(details.get('bytes', 0), platform=platform)
+        elif event in self.track_results:
+            result = self.track_results[event]
+            metrics.tracks_total.inc(platform=platform, result=result)
+            started_at = self.track_started_at.pop(track_id, None)
+            if started_at is not None:
+                metrics.track_download_seconds.observe(time.perf_counter() - started_at, platform=platform, result=result)
+
+    def check_cancelled(self):
+        """Raise DownloadCancelled, after removing unfinished files, once the download has been cancelled"""
+        if self.cancel_event and self.cancel_event.is_set():
+            self.remove_partial_files()
+            raise DownloadCancelled()
+
+    def remove_partial_files(self):
+        """Delete interrupted tracks and the temp files created by this download"""
+        for future in self.asset_futures:
+            future.cancel()  # Their downloads delete their own partial files
+        for location in list(self.partial_files.values()) + list(self.temp_files):
+            try:
+                silentremove(location)
+                remove_partial_download(location)
+            except OSError:
+                pass  # Still open on Windows, download_file removes it once the stream is closed
+        self.partial_files.clear()
+        self.temp_files.clear()
+
+    def _cover_cache(self):
+        return get_cover_cache(self.global_settings['covers'].get('cache_size', 256))
+
+    def _download_connections(self):
+        """Connections per large file, see download_file_async's segments"""
+        return self.global_settings['advanced'].get('download_connections', 1)
+
+    def _track_bytes_callback(self, track_id):
+        """Chunk callback for download_file(_async), reports the bytes received and aborts cancelled downloads"""
+        if not self.progress_callback and not self.cancel_event:
+            return None
+
+        def on_chunk(chunk_bytes, total_bytes):
+            self.check_cancelled()
+            self.report_progress(ProgressEventEnum.bytes_received, track_id, bytes=chunk_bytes, total_bytes=total_bytes)
+        return on_chunk
+
+    def _report_track_result(self, track_id, result, track_name=None, bytes_downloaded=0):
+        """Map a download_track return value to a track done/skipped/rate limited/failed event"""
+        if result in ("SKIPPED", "ALREADY_EXISTS"):
+            self.report_progress(ProgressEventEnum.track_skipped, track_id, track_name=track_name)
+        elif result == "RATE_LIMITED":
+            self.report_progress(ProgressEventEnum.track_rate_limited, track_id, track_name=track_name)
+        elif isinstance(result, str) and os.path.exists(result):
+            self.report_progress(ProgressEventEnum.track_done, track_id, track_name=track_name, bytes=bytes_downloaded,
+                                 location=result)
+        else:
+            # None, or an error message such as "This song is unavailable."
+            self.report_progress(ProgressEventEnum.track_failed, track_id, track_name=track_name,
+                                 error=result if isinstance(result, str) else None)
+
+    def _shared_track_key(self, track_id):
+        return self.service_name, str(track_id), self.global_settings['general']['download_quality']
+
+    def claim_shared_track(self, track_id):
+        """Claim a track for this Downloader, waiting while another Downloader of this process downloads it
+
+        Returns (owned, location), location is the file the other Downloader finished. An owned track has to be
+        released with release_shared_track()."""
+        key = self._shared_track_key(track_id)
+        while True:
+            track, owned = shared_tracks.claim(key)
+            if owned:
+                return True, None
+            while not track.done.wait(0.25):
+                self.check_cancelled()
+            if track.location:
+                return False, track.location
+            # The other download failed, try the track ourselves
+
+    async def claim_shared_track_async(self, track_id):
+        """claim_shared_track() for the concurrent downloader, waits without blocking the event loop"""
+        import asyncio
+        key = self._shared_track_key(track_id)
+        while True:
+            track, owned = shared_tracks.claim(key)
+            if owned:
+                return True, None
+            while not track.done.is_set():
+                self.check_cancelled()
+                await asyncio.sleep(0.25)
+            if track.location:
+                return False, track.location
+
+    def release_shared_track(self, track_id, result):
+        """Hand the outcome of an owned track to the Downloaders waiting for it"""
+        location = result if isinstance(result, str) and os.path.isfile(result) else None
+        shared_tracks.release(self._shared_track_key(track_id), location)
+
+    @staticmethod
+    def _copy_shared_track(shared_location, track_location):
+        """Copy a track another Downloader finished to this download's location, None if it is gone"""
+        if not shared_location or not os.path.isfile(shared_location):
+            return None
+        # The other Downloader may have converted the track, keep the extension of its file
+        location = os.path.splitext(track_location)[0] + os.path.splitext(shared_location)[1]
+        if os.path.abspath(location) == os.path.abspath(shared_location):
+            return 'ALREADY_EXISTS'
+        os.makedirs(os.path.dirname(location) or '.', exist_ok=True)
+        shutil.copyfile(shared_location, location)
+        return location
+
     def create_temp_filename(self):
         """Create a temporary filename in the temp directory"""
         if not self.temp_dir:
             # If temp_dir is not set, create it in the current directory
             self.temp_dir = os.path.join(os.getcwd(), 'temp')
         os.makedirs(self.temp_dir, exist_ok=True)
-        return os.path.join(self.temp_dir, str(uuid.uuid4()))
+        location = os.path.join(self.temp_dir, str(uuid.uuid4()))
+        self.temp_files.add(location)
+        return location
 
     def search_by_tags(self, module_name, track_info: TrackInfo):
         return self.loaded_modules[module_name].search(DownloadTypeEnum.track, f'{track_info.name} {" ".join(track_info.artists)}', track_info=track_info)
@@ -260,7 +483,7 @@ class Downloader:
         # Use asyncio + aiohttp for concurrent downloads
         import asyncio
         import time
-        from utils.utils import create_aiohttp_session, download_file_async
+        from utils.utils import download_file_async, get_session_loop
         
         # Store original print method
         original_print = self.print
@@ -274,8 +497,8 @@ class Downloader:
         concurrent_active = 0
         max_concurrent_seen = 0
         
-        async def download_worker_async(session, index, args):
-            """Async worker function to download a single track - OPTIMIZED VERSION"""
+        async def download_worker_async(session, pipeline, index, args):
+            """Async worker function to download a single track through the stages of the pipeline"""
             nonlocal concurrent_active, max_concurrent_seen, total_bytes_downloaded
             
             # Track concurrency
@@ -284,11 +507,21 @@ class Downloader:
             
             track_start_time = time.time()
             bytes_downloaded = 0
+            owned, shared_result = False, None
+            network_slot = False
             
             try:
                 # Get track info ONCE and pass it to the download function
                 track_id = args['track_id']
                 track_name = f"Track {track_id}"
+                if str(track_id) in self.skip_tracks:
+                    self.report_progress(ProgressEventEnum.track_started, track_id)
+                    return (index, track_name, "SKIPPED", None, None, 0, 0)
+                await pipeline.network.acquire()
+                network_slot = True
+                track_start_time = time.time()
+                self.report_progress(ProgressEventEnum.track_started, track_id)
+                owned, shared_location = await self.claim_shared_track_async(track_id)
                 
                 # Get track info and download info (API calls) - DO THIS ONCE PER TRACK IN THREAD POOL
                 try:
@@ -306,13 +539,14 @@ class Downloader:
                     def get_track_info_wrapper():
                         return self.service.get_track_info(track_id, quality_tier, codec_options, **args.get('extra_kwargs', {}))
                     
-                    track_info = await loop.run_in_executor(None, get_track_info_wrapper)
+                    track_info = await loop.run_in_executor(pipeline.metadata_pool, get_track_info_wrapper)
                     track_name = f"{', '.join(track_info.artists)} - {track_info.name}"
                     
                     # Check if file already exists BEFORE getting download info (for temp file modules like Deezer)
                     if track_info:
                         track_location = self._create_track_location(args.get('album_location', ''), track_info)
                         if await loop.run_in_executor(None, os.path.isfile, track_location):
+                            shared_result = track_location
                             return (index, track_name, "SKIPPED", None, None, 0, 0)
                     
                     # SINGLE API CALL: Get download info once - IN THREAD POOL
@@ -328,7 +562,7 @@ class Downloader:
                                 # Fallback for modules with simpler signatures
                                 return self.service.get_track_download(track_id, quality_tier)
                                 
-                    download_info = await loop.run_in_executor(None, get_download_info_wrapper)
+                    download_info = await loop.run_in_executor(pipeline.metadata_pool, get_download_info_wrapper)
                     
                 except Exception as e:
                     error_msg = str(e)
@@ -336,13 +570,23 @@ class Downloader:
                     return (index, track_name, f"Could not get track/download info: {error_msg}", None, Exception(f"Could not get track/download info for {track_id}: {error_msg}"), 0, 0)
 
                 # Pass both track_info and download_info to avoid double API calls
-                result = await self._download_track_async(
-                    session, 
-                    track_info=track_info, 
-                    download_info=download_info,
-                    **args, 
-                    verbose=False
-                )
+                async with pipeline.transfer:
+                    result = await self._transfer_track_async(
+                        session, 
+                        track_info=track_info, 
+                        download_info=download_info,
+                        **args, 
+                        verbose=False,
+                        shared_location=shared_location
+                    )
+                # Conversion and tagging must not keep the next track from starting its metadata fetch and transfer
+                pipeline.network.release()
+                network_slot = False
+                if isinstance(result, TransferredTrack):
+                    result = await self._finish_track_async(result, pipeline)
+                shared_result = result[0] if isinstance(result, tuple) else result
+                # Not reached when cancelled, check_cancelled() removes what is left in partial_files
+                self.partial_files.pop(track_id, None)
 
                 track_duration = time.time() - track_start_time
 
@@ -382,6 +626,10 @@ class Downloader:
                 track_duration = time.time() - track_start_time
                 return (index, f"Track {args.get('track_id', 'Unknown')}", e, None, e, 0, track_duration)
             finally:
+                if network_slot:
+                    pipeline.network.release()
+                if owned:
+                    self.release_shared_track(track_id, shared_result)
                 concurrent_active -= 1
         
         async def run_concurrent_downloads():
@@ -393,98 +641,103 @@ class Downloader:
             progress_bar_setting = self.global_settings['general'].get('progress_bar', False)
             set_progress_bars_enabled(progress_bar_setting)
             
-            async with create_aiohttp_session() as session:
-                # Create semaphore to limit concurrent downloads
-                semaphore = asyncio.Semaphore(concurrent_downloads)
-                
-                async def bounded_download(index, args):
-                    async with semaphore:
-                        return await download_worker_async(session, index, args)
-                
-                # Create tasks for all downloads
-                tasks = [bounded_download(i, args) for i, args in enumerate(download_args_list)]
+            pipeline = DownloadPipeline(concurrent_downloads)
+            try:
+                async with session_loop.shared_session() as session:
+                    # Every track gets a task, the pipeline's stages bound how many of them do work at once
+                    tasks = [asyncio.ensure_future(download_worker_async(session, pipeline, i, args)) for i, args in enumerate(download_args_list)]
+
+                    async def watch_cancel():
+                        # Tasks waiting on the semaphore or an API call do not see the cancel event by themselves
+                        while not self.cancel_event.is_set():
+                            await asyncio.sleep(0.25)
+                        for task in tasks:
+                            task.cancel()
+                    cancel_watcher = asyncio.ensure_future(watch_cancel()) if self.cancel_event else None
                 
-                # Progress tracking
-                symbols = self._get_status_symbols()
-                completed_count = 0
-                total_digits = len(str(total_tracks))
+                    # Progress tracking
+                    symbols = self._get_status_symbols()
+                    completed_count = 0
+                    total_digits = len(str(total_tracks))
                 
-                # Process downloads as they complete (OUT OF ORDER!)
-                results_temp = []
+                    # Process downloads as they complete (OUT OF ORDER!)
+                    results_temp = []
                 
-                for coro in asyncio.as_completed(tasks):
-                    try:
-                        result = await coro
-                        index, track_name, status, download_result, error, bytes_dl, duration = result
+                    for coro in asyncio.as_completed(tasks):
+                        try:
+                            try:
+                                result = await coro
+                            except asyncio.CancelledError:
+                                self.check_cancelled()
+                                raise
+                            index, track_name, status, download_result, error, bytes_dl, duration = result
                         
-                        completed_count += 1
-                        total_bytes_downloaded += bytes_dl
-                        if duration > 0:
-                            download_times.append(duration)
+                            completed_count += 1
+                            total_bytes_downloaded += bytes_dl
+                            if duration > 0:
+                                download_times.append(duration)
                         
-                        # Display progress with sequential numbering for user-friendly tracking
-                        track_number = completed_count  # Use sequential numbering (1-based)
+                            # Display progress with sequential numbering for user-friendly tracking
+                            track_number = completed_count  # Use sequential numbering (1-based)
                         
-                        if status == "SKIPPED":
-                            self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['skip']} {track_name} {symbols['yellow_text']}(already exists){symbols['reset']}", drop_level=performance_summary_indent)
-                        elif status == "RATE_LIMITED":
-                            self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['warning']} {track_name} (rate limited)", drop_level=performance_summary_indent)
-                        elif status is not None:
-                            # Error case
-                            if isinstance(status, str) and status.startswith("Could not get track info: "):
-                                error_msg = status.replace("Could not get track info: ", "")
-                                simplified_error = simplify_error_message(error_msg)
-                                self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['error']} Track {track_name}: {simplified_error} {symbols['red_text']}(failed){symbols['reset']}", drop_level=performance_summary_indent)
+                            track_id = download_args_list[index].get('track_id')
+                            if status == "SKIPPED":
+                                self.report_progress(ProgressEventEnum.track_skipped, track_id, track_name=track_name)
+                            elif status == "RATE_LIMITED":
+                                self.report_progress(ProgressEventEnum.track_rate_limited, track_id, track_name=track_name)
+                            elif status is not None:
+                                self.report_progress(ProgressEventEnum.track_failed, track_id, track_name=track_name,
+                                                     error=simplify_error_message(str(status)))
                             else:
-                                simplified_error = simplify_error_message(str(status))
-                                self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['error']} {track_name}: {simplified_error} {symbols['red_text']}(failed){symbols['reset']}", drop_level=performance_summary_indent)
-                        else:
-                            # Success
-                            self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['success']} {track_name}", drop_level=performance_summary_indent)
+                                self.report_progress(ProgressEventEnum.track_done, track_id, track_name=track_name,
+                                                     bytes=bytes_dl, location=download_result)
+
+                            if status == "SKIPPED":
+                                self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['skip']} {track_name} {symbols['yellow_text']}(already exists){symbols['reset']}", drop_level=performance_summary_indent)
+                            elif status == "RATE_LIMITED":
+                                self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['warning']} {track_name} (rate limited)", drop_level=performance_summary_indent)
+                            elif status is not None:
+                                # Error case
+                                if isinstance(status, str) and status.startswith("Could not get track info: "):
+                                    error_msg = status.replace("Could not get track info: ", "")
+                                    simplified_error = simplify_error_message(error_msg)
+                                    self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['error']} Track {track_name}: {simplified_error} {symbols['red_text']}(failed){symbols['reset']}", drop_level=performance_summary_indent)
+                                else:
+                                    simplified_error = simplify_error_message(str(status))
+                                    self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['error']} {track_name}: {simplified_error} {symbols['red_text']}(failed){symbols['reset']}", drop_level=performance_summary_indent)
+                            else:
+                                # Success
+                                self.print(f"{track_number:0{total_digits}d}/{total_tracks} {symbols['success']} {track_name}", drop_level=performance_summary_indent)
                         
-                        # Flush output to ensure immediate display in GUI
-                        import sys
-                        if hasattr(sys.stdout, 'flush'):
-                            sys.stdout.flush()
+                            # Flush output to ensure immediate display in GUI
+                            import sys
+                            if hasattr(sys.stdout, 'flush'):
+                                sys.stdout.flush()
                         
-                        # Store result for final processing
-                        results_temp.append((index, download_result, error))
+                            # Store result for final processing
+                            results_temp.append((index, download_result, error))
                         
-                    except Exception as e:
-                        completed_count += 1
-                        self.print(f"???/{total_tracks} {symbols['error']} Track (unknown): {simplify_error_message(str(e))} {symbols['red_text']}(failed){symbols['reset']}", drop_level=performance_summary_indent)
-                        # Flush output to ensure immediate display in GUI
-                        import sys
-                        if hasattr(sys.stdout, 'flush'):
-                            sys.stdout.flush()
-                        results_temp.append((len(results_temp), None, e))
+                        except Exception as e:
+                            completed_count += 1
+                            self.report_progress(ProgressEventEnum.track_failed, error=simplify_error_message(str(e)))
+                            self.print(f"???/{total_tracks} {symbols['error']} Track (unknown): {simplify_error_message(str(e))} {symbols['red_text']}(failed){symbols['reset']}", drop_level=performance_summary_indent)
+                            # Flush output to ensure immediate display in GUI
+                            import sys
+                            if hasattr(sys.stdout, 'flush'):
+                                sys.stdout.flush()
+                            results_temp.append((len(results_temp), None, e))
                 
-                return results_temp
+                    if cancel_watcher:
+                        cancel_watcher.cancel()
+                    return results_temp
+            finally:
+                pipeline.shutdown()
         
-        # Run the async downloads with Windows compatibility
+        # Run the async downloads on the process-wide loop, its session keeps connections between albums
+        session_loop = get_session_loop()
         try:
-            import platform
-            
             self.print(f"Using {concurrent_downloads} concurrent downloads for {total_tracks} tracks", drop_level=performance_summary_indent)
-            
-            if platform.system() == 'Windows':
-                # For Windows, set the event loop policy to avoid SelectorEventLoop issues
-                asyncio.set_event_loop_policy(asyncio.WindowsProactorEventLoopPolicy())
-            if hasattr(asyncio, 'run'):
-                # Python 3.7+
-                results_temp = asyncio.run(run_concurrent_downloads())
-            else:
-                # Python 3.6 compatibility
-                if platform.system() == 'Windows':
-                    loop = asyncio.ProactorEventLoop()
-                else:
-                    loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                try:
-                    results_temp = loop.run_until_complete(run_concurrent_downloads())
-                finally:
-                    loop.close()
-                    
+            results_temp = session_loop.run(run_concurrent_downloads())
         except Exception as e:
             original_print(f"❌ Error in async downloads: {e}", drop_level=1)
             original_print("🔄 Falling back to sync downloads")
@@ -605,6 +858,7 @@ class Downloader:
         if playlist_info.duration: self.print(f'Duration: {beauty_format_seconds(playlist_info.duration)}')
         number_of_tracks = len(playlist_info.tracks)
         self.print(f'Number of tracks: {number_of_tracks!s}')
+        self.report_progress(ProgressEventEnum.tracks_queued, count=number_of_tracks)
         
         # Sanitize and shorten playlist name for filesystem
         safe_playlist_name = sanitise_name(playlist_info.name)
@@ -622,14 +876,15 @@ class Downloader:
         
         if playlist_info.cover_url:
             self.print('Downloading playlist cover')
-            download_file(playlist_info.cover_url, f'{playlist_path}cover.{playlist_info.cover_type.name}', artwork_settings=self._get_artwork_settings())
+            download_file(playlist_info.cover_url, f'{playlist_path}cover.{playlist_info.cover_type.name}', artwork_settings=self._get_artwork_settings(), kind='cover')
         
         colored_platform = get_colored_platform_name(self.module_settings[self.service_name].service_name)
         self.print(f'Platform: {colored_platform}')
         
         if playlist_info.animated_cover_url and self.global_settings['covers']['save_animated_cover']:
             self.print('Downloading animated playlist cover')
-            download_file(playlist_info.animated_cover_url, playlist_path + 'cover.mp4', enable_progress_bar=self.global_settings['general'].get('progress_bar', False))
+            download_file(playlist_info.animated_cover_url, playlist_path + 'cover.mp4', enable_progress_bar=self.global_settings['general'].get('progress_bar', False),
+                          segments=self._download_connections(), kind='animated_cover')
         
         if playlist_info.description:
             with open(playlist_path + 'description.txt', 'w', encoding='utf-8') as f: f.write(playlist_info.description)
@@ -952,13 +1207,65 @@ class Downloader:
         
         return track_location
 
+    def _download_asset(self, url, location, **kwargs):
+        """Start downloading an album asset on the shared SessionLoop, returns a Future of its location
+
+        The tracks do not wait for it, download_album does once they are done. Cancelling the download cancels it."""
+        async def download():
+            session = await session_loop.get_session()
+            return (await download_file_async(session, url, location, **kwargs))[0]
+
+        session_loop = get_session_loop()
+        future = session_loop.submit(download())
+        self.asset_futures.append(future)
+        return future
+
+    def _album_cover(self, cover_temp_location):
+        """The downloaded cover_temp_location, waiting for it if it is a Future, or '' if it failed"""
+        if isinstance(cover_temp_location, Future):
+            try:
+                return cover_temp_location.result() or ''
+            except Exception:
+                return ''
+        return cover_temp_location or ''
+
+    async def _album_artwork_async(self, album_cover, track_info):
+        """A temp copy of the album's cover for tagging one track, or the track's own cover if the album's failed"""
+        import asyncio
+        loop = asyncio.get_event_loop()
+        try:
+            cover_location = await asyncio.wrap_future(album_cover) if isinstance(album_cover, Future) else album_cover
+        except Exception:
+            cover_location = ''
+        artwork_path = self.create_temp_filename()
+        try:
+            if cover_location:
+                await loop.run_in_executor(None, shutil.copyfile, cover_location, artwork_path)
+            elif track_info.cover_url:
+                session = await get_session_loop().get_session()
+                await self._cover_cache().save_async(session, track_info.cover_url, artwork_path, self._get_artwork_settings())
+            else:
+                return ''
+        except Exception:
+            return ''
+        return artwork_path
+
+    def _wait_album_assets(self):
+        """Wait for the assets started by _download_asset, reporting the ones that failed"""
+        futures, self.asset_futures = self.asset_futures, []
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                self.print(f'Could not download album asset: {simplify_error_message(str(e))}')
+
     def _download_album_files(self, album_path: str, album_info: AlbumInfo):
         if album_info.cover_url and self.global_settings['covers']['save_external']:
-            download_file(album_info.cover_url, f'{album_path}cover.{album_info.cover_type.name}', artwork_settings=self._get_artwork_settings())
+            self._download_asset(album_info.cover_url, f'{album_path}cover.{album_info.cover_type.name}', artwork_settings=self._get_artwork_settings(), kind='cover')
 
         if album_info.animated_cover_url and self.global_settings['covers']['save_animated_cover']:
             self.print('Downloading animated album cover')
-            download_file(album_info.animated_cover_url, album_path + 'cover.mp4', enable_progress_bar=self.global_settings['general'].get('progress_bar', True))
+            self._download_asset(album_info.animated_cover_url, album_path + 'cover.mp4', segments=self._download_connections(), kind='animated_cover')
 
         if album_info.description:
             with open(album_path + 'description.txt', 'w', encoding='utf-8') as f:
@@ -980,6 +1287,7 @@ class Downloader:
             return []
         
         number_of_tracks = len(album_info.tracks)
+        self.report_progress(ProgressEventEnum.tracks_queued, count=number_of_tracks)
         path = self.path if not path else path
 
         if number_of_tracks > 1 or self.global_settings['formatting']['force_album_format']:
@@ -999,13 +1307,14 @@ class Downloader:
             colored_platform = get_colored_platform_name(self.module_settings[self.service_name].service_name)
             self.print(f'Platform: {colored_platform}')
 
+            # The booklet, the cover for all tracks and the album's cover files download alongside the tracks
             if album_info.booklet_url and not os.path.exists(album_path + 'Booklet.pdf'):
                 self.print('Downloading booklet')
-                download_file(album_info.booklet_url, album_path + 'Booklet.pdf')
+                self._download_asset(album_info.booklet_url, album_path + 'Booklet.pdf', kind='booklet')
             
-            cover_temp_location = download_to_temp(album_info.all_track_cover_jpg_url) if album_info.all_track_cover_jpg_url else ''
+            cover_temp_location = self._download_asset(album_info.all_track_cover_jpg_url, self.create_temp_filename(),
+                                                       artwork_settings=self._get_artwork_settings(), kind='cover') if album_info.all_track_cover_jpg_url else ''
 
-            # Download booklet, animated album cover and album cover if present
             self._download_album_files(album_path, album_info)
 
             # Get concurrent downloads setting
@@ -1238,6 +1547,8 @@ class Downloader:
                         self.set_indent_number(current_indent)
                         print()  # Add blank line after message
 
+            self._wait_album_assets()
+
             # For artist downloads, align album completion with album start message
             if self.download_mode is DownloadTypeEnum.artist:
                 self.set_indent_number(1)  # Same as album start for artist downloads
@@ -1248,6 +1559,7 @@ class Downloader:
             # Add 2 empty lines after album completion for visual separation
             print()
             print()
+            cover_temp_location = self._album_cover(cover_temp_location)
             if cover_temp_location: silentremove(cover_temp_location)
         elif number_of_tracks == 1:
             # Single-track albums go directly to track download without album header or completion message
@@ -1358,6 +1670,7 @@ class Downloader:
         skip_tracks = self.global_settings['artist_downloading']['separate_tracks_skip_downloaded']
         tracks_to_download = [i for i in artist_info.tracks if (i not in tracks_downloaded and skip_tracks) or not skip_tracks]
         number_of_tracks_new = len(tracks_to_download)
+        self.report_progress(ProgressEventEnum.tracks_queued, count=number_of_tracks_new)
         
         if number_of_tracks_new > 0:
             
@@ -1507,8 +1820,17 @@ class Downloader:
         print()
         print()
 
-    async def _download_track_async(self, session, track_id=None, track_info=None, download_info=None, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}, verbose=True):
+    async def _download_track_async(self, session, track_id=None, track_info=None, download_info=None, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}, verbose=True, shared_location=None, pipeline=None):
         """Async version of download_track for use with concurrent downloads - OPTIMIZED VERSION"""
+        result = await self._transfer_track_async(session, track_id, track_info, download_info, album_location, main_artist, track_index, number_of_tracks, cover_temp_location, indent_level, m3u_playlist, extra_kwargs, verbose, shared_location)
+        if isinstance(result, TransferredTrack):
+            result = await self._finish_track_async(result, pipeline)
+        return result
+
+    async def _transfer_track_async(self, session, track_id=None, track_info=None, download_info=None, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}, verbose=True, shared_location=None):
+        """Network stage of _download_track_async: the audio file and its artwork
+
+        Returns a TransferredTrack for _finish_track_async, or the final result when there is nothing left to do."""
         import os
         import shutil
         from utils.utils import download_file_async
@@ -1586,17 +1908,35 @@ class Downloader:
         # Check if file already exists - use thread pool for file checks
         if await loop.run_in_executor(None, os.path.isfile, track_location):
             return "ALREADY_EXISTS"
+
+        # Another job of this process just downloaded the same track
+        copied_location = await loop.run_in_executor(None, self._copy_shared_track, shared_location, track_location)
+        if copied_location == "ALREADY_EXISTS":
+            return copied_location
+        if copied_location:
+            if m3u_playlist:
+                await loop.run_in_executor(None, self._add_track_m3u_playlist, m3u_playlist, track_info, copied_location)
+            return (copied_location, 0)
             
         # Download the audio file
+        self.partial_files[track_id] = track_location
+        streamed = None
         try:
-            if download_info.download_type is DownloadEnum.URL:
+            if download_info.download_type is DownloadEnum.URL and self._stream_conversion_plan(track_info):
+                streamed = await self._stream_convert_async(session, track_id, track_info, download_info, track_location)
+            if streamed:
+                final_location, bytes_downloaded = streamed
+            elif download_info.download_type is DownloadEnum.URL:
                 result_tuple = await download_file_async(
                     session,
                     download_info.file_url,
                     track_location,
                     headers=download_info.file_url_headers,
                     enable_progress_bar=False,  # Disable progress bar for concurrent downloads
-                    indent_level=0
+                    indent_level=0,
+                    progress_callback=self._track_bytes_callback(track_id),
+                    segments=self._download_connections(),
+                    kind='audio'
                 )
                 # Extract file location and bytes downloaded
                 if isinstance(result_tuple, tuple):
@@ -1639,35 +1979,43 @@ class Downloader:
         artwork_path = ''
         needs_artwork = (self.global_settings['covers']['embed_cover'] or 
                         self.global_settings['covers']['save_external'])
-        
-        if track_info.cover_url and needs_artwork:
+        album_cover = cover_temp_location if needs_artwork and cover_temp_location else None
+
+        if album_cover:
+            pass  # The album's cover is still downloading, _finish_track_async waits for it right before tagging
+        elif track_info.cover_url and needs_artwork:
             try:
-                artwork_path = self.create_temp_filename()
-                artwork_result = await download_file_async(
-                    session,
-                    track_info.cover_url, 
-                    artwork_path, 
-                    artwork_settings=self._get_artwork_settings(),
-                    enable_progress_bar=False,
-                    indent_level=0
-                )
-                # Handle new return format for artwork download
-                if isinstance(artwork_result, tuple):
-                    artwork_path, _ = artwork_result  # We don't need bytes for artwork
-                else:
-                    artwork_path = artwork_result
+                # Tracks sharing a cover fetch and resize it once
+                artwork_path = await self._cover_cache().save_async(session, track_info.cover_url, self.create_temp_filename(),
+                                                                    self._get_artwork_settings())
             except Exception:
                 artwork_path = ''  # Continue without artwork if download fails
-        
+
+        return TransferredTrack(track_id, track_info, final_location, bytes_downloaded, artwork_path, m3u_playlist,
+                                converted=bool(streamed), album_cover=album_cover)
+
+    async def _finish_track_async(self, transferred, pipeline=None):
+        """CPU and filesystem stages of _download_track_async: conversion and tagging, then the m3u entry and cleanup
+
+        With a DownloadPipeline they run on its own pools, so a track being converted does not hold a transfer slot."""
+        import asyncio
+        track_info, final_location, artwork_path = transferred.track_info, transferred.location, transferred.artwork_path
+        bytes_downloaded, m3u_playlist = transferred.bytes_downloaded, transferred.m3u_playlist
+        cpu_pool = pipeline.cpu_pool if pipeline else None
+        finalize_pool = pipeline.finalize_pool if pipeline else None
+
         # Do conversion BEFORE tagging (like old version) - run in thread pool
         loop = asyncio.get_event_loop()
-        conversion_result = await loop.run_in_executor(
-            None,
-            self._convert_file_if_needed,
-            final_location,
-            track_info,
-            lambda msg: None  # Dummy print function for async context
-        )
+        if transferred.converted:
+            conversion_result = (final_location, None, None)
+        else:
+            conversion_result = await loop.run_in_executor(
+                cpu_pool,
+                self._convert_file_if_needed,
+                final_location,
+                track_info,
+                lambda msg: None  # Dummy print function for async context
+            )
         converted_location, old_track_location, old_container = conversion_result
         if converted_location and converted_location != final_location:
             final_location = converted_location
@@ -1700,25 +2048,27 @@ class Downloader:
             # Check if container supports tagging
             tagging_supported_containers = [ContainerEnum.flac, ContainerEnum.mp3, ContainerEnum.m4a, ContainerEnum.ogg]
             
+            if transferred.album_cover:
+                artwork_path = await self._album_artwork_async(transferred.album_cover, track_info)
+
+            embed_artwork_path = artwork_path if self.global_settings['covers']['embed_cover'] else None
             if container in tagging_supported_containers:
                 # Tag the converted file - only pass artwork_path if embed_cover is enabled
-                embed_artwork_path = artwork_path if self.global_settings['covers']['embed_cover'] else None
-                tag_file(final_location, embed_artwork_path, track_info, credits_list, embedded_lyrics, container)
+                await loop.run_in_executor(cpu_pool, tag_file, final_location, embed_artwork_path, track_info, credits_list, embedded_lyrics, container)
             else:
                 pass  # Skip tagging for unsupported containers like WAV
             
             # Also tag the original file if it was kept (matching old version exactly)
             if old_track_location and old_container:
                 if old_container in tagging_supported_containers:
-                    embed_artwork_path = artwork_path if self.global_settings['covers']['embed_cover'] else None
-                    tag_file(old_track_location, embed_artwork_path, track_info, credits_list, embedded_lyrics, old_container)
+                    await loop.run_in_executor(cpu_pool, tag_file, old_track_location, embed_artwork_path, track_info, credits_list, embedded_lyrics, old_container)
                 else:
                     pass  # Skip tagging for unsupported containers
             
-            # Run m3u playlist addition in thread pool too if needed
+            # Run m3u playlist addition in thread pool too if needed, one writer at a time keeps entries whole
             if m3u_playlist:
                 await loop.run_in_executor(
-                    None,
+                    finalize_pool,
                     self._add_track_m3u_playlist,
                     m3u_playlist,
                     track_info,
@@ -1726,11 +2076,8 @@ class Downloader:
                 )
                 
             # Clean up temporary artwork file
-            if artwork_path and os.path.exists(artwork_path):
-                try:
-                    os.remove(artwork_path)
-                except OSError:
-                    pass  # Ignore cleanup errors
+            if artwork_path:
+                await loop.run_in_executor(finalize_pool, silentremove, artwork_path)
             
             # Return tuple with file location and bytes downloaded
             return (final_location, bytes_downloaded)
@@ -1744,7 +2091,30 @@ class Downloader:
             
             return None  # Return None to indicate failure
 
-    def download_track(self, track_id, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}, verbose=True):
+    def download_track(self, track_id, *args, **kwargs):
+        """Download a single track, reporting its start and outcome as progress events"""
+        self.check_cancelled()
+        self.report_progress(ProgressEventEnum.track_started, track_id)
+        if str(track_id) in self.skip_tracks:
+            self._report_track_result(track_id, "SKIPPED")
+            return "SKIPPED"
+
+        owned, shared_location = self.claim_shared_track(track_id)
+        result = None
+        try:
+            result = self._download_track(track_id, *args, shared_location=shared_location, **kwargs)
+        except Exception as e:
+            self.report_progress(ProgressEventEnum.track_failed, track_id, error=str(e))
+            raise
+        finally:
+            if owned:
+                self.release_shared_track(track_id, result)
+        # Not reached when cancelled, check_cancelled() removes what is left in partial_files
+        self.partial_files.pop(track_id, None)
+        self._report_track_result(track_id, result)
+        return result
+
+    def _download_track(self, track_id, album_location='', main_artist='', track_index=0, number_of_tracks=0, cover_temp_location='', indent_level=1, m3u_playlist=None, extra_kwargs={}, verbose=True, shared_location=None):
         self.set_indent_number(indent_level)
         # Aliasing for convenience.
         d_print = self.oprinter.oprint
@@ -1920,6 +2290,20 @@ class Downloader:
 
             return return_with_blank_line("SKIPPED")
 
+        # Another job of this process just downloaded the same track
+        copied_location = self._copy_shared_track(shared_location, track_location)
+        if copied_location:
+            d_print('Track was downloaded by another job, copied its file')
+            if details_indent_adjustment != 0:
+                self.set_indent_number(indent_level)
+            if copied_location == 'ALREADY_EXISTS':
+                d_print(f'=== {symbols["skip"]} Track skipped ===', drop_level=header_drop_level)
+                return return_with_blank_line("SKIPPED")
+            if m3u_playlist:
+                self._add_track_m3u_playlist(m3u_playlist, track_info, copied_location)
+            d_print(f'=== {symbols["success"]} Track completed ===', drop_level=header_drop_level)
+            return return_with_blank_line(copied_location)
+
 
         # Download lyrics
         if self.global_settings['lyrics']['save_synced_lyrics'] and hasattr(track_info, 'lyrics') and track_info.lyrics:
@@ -2097,13 +2481,17 @@ class Downloader:
             return return_with_blank_line(None)
         
         d_print('Downloading audio...')
+        self.partial_files[track_id] = track_location
         try:
             final_location = download_file(
                 download_info.file_url,
                 track_location,
                 headers=download_info.file_url_headers,
                 enable_progress_bar=self.global_settings['general'].get('progress_bar', False) and verbose,
-                indent_level=self.indent_number
+                indent_level=self.indent_number,
+                progress_callback=self._track_bytes_callback(track_id),
+                segments=self._download_connections(),
+                kind='audio'
             ) if download_info.download_type is DownloadEnum.URL else shutil.move(download_info.temp_file_path, track_location)
             
             
@@ -2157,10 +2545,14 @@ class Downloader:
         needs_artwork = (self.global_settings['covers']['embed_cover'] or 
                         self.global_settings['covers']['save_external'])
         
-        if track_info.cover_url and needs_artwork:
+        album_cover = self._album_cover(cover_temp_location) if needs_artwork else ''
+        if album_cover:
+            artwork_path = self.create_temp_filename()
+            shutil.copyfile(album_cover, artwork_path)
+        elif track_info.cover_url and needs_artwork:
             d_print('Downloading artwork...')
             artwork_path = self.create_temp_filename()
-            download_file(track_info.cover_url, artwork_path, artwork_settings=self._get_artwork_settings(), indent_level=self.indent_number)
+            self._cover_cache().save(track_info.cover_url, artwork_path, self._get_artwork_settings())
 
         # Do conversion BEFORE tagging (like old version)
         conversion_result = self._convert_file_if_needed(final_location, track_info, d_print)
@@ -2251,6 +2643,78 @@ class Downloader:
 
             return return_with_blank_line(None)  # Return None to indicate failure for concurrent download tracking
 
+    def _stream_conversion_plan(self, track_info):
+        """(new codec, ffmpeg codec, flags) when the track can be converted while it downloads, else None
+
+        Only with advanced.stream_conversion enabled, and only for conversions _convert_file_if_needed would do without
+        keeping the original file. Invalid settings are left for _convert_file_if_needed to report."""
+        advanced = self.global_settings.get('advanced', {})
+        if not advanced.get('stream_conversion', False) or advanced.get('conversion_keep_original', False):
+            return None
+        try:
+            conversions = {CodecEnum[k.upper()]: CodecEnum[v.upper()] for k, v in advanced['codec_conversions'].items()}
+            conversion_flags = {CodecEnum[k.upper()]: v for k, v in advanced.get('conversion_flags', {}).items()}
+        except (KeyError, AttributeError):
+            return None
+
+        codec = track_info.codec
+        new_codec = conversions.get(codec)
+        if new_codec is None or new_codec == codec:
+            return None
+        old_codec_data, new_codec_data = codec_data[codec], codec_data[new_codec]
+        if old_codec_data.spatial or new_codec_data.spatial:
+            return None
+        if not old_codec_data.lossless and new_codec_data.lossless and not advanced.get('enable_undesirable_conversions', False):
+            return None
+        ffmpeg_codec = {'wav': 'pcm_s16le'}.get(new_codec.name.lower(), new_codec.name.lower())
+        return new_codec, ffmpeg_codec, conversion_flags.get(new_codec, {})
+
+    async def _stream_convert_async(self, session, track_id, track_info, download_info, track_location):
+        """Download a track straight into ffmpeg's stdin, so only the converted file is written to disk
+
+        Returns (location, bytes_downloaded), or None to fall back to downloading and then converting the file, e.g.
+        for MP4 files whose index comes after the audio and cannot be read from a pipe."""
+        import subprocess
+        new_codec, ffmpeg_codec, conv_flags = self._stream_conversion_plan(track_info)
+        container = codec_data[new_codec].container.name
+        file_path_without_ext = os.path.splitext(track_location)[0]
+        new_track_location = f'{file_path_without_ext}.{container}'
+        converting_location = f'{file_path_without_ext}.converting.{container}'  # Next to the track, renamed when done
+        os.makedirs(os.path.dirname(new_track_location) or '.', exist_ok=True)
+
+        args = ffmpeg.input('pipe:0', hide_banner=None, y=None).output(
+            converting_location,
+            acodec=ffmpeg_codec,
+            vn=None,
+            **conv_flags,
+            loglevel='error'
+        ).compile()
+        self.partial_files[track_id] = converting_location
+        started = time.perf_counter()
+        try:
+            bytes_downloaded = await stream_to_process_async(session, download_info.file_url, args,
+                                                             headers=download_info.file_url_headers,
+                                                             progress_callback=self._track_bytes_callback(track_id))
+        except (subprocess.CalledProcessError, FileNotFoundError) as e:
+            silentremove(converting_location)
+            self.partial_files[track_id] = track_location
+            self.print(f'Streaming conversion failed, converting after the download instead: {getattr(e, "stderr", None) or e}')
+            return None
+        except BaseException:
+            # A half converted file can't be resumed like a .part file, so it must not stay in the album folder
+            silentremove(converting_location)
+            self.partial_files[track_id] = track_location
+            raise
+
+        os.replace(converting_location, new_track_location)
+        self.partial_files[track_id] = new_track_location
+        elapsed = time.perf_counter() - started
+        metrics.conversion_seconds.observe(elapsed, codec=ffmpeg_codec)
+        if track_info.duration and elapsed > 0:
+            metrics.converted_audio_seconds_total.inc(track_info.duration, codec=ffmpeg_codec)
+            metrics.conversion_realtime_factor.observe(track_info.duration / elapsed, codec=ffmpeg_codec)
+        return new_track_location, bytes_downloaded
+
     def _convert_file_if_needed(self, file_path, track_info, d_print):
         """Convert file based on codec_conversions settings - based on old working version"""
         try:
@@ -2313,6 +2777,7 @@ class Downloader:
             
             # Create temp file and final output path (matching old version exactly)
             temp_track_location = f'{self.create_temp_filename()}.{new_codec_data.container.name}'
+            self.temp_files.add(temp_track_location)  # Removed if the download is cancelled mid-conversion
             file_path_without_ext = os.path.splitext(file_path)[0]
             new_track_location = f'{file_path_without_ext}.{new_codec_data.container.name}'
             
@@ -2325,6 +2790,8 @@ class Downloader:
             import shutil
             
             stream = ffmpeg.input(file_path, hide_banner=None, y=None)
+            # Shared by every download of this process, so the number of ffmpeg processes follows the CPU count
+            executor = get_conversion_executor(self.global_settings['advanced'].get('conversion_workers', 0))
             
             try:
                 # Map codec names to FFmpeg codec names
@@ -2340,26 +2807,26 @@ class Downloader:
                 ffmpeg_codec = ffmpeg_codec_map.get(new_codec.name.lower(), new_codec.name.lower())
                 
                 # Use the old version's approach: audio codec + ignore video streams
-                stream.output(
+                executor.run(stream.output(
                     temp_track_location,
                     acodec=ffmpeg_codec,
                     vn=None,  # Ignore video stream (this is key!)
                     **conv_flags,
                     loglevel='error'
-                ).run(capture_stdout=True, capture_stderr=True)
+                ), self.cancel_event, track_info.duration, ffmpeg_codec)
             except Error as e:
                 error_msg = e.stderr.decode('utf-8')
                 # Handle experimental encoder fallback (from old version)
                 encoder = re.search(r"(?<=non experimental encoder ')[^']+", error_msg)
                 if encoder:
                     try:
-                        stream.output(
+                        executor.run(stream.output(
                             temp_track_location,
                             acodec=encoder.group(0),
                             vn=None,  # Ignore video stream here as well
                             **conv_flags,
                             loglevel='error'
-                        ).run(capture_stdout=True, capture_stderr=True)
+                        ), self.cancel_event, track_info.duration, encoder.group(0))
                     except Error as e2:
                         raise Exception(f'ffmpeg error converting to {ffmpeg_codec}:\n{e2.stderr.decode("utf-8")}')
                 else:
@@ -16,6 +16,7 @@ from mutagen.oggopus import OggOpus
 from mutagen.oggvorbis import OggVorbis
 from mutagen.oggvorbis import OggVorbisHeaderError
 
+from utils import metrics
 from utils.exceptions import *
 from utils.models import ContainerEnum, TrackInfo
 
@@ -65,6 +66,7 @@ def _resize_image_if_needed(image_path: str, max_size_bytes: int = 16 * 1024 * 1
         return image_path
 
 
+@metrics.tagging_seconds.wrap
 def tag_file(file_path: str, image_path: str, track_info: TrackInfo, credits_list: list, embedded_lyrics: str, container: ContainerEnum):
     if container == ContainerEnum.flac:
         tagger = FLAC(file_path)
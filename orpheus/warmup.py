@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from orpheus.core import Orpheus, bearer_expiry, true_current_utc_timestamp
+from utils import metrics
+from utils.models import ModuleFlags
+from utils.utils import read_temporary_setting
+
+# Bearer tokens are refreshed this many seconds before they expire
+JWT_REFRESH_MARGIN = 300
+# Upper bound of the wait between two checks of the bearer tokens, in seconds
+JWT_CHECK_INTERVAL = 60
+
+
+class ModuleWarmup:
+    """Loads and logs into the modules of an Orpheus instance in the background, then keeps their tokens fresh
+
+    Without it the first request for a platform pays for importing the module and logging in. The modules are
+    loaded concurrently on a thread pool, and modules with enable_jwt_system get refresh_login() called shortly
+    before their bearer token expires, instead of by the request that finds it expired."""
+
+    def __init__(self, orpheus: Orpheus, modules=None, workers: int = 4):
+        self.orpheus = orpheus
+        self.modules = sorted(modules if modules is not None else orpheus.module_list)
+        self.workers = workers
+        self.status = {module: {'status': 'pending', 'error': None, 'seconds': None} for module in self.modules}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.refresher = None
+
+    def start(self):
+        """Start loading the modules, returns immediately"""
+        if self.refresher:
+            return
+        executor = ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(self.modules))),
+                                      thread_name_prefix='orpheus-warmup')
+        futures = [executor.submit(self._warm_up, module) for module in self.modules]
+        executor.shutdown(wait=False)
+        self.refresher = threading.Thread(target=self._refresh_loop, args=(futures,), name='orpheus-jwt-refresh',
+                                          daemon=True)
+        self.refresher.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _set_status(self, module, **status):
+        with self.lock:
+            self.status[module].update(status)
+
+    def _warm_up(self, module):
+        self._set_status(module, status='loading')
+        start = time.perf_counter()
+        try:
+            self.orpheus.load_module(module)
+        except (Exception, SystemExit) as e:
+            logging.warning(f'Orpheus: warming up {module} failed: {e}')
+            self._set_status(module, status='failed', error=str(e), seconds=time.perf_counter() - start)
+            metrics.module_warmups_total.inc(platform=module, result='failed')
+        else:
+            self._set_status(module, status='ready', seconds=time.perf_counter() - start)
+            metrics.module_warmups_total.inc(platform=module, result='ready')
+
+    def bearer_expiries(self):
+        """{module: exp timestamp} of the loaded modules with enable_jwt_system and a readable bearer token"""
+        expiries = {}
+        for module in self.modules:
+            if module not in self.orpheus.loaded_modules or \
+                    ModuleFlags.enable_jwt_system not in self.orpheus.module_settings[module].flags:
+                continue
+            try:
+                bearer = read_temporary_setting(self.orpheus.session_storage_location, module, 'bearer')
+            except Exception:
+                continue
+            expiry = bearer_expiry(bearer) if bearer else None
+            if expiry is not None:
+                expiries[module] = expiry
+        return expiries
+
+    def refresh_expiring(self):
+        """Refresh the bearer tokens that expire within JWT_REFRESH_MARGIN, returns the seconds until the next one does"""
+        next_check = JWT_CHECK_INTERVAL
+        for module, expiry in self.bearer_expiries().items():
+            time_left = expiry - true_current_utc_timestamp()
+            if time_left > JWT_REFRESH_MARGIN:
+                next_check = min(next_check, time_left - JWT_REFRESH_MARGIN)
+                continue
+            try:
+                with self.orpheus.module_locks[module]:  # Not while a request is loading or using the login
+                    self.orpheus.loaded_modules[module].refresh_login()
+                metrics.jwt_refreshes_total.inc(platform=module, result='refreshed')
+            except Exception as e:
+                logging.warning(f'Orpheus: refreshing the {module} login failed: {e}')
+                metrics.jwt_refreshes_total.inc(platform=module, result='failed')
+        return max(next_check, 1)
+
+    def _refresh_loop(self, futures):
+        for future in futures:
+            future.result()
+        while not self.stopped.is_set():
+            try:
+                next_check = self.refresh_expiring()
+            except Exception as e:
+                logging.warning(f'Orpheus: checking the module logins failed: {e}')
+                next_check = JWT_CHECK_INTERVAL
+            self.stopped.wait(next_check)
+
+    def report(self) -> dict:
+        """Readiness of the warm-up: ready once every module finished loading, whether it failed or not"""
+        with self.lock:
+            modules = {module: dict(status) for module, status in self.status.items()}
+        now = true_current_utc_timestamp()
+        for module, expiry in self.bearer_expiries().items():
+            modules[module]['bearer_expires_in'] = expiry - now
+        return {
+            'ready': all(status['status'] in ('ready', 'failed') for status in modules.values()),
+            'modules': modules,
+        }
@@ -1,17 +1,21 @@
 
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi import Request
 from pydantic import BaseModel
 from typing import List, Optional
+import asyncio
+import json
+import time
 import uvicorn
 import os
 
 # Import our custom modules
 from OrpheusManager import OrpheusManager
-from job_manager import job_manager, JobType, JobStatus
+from job_manager import job_manager, JobType, JobStatus, QueueFullError
 from models.AlbumSearchRequest import AlbumSearchRequest
 from models.AlbumTracksRequest import AlbumTracksRequest
 from models.AppleAuth2FAResponse import AppleAuth2FAResponse
@@ -20,6 +24,7 @@ from models.DownloadRequest import DownloadRequest
 from models.JobResponse import JobResponse
 from models.MultiFormatDownloadRequest import MultiFormatDownloadRequest
 from models.Searchrequest import SearchRequest
+from utils import metrics
 
 # Initialize FastAPI app
 app = FastAPI(title="Orpheus Music Downloader API", version="1.0.0")
@@ -37,6 +42,26 @@ templates = Jinja2Templates(directory="templates")
 
 # Initialize OrpheusManager
 orpheus_manager = OrpheusManager()
+job_manager.configure(orpheus_manager.orpheus.settings['global']['jobs'], orpheus_manager.orpheus)
+job_manager.migrate_legacy_logs()
+job_manager.recover_jobs()
+job_manager.start_retention()
+
+# How often the event loop lag is sampled, in seconds
+EVENT_LOOP_LAG_INTERVAL = 0.5
+
+
+async def monitor_event_loop_lag():
+    """Measure how much later than scheduled the event loop wakes up, blocking handlers show up here"""
+    while True:
+        expected = time.perf_counter() + EVENT_LOOP_LAG_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        metrics.event_loop_lag_seconds.observe(max(time.perf_counter() - expected, 0))
+
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    asyncio.ensure_future(monitor_event_loop_lag())
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -121,15 +146,18 @@ async def download_multi_format_endpoint(request: MultiFormatDownloadRequest):
         job_type = JobType.TRACK_DOWNLOAD if request.type == "track" else JobType.ALBUM_DOWNLOAD
 
         # Create job - formats are just for display, actual formats come from config
-        job_id = job_manager.create_job(
+        # Off the loop, as creating a job writes to the job store and parses the URL
+        job_id = await run_in_threadpool(
+            job_manager.create_job,
             job_type=job_type,
             url=request.url,
             platform=request.platform,
             formats=["configured"],  # Placeholder since formats come from config
-            user_id=request.user_id
+            user_id=request.user_id,
+            priority=request.priority
         )
 
-        # Start the job in background
+        # Queue the job, it starts as soon as a worker and platform slot are free
         job_manager.start_download_job(job_id)
 
         return JSONResponse(
@@ -137,10 +165,13 @@ async def download_multi_format_endpoint(request: MultiFormatDownloadRequest):
             content={
                 "job_id": job_id,
                 "status": "accepted",
-                "message": f"Download job started for {request.type}: {request.url}"
+                "message": f"Download job queued for {request.type}: {request.url}"
             }
         )
 
+    except QueueFullError as e:
+        # Backpressure: tell the client to come back later instead of piling up work
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": "30"})
     except HTTPException:
         raise
     except Exception as e:
@@ -148,15 +179,73 @@ async def download_multi_format_endpoint(request: MultiFormatDownloadRequest):
 
 
 @app.get("/api/jobs")
-async def get_all_jobs(user_id: Optional[str] = None):
-    """Get all jobs, optionally filtered by user_id"""
+async def get_all_jobs(user_id: Optional[str] = None, status: Optional[str] = None, limit: int = 100, offset: int = 0):
+    """Get a page of jobs, newest first, optionally filtered by user_id and status"""
     try:
-        jobs = job_manager.get_all_jobs(user_id)
-        return {"jobs": jobs}
+        jobs = job_manager.get_all_jobs(user_id, status, limit, offset)
+        total = job_manager.count_jobs(user_id, status)
+        return {"jobs": jobs, "total": total, "limit": limit, "offset": offset}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/jobs/queue")
+async def get_queue_stats():
+    """Get the number of queued and running jobs, and how many finished jobs the retention policy evicted"""
+    try:
+        return job_manager.get_queue_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def format_sse_event(event: str, data, event_id=None) -> str:
+    """Encode one server-sent event"""
+    message = f"event: {event}\n"
+    if event_id is not None:
+        message += f"id: {event_id}\n"
+    return message + f"data: {json.dumps(data)}\n\n"
+
+
+@app.get("/api/jobs/events")
+async def stream_job_events(request: Request, user_id: Optional[str] = None, job_id: Optional[str] = None,
+                            logs: bool = False, since: int = 0):
+    """Stream job updates (and optionally log lines) as server-sent events instead of polling"""
+    # Subscribe before backfilling so nothing logged in between is lost
+    subscription = job_manager.events.subscribe(job_id, user_id, include_logs=logs)
+
+    async def event_stream():
+        try:
+            last_seq = since
+            if job_id:
+                # The job store and a finished job's gzip log are read in the thread pool, not on the event loop
+                job = await run_in_threadpool(job_manager.get_job, job_id)
+                if job:
+                    yield format_sse_event("job", job.to_dict())
+                if logs:
+                    for entry in await run_in_threadpool(job_manager.get_job_logs, job_id, since) or []:
+                        last_seq = entry["seq"]
+                        yield format_sse_event("log", {"job_id": job_id, **entry})
+
+            while not await request.is_disconnected():
+                try:
+                    event_id, event, data = await asyncio.wait_for(subscription.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if event == "log" and job_id:
+                    # Lines already sent by the backfill above
+                    if data["seq"] <= last_seq:
+                        continue
+                    last_seq = data["seq"]
+                yield format_sse_event(event, data, event_id)
+        finally:
+            job_manager.events.unsubscribe(subscription)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.get("/api/jobs/{job_id}")
 async def get_job_status(job_id: str):
     """Get status and details of a specific job"""
@@ -173,14 +262,14 @@ async def get_job_status(job_id: str):
 
 
 @app.get("/api/jobs/{job_id}/logs")
-async def get_job_logs(job_id: str):
-    """Get logs for a specific job"""
+async def get_job_logs(job_id: str, since: int = 0, limit: Optional[int] = None, tail: Optional[int] = None):
+    """Get logs for a specific job: lines after the since cursor, paged by limit, or only the last tail lines"""
     try:
-        logs = job_manager.get_job_logs(job_id)
+        logs = job_manager.get_job_logs(job_id, since, limit, tail)
         if logs is None:
             raise HTTPException(status_code=404, detail="Job not found")
 
-        return {"job_id": job_id, "logs": logs}
+        return {"job_id": job_id, "logs": logs, "next": logs[-1]["seq"] if logs else since}
     except HTTPException:
         raise
     except Exception as e:
@@ -196,11 +285,15 @@ async def download_endpoint(request: DownloadRequest):
             url=request.url,
             platform=request.platform,
             type=request.type,
-            formats=["configured"]  # Formats come from config
+            formats=["configured"],  # Formats come from config
+            user_id=request.user_id,
+            priority=request.priority
         )
 
         return await download_multi_format_endpoint(multi_format_request)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -217,46 +310,68 @@ async def get_platforms():
 # Additional job management endpoints
 @app.post("/api/jobs/{job_id}/cancel")
 async def cancel_job(job_id: str):
-    """Cancel a running job"""
+    """Cancel a queued or running job, running downloads stop and remove their partial files"""
     try:
         success = job_manager.cancel_job(job_id)
         if success:
             return {"message": "Job cancelled successfully"}
         else:
             raise HTTPException(status_code=404, detail="Job not found or cannot be cancelled")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/jobs/{job_id}/retry")
 async def retry_job(job_id: str):
-    """Retry a failed job"""
+    """Retry a failed or cancelled job, only the tracks it did not finish are downloaded"""
     try:
         new_job_id = job_manager.retry_job(job_id)
         if new_job_id:
             return {"message": "Job retry started", "new_job_id": new_job_id}
         else:
             raise HTTPException(status_code=404, detail="Job not found or cannot be retried")
+    except QueueFullError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": "30"})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.delete("/api/jobs/{job_id}")
 async def remove_job(job_id: str):
-    """Remove a job from the list"""
+    """Remove a finished job from the list"""
     try:
         success = job_manager.remove_job(job_id)
         if success:
             return {"message": "Job removed successfully"}
         else:
-            raise HTTPException(status_code=404, detail="Job not found")
+            raise HTTPException(status_code=404, detail="Job not found or still active")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/health")
+async def health():
+    """Readiness of the service, 503 while the module warm-up is still loading modules"""
+    report = await asyncio.get_event_loop().run_in_executor(None, orpheus_manager.health)
+    return JSONResponse(content={"status": "ok" if report["ready"] else "starting", **report},
+                        status_code=200 if report["ready"] else 503)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Job, downloader and web server metrics in the Prometheus text format"""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/api/jobs/clear-completed")
 async def clear_completed_jobs():
-    """Clear all completed and failed jobs"""
+    """Clear all completed, failed and cancelled jobs"""
     try:
         count = job_manager.clear_completed_jobs()
         return {"message": f"Cleared {count} completed jobs"}
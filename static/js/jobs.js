@@ -5,17 +5,36 @@ let currentJobId = null;
 let autoRefreshEnabled = true;
 let autoRefreshInterval = null;
 
+// Live updates: jobs are pushed by the server over server-sent events
+let jobsEventSource = null;
+let jobLogsEventSource = null;
+let jobsById = new Map();
+let jobsRenderTimer = null;
+let currentLogsCursor = 0;
+const JOB_LOGS_TAIL = 1000;
+
 // Initialize when page loads
 document.addEventListener('DOMContentLoaded', function() {
-    console.log('DOM loaded, starting jobs auto-refresh');
+    console.log('DOM loaded, starting jobs live updates');
+    const autoRefreshCheckbox = document.getElementById('autoRefresh');
+    if (autoRefreshCheckbox) {
+        autoRefreshCheckbox.addEventListener('change', function() {
+            autoRefreshEnabled = this.checked;
+            if (autoRefreshEnabled) {
+                startJobsAutoRefresh();
+            } else {
+                stopJobsAutoRefresh();
+            }
+        });
+    }
     startJobsAutoRefresh();
 });
 
-// Stop auto-refresh when page is hidden/closed
+// Stop live updates when page is hidden/closed
 document.addEventListener('visibilitychange', function() {
     if (document.hidden) {
         stopJobsAutoRefresh();
-    } else {
+    } else if (autoRefreshEnabled) {
         startJobsAutoRefresh();
     }
 });
@@ -53,7 +72,8 @@ async function refreshJobs() {
         const data = await response.json();
         console.log('Jobs data received:', data);
 
-        renderJobsList(data.jobs || []);
+        jobsById = new Map((data.jobs || []).map(job => [job.job_id, job]));
+        renderJobs();
 
     } catch (error) {
         console.error('Failed to fetch jobs:', error);
@@ -64,6 +84,21 @@ async function refreshJobs() {
 
 
 
+// Render the jobs currently known to the page, newest first
+function renderJobs() {
+    jobsRenderTimer = null;
+    const jobs = Array.from(jobsById.values())
+        .sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
+    renderJobsList(jobs);
+}
+
+// Coalesce bursts of job events into a single re-render
+function scheduleRenderJobs() {
+    if (!jobsRenderTimer) {
+        jobsRenderTimer = setTimeout(renderJobs, 250);
+    }
+}
+
 // Function to render the jobs list
 function renderJobsList(jobs) {
     const jobsDiv = document.getElementById('jobsResults');
@@ -77,7 +112,7 @@ function renderJobsList(jobs) {
     const groupedJobs = {
         running: jobs.filter(job => job.status === 'running' || job.status === 'queued'),
         completed: jobs.filter(job => job.status === 'completed'),
-        failed: jobs.filter(job => job.status === 'failed')
+        failed: jobs.filter(job => job.status === 'failed' || job.status === 'cancelled')
     };
 
     let html = `<h3>Download Jobs (${jobs.length})</h3>`;
@@ -111,7 +146,7 @@ function renderJobsList(jobs) {
 
     // Finally failed jobs
     if (groupedJobs.failed.length > 0) {
-        html += '<h4>❌ Failed Jobs</h4>';
+        html += '<h4>❌ Failed and Cancelled Jobs</h4>';
         groupedJobs.failed.forEach(job => {
             html += renderJobItem(job);
         });
@@ -146,8 +181,11 @@ function renderJobItem(job) {
             <div style="margin-top: 5px;">
                 <small><strong>URL:</strong> ${job.url}</small><br>
                 <small><strong>Platform:</strong> ${job.platform}</small>
+                ${job.coalesced_with ? `<br><small style="color: #666;">Shares the download of job ${job.coalesced_with}</small>` : ''}
             </div>
             
+            ${job.status === 'running' ? renderJobProgress(job) : ''}
+            
             ${job.error_message ? `
                 <div style="margin-top: 5px; color: red;">
                     <small><strong>Error:</strong> ${job.error_message}</small>
@@ -167,18 +205,72 @@ function renderJobItem(job) {
                 <button onclick="viewJobLogs('${job.job_id}')" class="btn btn-info btn-sm">
                     View Logs (${job.logs_count || 0})
                 </button>
+                ${job.status === 'queued' || job.status === 'running' ? `
+                    <button onclick="cancelJob('${job.job_id}')" class="btn btn-warning btn-sm">Cancel</button>
+                ` : ''}
+                ${job.status === 'failed' || job.status === 'cancelled' ? `
+                    <button onclick="retryJob('${job.job_id}')" class="btn btn-info btn-sm">Retry</button>
+                ` : ''}
+                ${job.status !== 'queued' && job.status !== 'running' ? `
+                    <button onclick="removeJob('${job.job_id}')" class="btn btn-danger btn-sm">Remove</button>
+                ` : ''}
+            </div>
+        </div>
+    `;
+}
+
+// Progress bar with track counts, throughput and ETA reported by the downloader
+function renderJobProgress(job) {
+    const progress = job.progress || 0;
+    const details = [];
+    if (job.tracks_total) {
+        const finished = (job.tracks_completed || 0) + (job.tracks_skipped || 0) + (job.tracks_failed || 0);
+        details.push(`${finished}/${job.tracks_total} tracks`);
+    }
+    if (job.tracks_failed) {
+        details.push(`${job.tracks_failed} failed`);
+    }
+    if (job.speed) {
+        details.push(`${formatBytes(job.speed)}/s`);
+    }
+    if (job.eta !== null && job.eta !== undefined) {
+        details.push(`ETA ${formatDuration(job.eta)}`);
+    }
+
+    return `
+        <div style="margin-top: 5px;">
+            <div style="background: #eee; border-radius: 3px; height: 8px; overflow: hidden;">
+                <div style="background: #007bff; height: 100%; width: ${progress}%;"></div>
             </div>
+            <small style="color: #666;">${progress}%${details.length ? ' · ' + details.join(' · ') : ''}</small>
         </div>
     `;
 }
 
+function formatBytes(bytes) {
+    const units = ['B', 'KB', 'MB', 'GB'];
+    let value = bytes;
+    let unit = 0;
+    while (value >= 1024 && unit < units.length - 1) {
+        value /= 1024;
+        unit++;
+    }
+    return `${value.toFixed(unit === 0 ? 0 : 1)} ${units[unit]}`;
+}
+
+function formatDuration(seconds) {
+    const minutes = Math.floor(seconds / 60);
+    return minutes > 0 ? `${minutes}m ${seconds % 60}s` : `${seconds}s`;
+}
+
 // Function to get status badge
 function getStatusBadge(status) {
     const badges = {
         'queued': '<span style="background: #ffc107; color: black; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">QUEUED</span>',
         'running': '<span style="background: #007bff; color: white; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">RUNNING</span>',
         'completed': '<span style="background: #28a745; color: white; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">COMPLETED</span>',
-        'failed': '<span style="background: #dc3545; color: white; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">FAILED</span>'
+        'failed': '<span style="background: #dc3545; color: white; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">FAILED</span>',
+        'cancelled': '<span style="background: #6c757d; color: white; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">CANCELLED</span>'
     };
     return badges[status] || `<span style="background: #6c757d; color: white; padding: 2px 6px; border-radius: 3px; font-size: 0.8em;">${status.toUpperCase()}</span>`;
 }
@@ -203,10 +295,13 @@ function getTimeInfo(job) {
 
 async function viewJobLogs(jobId) {
     currentJobId = jobId;
+    closeJobLogsStream();
 
     try {
-        const response = await fetch(`/api/jobs/${jobId}/logs`);
+        // Only the tail of the log, long artist downloads can have many thousands of lines
+        const response = await fetch(`/api/jobs/${jobId}/logs?tail=${JOB_LOGS_TAIL}`);
         const data = await response.json();
+        currentLogsCursor = data.next || 0;
 
         document.getElementById('logsJobId').textContent = jobId.substring(0, 8) + '...';
 
@@ -217,6 +312,7 @@ async function viewJobLogs(jobId) {
 
         displayJobLogs(data.logs);
         document.getElementById('jobLogsModal').style.display = 'block';
+        openJobLogsStream(jobId);
 
     } catch (error) {
         console.error('Error getting job logs:', error);
@@ -224,6 +320,18 @@ async function viewJobLogs(jobId) {
     }
 }
 
+function renderLogEntry(log) {
+    const timestamp = new Date(log.timestamp).toLocaleTimeString();
+    const levelClass = `log-${log.level.toLowerCase()}`;
+    return `
+        <div class="log-entry ${levelClass}">
+            <span class="log-timestamp">${timestamp}</span>
+            <span class="log-level">[${log.level}]</span>
+            <span class="log-message">${log.message}</span>
+        </div>
+    `;
+}
+
 function displayJobLogs(logs) {
     const logsContent = document.getElementById('jobLogsContent');
 
@@ -232,21 +340,7 @@ function displayJobLogs(logs) {
         return;
     }
 
-    let logsHtml = '<div class="logs-list">';
-    logs.forEach(log => {
-        const timestamp = new Date(log.timestamp).toLocaleTimeString();
-        const levelClass = `log-${log.level.toLowerCase()}`;
-        logsHtml += `
-            <div class="log-entry ${levelClass}">
-                <span class="log-timestamp">${timestamp}</span>
-                <span class="log-level">[${log.level}]</span>
-                <span class="log-message">${log.message}</span>
-            </div>
-        `;
-    });
-    logsHtml += '</div>';
-
-    logsContent.innerHTML = logsHtml;
+    logsContent.innerHTML = `<div class="logs-list">${logs.map(renderLogEntry).join('')}</div>`;
 
     // Auto-scroll to bottom if enabled
     if (document.getElementById('autoScrollLogs').checked) {
@@ -254,12 +348,59 @@ function displayJobLogs(logs) {
     }
 }
 
+// Append new log lines without re-rendering the ones already shown
+function appendJobLogs(logs) {
+    if (!logs || logs.length === 0) {
+        return;
+    }
+
+    const logsContent = document.getElementById('jobLogsContent');
+    let logsList = logsContent.querySelector('.logs-list');
+    if (!logsList) {
+        logsContent.innerHTML = '<div class="logs-list"></div>';
+        logsList = logsContent.querySelector('.logs-list');
+    }
+    logsList.insertAdjacentHTML('beforeend', logs.map(renderLogEntry).join(''));
+    currentLogsCursor = logs[logs.length - 1].seq || currentLogsCursor;
+
+    if (document.getElementById('autoScrollLogs').checked) {
+        logsContent.scrollTop = logsContent.scrollHeight;
+    }
+}
+
+// Follow a job's log lines as they are written
+function openJobLogsStream(jobId) {
+    if (!window.EventSource) {
+        return;
+    }
+
+    jobLogsEventSource = new EventSource(`/api/jobs/events?job_id=${encodeURIComponent(jobId)}&logs=true&since=${currentLogsCursor}`);
+    jobLogsEventSource.addEventListener('log', event => {
+        const log = JSON.parse(event.data);
+        if (log.seq > currentLogsCursor) {
+            appendJobLogs([log]);
+        }
+    });
+    jobLogsEventSource.addEventListener('job', event => {
+        const job = JSON.parse(event.data);
+        document.getElementById('logsJobStatus').textContent = job.status.toUpperCase();
+    });
+    jobLogsEventSource.addEventListener('resync', refreshJobLogs);
+}
+
+function closeJobLogsStream() {
+    if (jobLogsEventSource) {
+        jobLogsEventSource.close();
+        jobLogsEventSource = null;
+    }
+}
+
 async function refreshJobLogs() {
     if (currentJobId) {
         try {
-            const response = await fetch(`/api/jobs/${currentJobId}/logs`);
+            const response = await fetch(`/api/jobs/${currentJobId}/logs?since=${currentLogsCursor}`);
             const data = await response.json();
-            displayJobLogs(data.logs);
+            appendJobLogs(data.logs);
         } catch (error) {
             console.error('Error refreshing logs:', error);
         }
@@ -283,7 +424,9 @@ function downloadJobLogs() {
 
 function closeJobLogsModal() {
     document.getElementById('jobLogsModal').style.display = 'none';
+    closeJobLogsStream();
     currentJobId = null;
+    currentLogsCursor = 0;
 }
 
 async function cancelJob(jobId) {
@@ -363,26 +506,50 @@ async function clearCompletedJobs() {
     }
 }
 
-// Function to start auto-refresh
+// Function to start live updates
 function startJobsAutoRefresh() {
-    // Clear existing interval if any
-    if (jobsRefreshInterval) {
-        clearInterval(jobsRefreshInterval);
-    }
+    stopJobsAutoRefresh();
 
     // Initial load
     refreshJobs();
 
-    // Set up auto-refresh every 5 seconds
-    jobsRefreshInterval = setInterval(refreshJobs, 5000);
-    console.log('Jobs auto-refresh started');
+    if (!window.EventSource) {
+        // Browsers without server-sent events fall back to polling every 5 seconds
+        jobsRefreshInterval = setInterval(refreshJobs, 5000);
+        console.log('Jobs auto-refresh started');
+        return;
+    }
+
+    jobsEventSource = new EventSource('/api/jobs/events');
+    jobsEventSource.addEventListener('job', event => {
+        const job = JSON.parse(event.data);
+        jobsById.set(job.job_id, job);
+        scheduleRenderJobs();
+    });
+    // The server dropped events for this client, reload the full list
+    jobsEventSource.addEventListener('resync', refreshJobs);
+    jobsEventSource.onopen = () => {
+        // Catch up on anything missed while the connection was down
+        if (jobsEventSource.reconnecting) {
+            refreshJobs();
+        }
+        jobsEventSource.reconnecting = false;
+    };
+    jobsEventSource.onerror = () => {
+        jobsEventSource.reconnecting = true;
+    };
+    console.log('Jobs live updates started');
 }
-// Function to stop auto-refresh
+// Function to stop live updates
 function stopJobsAutoRefresh() {
     if (jobsRefreshInterval) {
         clearInterval(jobsRefreshInterval);
         jobsRefreshInterval = null;
-        console.log('Jobs auto-refresh stopped');
+    }
+    if (jobsEventSource) {
+        jobsEventSource.close();
+        jobsEventSource = null;
+        console.log('Jobs live updates stopped');
     }
 }
 
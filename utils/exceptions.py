@@ -47,4 +47,10 @@ class TrackUnavailableError(DownloadError):
 
 class ArtworkError(DownloadError):
     """Raised for artwork-related errors"""
-    pass
\ No newline at end of file
+    pass
+
+
+class DownloadCancelled(BaseException):
+    """Raised inside a download when it was cancelled. Like KeyboardInterrupt it is a BaseException, so the
+    "except Exception" fallbacks around track downloads do not swallow it"""
+    pass
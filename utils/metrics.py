@@ -0,0 +1,213 @@
+import bisect
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# Seconds, from fast API calls to slow album-sized jobs
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: Tuple = ()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    """A named metric with optional labels, one child per combination of label values"""
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.children: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict) -> Tuple[str, ...]:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self.lock:
+            children = list(self.children.items())
+        for key, child in sorted(children):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.children[key] = self.children.get(key, 0) + amount
+
+    def _render_child(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Gauge(Metric):
+    """A value that goes up and down, either set directly or read from a function at scrape time"""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.children[key] = value
+
+    def set_function(self, function: Callable):
+        """Read the gauge from function() when scraped, it returns a number or {label values tuple: number}"""
+        self.function = function
+
+    def render(self) -> List[str]:
+        if self.function:
+            try:
+                values = self.function()
+            except Exception:
+                values = {}  # A failing collector must not break the whole scrape
+            if not isinstance(values, dict):
+                values = {(): values}
+            with self.lock:
+                self.children = {tuple(str(v) for v in key): value for key, value in values.items()}
+        return super().render()
+
+    def _render_child(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            child = self.children.get(key)
+            if child is None:
+                # Per-bucket counts, cumulated when rendered, then the sum of all observations
+                child = self.children[key] = [[0] * len(self.buckets), 0.0]
+            child[0][index] += 1
+            child[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def wrap(self, function: Callable, **labels) -> Callable:
+        """function, timed into this histogram on every call"""
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            with self.time(**labels):
+                return function(*args, **kwargs)
+        return timed
+
+    def _render_child(self, key, child) -> List[str]:
+        counts, total = child
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets, counts):
+            cumulative += count
+            labels = _format_labels(self.label_names, key, (("le", _format_value(bound)),))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.label_names, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format, version 0.0.4"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4"  # The server adds the charset
+
+registry = MetricsRegistry()
+
+# Jobs
+jobs_queued = registry.gauge("orpheus_jobs_queued", "Jobs waiting for a worker")
+jobs_running = registry.gauge("orpheus_jobs_running", "Jobs being downloaded", ["platform"])
+job_queue_wait_seconds = registry.histogram("orpheus_job_queue_wait_seconds", "Time jobs waited in the queue for a worker", ["platform"])
+job_duration_seconds = registry.histogram("orpheus_job_duration_seconds", "Time jobs ran on a worker", ["platform", "status"])
+jobs_finished_total = registry.counter("orpheus_jobs_finished_total", "Finished jobs", ["platform", "status"])
+jobs_evicted_total = registry.counter("orpheus_jobs_evicted_total", "Finished jobs evicted by the retention policy, by age or the per-user cap", ["reason"])
+download_speed_bytes = registry.gauge("orpheus_download_speed_bytes", "Combined throughput of running jobs in bytes per second")
+
+# Downloader
+api_request_seconds = registry.histogram("orpheus_api_request_seconds", "Latency of module API calls", ["platform", "method"])
+track_download_seconds = registry.histogram("orpheus_track_download_seconds", "Time from the start of a track to its outcome", ["platform", "result"])
+tracks_total = registry.counter("orpheus_tracks_total", "Tracks by outcome: done, skipped, failed or rate_limited", ["platform", "result"])
+downloaded_bytes_total = registry.counter("orpheus_downloaded_bytes_total", "Bytes of audio received", ["platform"])
+conversion_seconds = registry.histogram("orpheus_conversion_seconds", "Time spent converting tracks with ffmpeg", ["codec"])
+conversion_queue_seconds = registry.histogram("orpheus_conversion_queue_seconds", "Time conversions waited for an ffmpeg worker")
+conversion_realtime_factor = registry.histogram("orpheus_conversion_realtime_factor", "Seconds of audio converted per second of ffmpeg time", ["codec"],
+                                                buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+converted_audio_seconds_total = registry.counter("orpheus_converted_audio_seconds_total", "Seconds of audio converted", ["codec"])
+conversions_queued = registry.gauge("orpheus_conversions_queued", "Conversions waiting for an ffmpeg worker")
+conversions_running = registry.gauge("orpheus_conversions_running", "ffmpeg processes converting tracks")
+tagging_seconds = registry.histogram("orpheus_tagging_seconds", "Time spent tagging tracks")
+cover_cache_requests_total = registry.counter("orpheus_cover_cache_requests_total", "Cover requests by where they were served from: memory, disk, shared or miss", ["result"])
+transfer_seconds = registry.histogram("orpheus_transfer_seconds", "Time of finished file transfers, audio, covers and booklets", ["kind"])
+transfer_bytes_total = registry.counter("orpheus_transfer_bytes_total", "Bytes received by finished file transfers", ["kind"])
+http_connections_total = registry.counter("orpheus_http_connections_total", "Connections of the download session, new or reused from the pool", ["result"])
+http_connections_active = registry.gauge("orpheus_http_connections_active", "Connections of the download session in use")
+http_connections_idle = registry.gauge("orpheus_http_connections_idle", "Connections of the download session kept alive for reuse")
+dns_lookups_total = registry.counter("orpheus_dns_lookups_total", "Host lookups of the download session, cached or resolved", ["result"])
+module_warmups_total = registry.counter("orpheus_module_warmups_total", "Modules loaded and logged into by the startup warm-up, ready or failed", ["platform", "result"])
+jwt_refreshes_total = registry.counter("orpheus_jwt_refreshes_total", "Bearer tokens refreshed before they expired, refreshed or failed", ["platform", "result"])
+
+# Web service
+event_loop_lag_seconds = registry.histogram("orpheus_event_loop_lag_seconds", "How late the web server's event loop ran a timer",
+                                            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
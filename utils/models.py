@@ -381,3 +381,25 @@ class TrackDownloadInfo:
     file_url_headers: Optional[dict] = None
     temp_file_path: Optional[str] = None
     different_codec: Optional[CodecEnum] = None
+
+
+class ProgressEventEnum(Flag):
+    tracks_queued = auto()  # count tracks were added to the download
+    track_started = auto()
+    bytes_received = auto()  # bytes is the size of the chunk just written
+    track_done = auto()
+    track_skipped = auto()  # Already exists
+    track_failed = auto()
+    track_rate_limited = auto()  # Deferred, the track is retried later
+
+
+@dataclass
+class ProgressEvent:
+    event: ProgressEventEnum
+    track_id: Optional[str] = None
+    track_name: Optional[str] = None
+    count: int = 0
+    bytes: int = 0
+    total_bytes: Optional[int] = None
+    location: Optional[str] = None  # Final file of a finished track
+    error: Optional[str] = None
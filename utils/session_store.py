@@ -0,0 +1,232 @@
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+
+class SessionStore:
+    """Module sessions (loginstorage) in SQLite, one row per module and per session
+
+    Token refreshes of concurrent downloads read and write single sessions, so every call touches one row instead of
+    unpickling and rewriting the whole storage, and SQLite transactions keep parallel workers and processes from
+    overwriting each other. Rows are cached in process until PRAGMA data_version reports a commit by another
+    connection. Values are pickled, as modules may store any object."""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS modules (
+            module TEXT PRIMARY KEY,
+            selected TEXT NOT NULL,
+            data BLOB NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS sessions (
+            module TEXT NOT NULL,
+            session TEXT NOT NULL,
+            data BLOB NOT NULL,
+            PRIMARY KEY (module, session)
+        );
+    """
+
+    def __init__(self, location: str):
+        directory = os.path.dirname(location)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.location = location
+        self.lock = threading.Lock()
+        # Shared by all threads of the process, every use is serialised by self.lock
+        self.connection = sqlite3.connect(location, check_same_thread=False, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.schema)
+        self.modules = {}  # module -> (selected, pickled module data) or None
+        self.sessions = {}  # (module, session) -> pickled session or None
+        self.data_version = None
+
+    def _validate_cache(self):
+        data_version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self.data_version:  # Another connection committed, the cached rows may be outdated
+            self.modules.clear()
+            self.sessions.clear()
+            self.data_version = data_version
+
+    def _module_row(self, module):
+        if module not in self.modules:
+            self.modules[module] = self.connection.execute(
+                "SELECT selected, data FROM modules WHERE module = ?", (module,)).fetchone()
+        return self.modules[module]
+
+    def _session_row(self, module, session):
+        if (module, session) not in self.sessions:
+            row = self.connection.execute(
+                "SELECT data FROM sessions WHERE module = ? AND session = ?", (module, session)).fetchone()
+            self.sessions[module, session] = row[0] if row else None
+        return self.sessions[module, session]
+
+    def _all_sessions(self, module):
+        return {session: pickle.loads(data) for session, data in self.connection.execute(
+            "SELECT session, data FROM sessions WHERE module = ?", (module,))}
+
+    def read(self, module: str, global_mode: bool = False) -> Optional[Dict]:
+        """The selected session of a module, or with global_mode the module's storage, None if it has none"""
+        with self.lock:
+            self._validate_cache()
+            module_row = self._module_row(module)
+            if not module_row:
+                return None
+            selected, module_data = module_row
+            if global_mode:
+                return {**pickle.loads(module_data), 'selected': selected, 'sessions': self._all_sessions(module)}
+            session_data = self._session_row(module, selected)
+            return pickle.loads(session_data) if session_data else None
+
+    def update(self, module: str, root_setting: str, setting: str = None, value=None, global_mode: bool = False):
+        """Set root_setting, or setting inside it, in the selected session or with global_mode the module's storage"""
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")  # Holds the write lock from the read to the write
+            try:
+                self._validate_cache()
+                module_row = self._module_row(module)
+                session_data = None
+                if module_row:
+                    session_data = module_row[1] if global_mode else self._session_row(module, module_row[0])
+                if not session_data:
+                    raise Exception('Module does not use temporary settings')
+
+                session = pickle.loads(session_data)
+                if setting:
+                    session[root_setting][setting] = value
+                else:
+                    session[root_setting] = value
+                session_data = pickle.dumps(session)
+
+                if global_mode:
+                    self.connection.execute("UPDATE modules SET data = ? WHERE module = ?", (session_data, module))
+                else:
+                    self.connection.execute("UPDATE sessions SET data = ? WHERE module = ? AND session = ?",
+                                            (session_data, module, module_row[0]))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                self.modules.clear()
+                self.sessions.clear()
+                raise
+            if global_mode:
+                self.modules[module] = (module_row[0], session_data)
+            else:
+                self.sessions[module, module_row[0]] = session_data
+
+    def _rows(self):
+        rows = {}
+        for key, value in self.connection.execute("SELECT key, value FROM meta"):
+            rows['meta', key] = value
+        for module, selected, data in self.connection.execute("SELECT module, selected, data FROM modules"):
+            rows['module', module] = (selected, data)
+        for module, session, data in self.connection.execute("SELECT module, session, data FROM sessions"):
+            rows['session', module, session] = data
+        return rows
+
+    @staticmethod
+    def _storage_from_rows(rows):
+        if ('meta', 'advancedmode') not in rows:
+            return {}
+        modules = {}
+        for key, value in rows.items():
+            if key[0] == 'module':
+                modules[key[1]] = {**pickle.loads(value[1]), 'selected': value[0], 'sessions': {}}
+        for key, value in rows.items():
+            if key[0] == 'session' and key[1] in modules:
+                modules[key[1]]['sessions'][key[2]] = pickle.loads(value)
+        return {'advancedmode': pickle.loads(rows['meta', 'advancedmode']), 'modules': modules}
+
+    @staticmethod
+    def _rows_from_storage(storage):
+        rows = {('meta', 'advancedmode'): pickle.dumps(storage['advancedmode'])}
+        for module, module_storage in storage['modules'].items():
+            module_data = {k: v for k, v in module_storage.items() if k not in ('selected', 'sessions')}
+            rows['module', module] = (module_storage['selected'], pickle.dumps(module_data))
+            for session, data in module_storage['sessions'].items():
+                rows['session', module, session] = pickle.dumps(data)
+        return rows
+
+    def _write_rows(self, old_rows, new_rows):
+        for key in old_rows.keys() - new_rows.keys():
+            if key[0] == 'meta':
+                self.connection.execute("DELETE FROM meta WHERE key = ?", key[1:])
+            elif key[0] == 'module':
+                self.connection.execute("DELETE FROM modules WHERE module = ?", key[1:])
+            else:
+                self.connection.execute("DELETE FROM sessions WHERE module = ? AND session = ?", key[1:])
+        for key, value in new_rows.items():
+            if old_rows.get(key) == value:
+                continue
+            if key[0] == 'meta':
+                self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key[1], value))
+            elif key[0] == 'module':
+                self.connection.execute("INSERT OR REPLACE INTO modules (module, selected, data) VALUES (?, ?, ?)",
+                                        (key[1], *value))
+            else:
+                self.connection.execute("INSERT OR REPLACE INTO sessions (module, session, data) VALUES (?, ?, ?)",
+                                        (*key[1:], value))
+
+    def load(self) -> Dict:
+        """The whole storage as {'advancedmode', 'modules': {module: {'selected', 'sessions', ...}}}, {} if empty"""
+        with self.lock:
+            return self._storage_from_rows(self._rows())
+
+    def rewrite(self, function) -> bool:
+        """Replace the storage by function(load()) in one transaction, only writing the rows that changed
+
+        Returns whether anything was written. function gets the format of load() and returns the new storage."""
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")  # Nobody writes between reading and replacing the storage
+            try:
+                old_rows = {key: value for key, value in self._rows().items() if key[0] != 'meta' or key[1] == 'advancedmode'}
+                new_rows = self._rows_from_storage(function(self._storage_from_rows(old_rows)))
+                changed = new_rows != old_rows
+                if changed:
+                    self._write_rows(old_rows, new_rows)
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                self.modules.clear()
+                self.sessions.clear()
+                raise
+            if changed:
+                self.modules.clear()
+                self.sessions.clear()
+            return changed
+
+    def replace(self, storage: Dict) -> bool:
+        """Replace the whole storage, the format is the one of load()"""
+        return self.rewrite(lambda _: storage)
+
+    def get_meta(self, key: str):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def set_meta(self, key: str, value):
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, pickle.dumps(value)))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+session_stores = {}
+session_stores_lock = threading.Lock()
+
+
+def get_session_store(location: str) -> SessionStore:
+    """The SessionStore of location, one per file and process"""
+    location = os.path.abspath(location)
+    with session_stores_lock:
+        if location not in session_stores:
+            session_stores[location] = SessionStore(location)
+        return session_stores[location]
@@ -1,6 +1,5 @@
-import pickle, requests, errno, hashlib, math, os, re, operator, asyncio
+import pickle, requests, errno, hashlib, json, math, os, re, operator, asyncio, sys, time, atexit, contextlib, contextvars
 import aiohttp
-import aiofiles
 from tqdm import tqdm as original_tqdm
 import threading
 
@@ -25,8 +24,12 @@ def set_progress_bars_enabled(enabled):
 from PIL import Image, ImageChops
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from functools import reduce
 
+from utils import metrics
+from utils.session_store import get_session_store
+
 
 def hash_string(input_str: str, hash_type: str = 'MD5'):
     if hash_type == 'MD5':
@@ -50,16 +53,145 @@ def create_aiohttp_session():
         limit=200,           # Increased total connection pool from 100 to 200
         limit_per_host=50,   # Increased per-host connections from 30 to 50
         enable_cleanup_closed=True,
-        use_dns_cache=False  # Disable DNS cache to avoid aiodns issues on Windows
+        keepalive_timeout=60,  # Idle connections outlive the gap between two albums
+        use_dns_cache=True,
+        ttl_dns_cache=300,
+        resolver=aiohttp.ThreadedResolver()  # The system resolver, aiodns has issues on Windows
     )
     
     return aiohttp.ClientSession(
         connector=connector,
         timeout=timeout,
         headers={'User-Agent': 'OrpheusDL/1.0'},
-        trust_env=True
+        trust_env=True,
+        trace_configs=[_connection_trace_config()]
     )
 
+
+def _connection_trace_config():
+    """Counts new and reused connections and DNS cache hits into the metrics"""
+    async def on_create(session, context, params):
+        metrics.http_connections_total.inc(result='new')
+
+    async def on_reuse(session, context, params):
+        metrics.http_connections_total.inc(result='reused')
+
+    async def on_dns_hit(session, context, params):
+        metrics.dns_lookups_total.inc(result='cached')
+
+    async def on_dns_miss(session, context, params):
+        metrics.dns_lookups_total.inc(result='resolved')
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_connection_create_end.append(on_create)
+    trace_config.on_connection_reuseconn.append(on_reuse)
+    trace_config.on_dns_cache_hit.append(on_dns_hit)
+    trace_config.on_dns_cache_miss.append(on_dns_miss)
+    return trace_config
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor that runs each call in the context variables of the thread that submitted it
+
+    Work hops from job threads to the SessionLoop and on to thread pools, loop.run_in_executor and submit() don't
+    carry context variables along by themselves, so state like the job that print() output belongs to would be lost."""
+
+    def submit(self, fn, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+class SessionLoop:
+    """An event loop on its own thread with one aiohttp session, shared by all downloads of the process
+
+    Connections, TLS sessions and DNS answers are kept from one album to the next, instead of being thrown away with
+    a session and loop per batch of tracks. Blocking work does not belong on this loop, it would hold up every
+    download of the process."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loop = None
+        self.thread = None
+        self.session = None
+
+    def _start(self):
+        with self.lock:
+            if self.loop is None:
+                if os.name == 'nt':
+                    self.loop = asyncio.ProactorEventLoop()
+                else:
+                    self.loop = asyncio.new_event_loop()
+                # File work of all downloads shares this loop's default executor
+                self.loop.set_default_executor(ContextThreadPoolExecutor(32, thread_name_prefix='orpheus-io'))
+                self.thread = threading.Thread(target=self.loop.run_forever, name='orpheus-session-loop', daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def run(self, coroutine):
+        """Run coroutine on the loop and wait for its result, from any thread but the loop's own"""
+        loop = self._start()
+        if threading.current_thread() is self.thread:
+            coroutine.close()
+            raise RuntimeError('SessionLoop.run() would wait for its own thread, await the coroutine instead')
+        future = asyncio.run_coroutine_threadsafe(coroutine, loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()  # Interrupted while waiting, e.g. by Ctrl+C
+            raise
+
+    def submit(self, coroutine):
+        """Schedule coroutine on the loop without waiting, returns a concurrent.futures.Future of its result"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start())
+
+    async def get_session(self):
+        """The shared session, created on first use, call from a coroutine running on the loop"""
+        if self.session is None or self.session.closed:
+            self.session = create_aiohttp_session()
+        return self.session
+
+    @contextlib.asynccontextmanager
+    async def shared_session(self):
+        """get_session() for an async with block, the session stays open afterwards"""
+        yield await self.get_session()
+
+    def stats(self):
+        """Connections of the pool: active (handed out), idle (kept alive) and the pool limit"""
+        session = self.session
+        connector = session.connector if session and not session.closed else None
+        if connector is None:
+            return {'active': 0, 'idle': 0, 'limit': 0}
+        return {
+            'active': len(getattr(connector, '_acquired', ())),
+            'idle': sum(len(connections) for connections in getattr(connector, '_conns', {}).values()),
+            'limit': connector.limit,
+        }
+
+    def close(self):
+        with self.lock:
+            loop, self.loop = self.loop, None
+        if loop is None:
+            return
+        if self.session is not None and not self.session.closed:
+            asyncio.run_coroutine_threadsafe(self.session.close(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+        self.thread.join(timeout=10)
+
+
+session_loop = None
+session_loop_lock = threading.Lock()
+
+
+def get_session_loop() -> SessionLoop:
+    """The process-wide SessionLoop, closed when the interpreter exits"""
+    global session_loop
+    with session_loop_lock:
+        if session_loop is None:
+            session_loop = SessionLoop()
+            atexit.register(session_loop.close)
+            metrics.http_connections_active.set_function(lambda: session_loop.stats()['active'])
+            metrics.http_connections_idle.set_function(lambda: session_loop.stats()['idle'])
+        return session_loop
+
 sanitise_name = lambda name: re.sub(r'[:]', ' - ', re.sub(r'[\\/*?"<>|$]', '', re.sub(r'[\x00-\x1F\x7F]', '', str(name).strip()))) if name else ''
 
 
@@ -79,10 +211,365 @@ def fix_byte_limit(path: str, byte_limit=250):
     return directory + '/' + fixed_filename
 
 
-r_session = create_requests_session()
+r_session = create_requests_session()  # For modules, downloads go through download_file(_async)
+
+PART_SUFFIX = '.part'
+
+
+def part_journal_location(file_location):
+    """The sidecar of file_location's .part file, JSON with the offset, size and validator of the download"""
+    return file_location + PART_SUFFIX + '.json'
+
+
+def read_part_journal(file_location):
+    try:
+        with open(part_journal_location(file_location), 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+        return journal if isinstance(journal, dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def write_part_journal(file_location, journal):
+    journal_location = part_journal_location(file_location)
+    with open(journal_location + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(journal, f)
+    os.replace(journal_location + '.tmp', journal_location)
+
+
+def _open_part_journal(file_location, url, offset, size, etag, last_modified):
+    """The journal of file_location's .part file, a new one unless an earlier download is continued"""
+    if offset == 0 or not read_part_journal(file_location):
+        write_part_journal(file_location, {
+            'url': url,
+            'size': size,
+            'offset': offset,
+            'etag': etag,
+            'last_modified': last_modified,
+        })
+    return read_part_journal(file_location)
+
+
+def _complete_part(file_location):
+    os.replace(file_location + PART_SUFFIX, file_location)
+    silentremove(part_journal_location(file_location))
+
+
+def remove_partial_download(file_location):
+    """Delete the .part file and journal of an unfinished download_file_async"""
+    silentremove(file_location + PART_SUFFIX)
+    silentremove(part_journal_location(file_location))
+
+
+def _resumable_offset(file_location, url, segmented=False):
+    """Bytes of file_location's .part file that can be kept, and the headers to request the rest with
+
+    For a segmented part that is where its first missing range starts, and only that range is requested."""
+    part_location = file_location + PART_SUFFIX
+    journal = read_part_journal(file_location)
+    offset = os.path.getsize(part_location) if os.path.isfile(part_location) else 0
+    if not offset or not journal:
+        return 0, {}
+    validator = journal.get('etag') or journal.get('last_modified')
+    # Without a validator only a retry of the very same URL may continue, signed URLs change between runs
+    if not validator and journal.get('url') != url:
+        return 0, {}
+    if journal.get('preallocated'):
+        # The part has its full size from the start, the journal knows how much of it was written
+        offset = min(journal.get('offset') or 0, offset)
+        if not offset:
+            return 0, {}
+    if 'pending' in journal:
+        if not segmented or not journal['pending']:
+            return 0, {}
+        offset, end = journal['pending'][0]
+        headers = {'Range': f'bytes={offset}-{end - 1}'}
+    else:
+        headers = {'Range': f'bytes={offset}-'}
+    if validator:
+        headers['If-Range'] = validator
+    return offset, headers
+
+
+def _record_part_offset(file_location):
+    journal = read_part_journal(file_location)
+    part_location = file_location + PART_SUFFIX
+    # Segmented and preallocated parts are longer than what was written, their writers keep the journal themselves
+    if journal and 'pending' not in journal and not journal.get('preallocated') and os.path.isfile(part_location):
+        journal['offset'] = os.path.getsize(part_location)
+        write_part_journal(file_location, journal)
+
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes asked from the response at a time
+DOWNLOAD_BUFFER_SIZE = 2 * 1024 * 1024  # Bytes gathered before a write
+
+
+class _IndentedOutput:
+    """File-like stdout for tqdm that indents every line"""
+    def __init__(self, indent_level):
+        self.indent_level = indent_level
+
+    def write(self, text):
+        lines = text.split('\n')
+        sys.stdout.write('\n'.join(' ' * self.indent_level + line if line.strip() else line for line in lines))
+
+    def flush(self):
+        sys.stdout.flush()
+
+
+class PartWriter:
+    """Sequential writer of a .part file that gathers chunks in one reusable buffer
+
+    Every full buffer is a single write on a worker thread, instead of a thread hop per chunk. The file is
+    preallocated when its size is known, so it is not grown write by write, and the journal then records how far it
+    has been written, about once a second and when the writer is closed. Only write() and flush() belong on the
+    event loop, creating and closing the writer opens, preallocates and journals the file."""
+
+    def __init__(self, file_location, offset=0, size=None, journal=None, buffer_size=DOWNLOAD_BUFFER_SIZE, on_flush=None):
+        self.file_location = file_location
+        self.journal = journal
+        self.position = offset  # Bytes of the file on disk
+        self.on_flush = on_flush
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+        self.journal_written_at = time.monotonic()
+        flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        self.fd = os.open(file_location + PART_SUFFIX, flags if offset else flags | os.O_TRUNC)
+        try:
+            os.lseek(self.fd, offset, os.SEEK_SET)
+            if size and size > offset and journal is not None and preallocate(self.fd, offset, size - offset):
+                journal['preallocated'] = True
+                self._save_journal()
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def _save_journal(self):
+        if self.journal is not None and self.journal.get('preallocated'):
+            self.journal['offset'] = self.position
+            write_part_journal(self.file_location, self.journal)
+            self.journal_written_at = time.monotonic()
+
+    def _write_buffer(self):
+        view = self.view[:self.filled]
+        while view:
+            view = view[os.write(self.fd, view):]
+        self.position += self.filled
+        if self.on_flush:
+            self.on_flush(self.filled)
+        self.filled = 0
+        if time.monotonic() - self.journal_written_at >= SEGMENT_JOURNAL_INTERVAL:
+            self._save_journal()  # Here, on the worker thread, rather than on the event loop
+
+    async def write(self, chunk):
+        chunk = memoryview(chunk)
+        while chunk:
+            count = min(len(chunk), len(self.buffer) - self.filled)
+            self.view[self.filled:self.filled + count] = chunk[:count]
+            self.filled += count
+            chunk = chunk[count:]
+            if self.filled == len(self.buffer):
+                await self.flush()
+
+    async def flush(self):
+        if self.filled:
+            await asyncio.get_event_loop().run_in_executor(None, self._write_buffer)
+
+    def close(self):
+        """Write what is still buffered and close the file, also after a failed download"""
+        try:
+            if self.filled:
+                self._write_buffer()
+        finally:
+            os.close(self.fd)
+            self._save_journal()
+
+
+def preallocate(fd, offset, length):
+    """Reserve length bytes of fd from offset on, returns whether the file system supports it"""
+    if not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, offset, length)
+        return True
+    except OSError:
+        return False
+
+
+SEGMENT_MIN_SIZE = 8 * 1024 * 1024  # Smallest range worth its own connection
+SEGMENT_SPLIT_SIZE = 1024 * 1024  # Ranges with less left than twice this are not split any further
+SEGMENT_FLUSH_SIZE = 1024 * 1024  # Bytes buffered per connection between writes
+SEGMENT_JOURNAL_INTERVAL = 1.0  # Seconds between journal updates
+
+
+class RangeIgnoredError(Exception):
+    """The server answered a range request with the whole file, it changed since the download started"""
+
+
+class _Segment:
+    """A byte range of a segmented download, read up to pos and written up to written"""
+    __slots__ = ('pos', 'written', 'end')
+
+    def __init__(self, start, end):
+        self.pos = self.written = start
+        self.end = end
+
+
+async def _download_segments(session, url, headers, file_location, journal, connections, on_chunk, first_response=None):
+    """Fetch the missing ranges of file_location's .part file over up to connections parallel requests
+
+    The ranges are journal['pending'], or the whole file split by its size for a new download. first_response, the
+    response to the first request, serves the first range. A connection that finishes its range takes over half of the range with the
+    most left, so fast connections end up downloading more than slow ones. Ranges are written with positioned
+    writes into the file, preallocated to journal['size'], and the ranges still missing are kept in the journal.
+    Returns the bytes downloaded, raises RangeIgnoredError when the server does not honour a range."""
+    loop = asyncio.get_event_loop()
+    size = journal['size']
+    validator = journal.get('etag') or journal.get('last_modified')
+    part_location = file_location + PART_SUFFIX
+
+    if 'pending' not in journal:
+        count = max(1, min(connections, size // SEGMENT_MIN_SIZE))
+        bounds = [size * i // count for i in range(count + 1)]
+        waiting = [_Segment(start, end) for start, end in zip(bounds, bounds[1:])]
+    else:
+        waiting = [_Segment(start, end) for start, end in journal['pending'] if start < end]
+    active = []
+    journal_written_at = 0
+    journal_lock = asyncio.Lock()  # Journal writes land in the order of their snapshots
+
+    async def save_journal(force=False):
+        nonlocal journal_written_at
+        if not force and time.monotonic() - journal_written_at < SEGMENT_JOURNAL_INTERVAL:
+            return
+        journal_written_at = time.monotonic()
+        async with journal_lock:
+            # What was read but not written yet counts as missing, a stale journal only re-downloads some bytes
+            journal['pending'] = [[segment.written, segment.end] for segment in active + waiting if segment.written < segment.end]
+            await loop.run_in_executor(None, write_part_journal, file_location, dict(journal))
+
+    await save_journal(force=True)  # Before the first write, so the journal never claims bytes that are not there
+    fd = os.open(part_location, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0))
+    write_lock = threading.Lock()
+
+    def write_at(data, position):
+        if hasattr(os, 'pwrite'):
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, position)
+                view, position = view[written:], position + written
+        else:
+            with write_lock:  # No positioned writes on Windows
+                os.lseek(fd, position, os.SEEK_SET)
+                os.write(fd, data)
+
+    def next_segment():
+        if waiting:
+            segment = waiting.pop(0)
+        else:
+            # Split the range with the most left, its connection keeps the first half
+            busiest = max(active, key=lambda segment: segment.end - segment.pos, default=None)
+            if busiest is None or busiest.end - busiest.pos < 2 * SEGMENT_SPLIT_SIZE:
+                return None
+            middle = busiest.pos + (busiest.end - busiest.pos) // 2
+            segment = _Segment(middle, busiest.end)
+            busiest.end = middle
+        active.append(segment)
+        return segment
+
+    async def read_into(segment, response):
+        buffer = bytearray()
+        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+            chunk = chunk[:segment.end - segment.pos]  # The end moves when another connection takes over a half
+            buffer += chunk
+            segment.pos += len(chunk)
+            on_chunk(len(chunk))
+            if len(buffer) >= SEGMENT_FLUSH_SIZE or segment.pos >= segment.end:
+                await loop.run_in_executor(None, write_at, bytes(buffer), segment.written)
+                segment.written += len(buffer)
+                buffer.clear()
+                await save_journal()
+            if segment.pos >= segment.end:
+                break
+        if buffer:
+            await loop.run_in_executor(None, write_at, bytes(buffer), segment.written)
+            segment.written += len(buffer)
+        if segment.pos < segment.end:
+            raise aiohttp.ClientPayloadError(f'Connection closed {segment.end - segment.pos} bytes before the end of its range')
+
+    async def connection(segment, response=None):
+        while segment:
+            if response is not None:
+                await read_into(segment, response)
+                response.close()  # Stops the full response at the end of the first range
+                response = None
+            else:
+                range_headers = {'Range': f'bytes={segment.pos}-{segment.end - 1}'}
+                if validator:
+                    range_headers['If-Range'] = validator
+                async with session.get(url, headers={**headers, **range_headers}, ssl=False) as range_response:
+                    range_response.raise_for_status()
+                    content_range = re.match(r'bytes (\d+)-', range_response.headers.get('content-range', ''))
+                    if range_response.status != 206 or not content_range or int(content_range.group(1)) != segment.pos:
+                        raise RangeIgnoredError(url)
+                    await read_into(segment, range_response)
+            active.remove(segment)
+            segment = next_segment()
+
+    try:
+        if not preallocate(fd, 0, size):
+            os.ftruncate(fd, size)  # Sparse instead, ranges are written wherever they fall
+        tasks = []
+        if first_response is not None:
+            tasks.append(asyncio.ensure_future(connection(next_segment(), first_response)))
+        while len(tasks) < connections and waiting:
+            tasks.append(asyncio.ensure_future(connection(next_segment())))
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    finally:
+        os.close(fd)
+        await save_journal(force=True)
+
+
+def resize_artwork(file_location, artwork_settings):
+    """Resize and re-encode a downloaded cover in place according to artwork_settings"""
+    new_resolution = artwork_settings.get('resolution', 1400)
+    new_format = artwork_settings.get('format', 'jpeg')
+    if new_format == 'jpg': new_format = 'jpeg'
+    new_compression = artwork_settings.get('compression', 'low')
+    if new_compression == 'low':
+        new_compression = 90
+    elif new_compression == 'high':
+        new_compression = 70
+    if new_format == 'png': new_compression = None
+    with Image.open(file_location) as im:
+        im = im.resize((new_resolution, new_resolution), Image.Resampling.BICUBIC)
+        im.save(file_location, new_format, quality=new_compression)
+
+
+async def download_file_async(session, url, file_location, headers={}, enable_progress_bar=False, indent_level=0, artwork_settings=None, max_retries=3, progress_callback=None, segments=1,
+                              chunk_size=DOWNLOAD_CHUNK_SIZE, buffer_size=DOWNLOAD_BUFFER_SIZE, kind='file'):
+    """Async version of download_file using aiohttp - returns (file_location, bytes_downloaded)
+
+    The download is written to file_location + '.part' and renamed once complete. A failed attempt keeps the part
+    and its journal (see part_journal_location), retries and later runs continue from there with a Range request,
+    guarded by If-Range with the ETag or Last-Modified of the first response. Cancelling deletes both.
+
+    Received chunks of chunk_size bytes are written through a PartWriter of buffer_size bytes.
 
-async def download_file_async(session, url, file_location, headers={}, enable_progress_bar=False, indent_level=0, artwork_settings=None, max_retries=3):
-    """Async version of download_file using aiohttp - returns (file_location, bytes_downloaded)"""
+    Finished transfers are counted in the transfer metrics under kind, e.g. audio, cover or booklet.
+
+    With segments above 1, files of at least 2 * SEGMENT_MIN_SIZE from servers that send Accept-Ranges are fetched
+    over up to that many connections at once, see _download_segments.
+
+    progress_callback(chunk_bytes, total_bytes) is called for every chunk written, total_bytes being what is left
+    to download, a retry that has to start over rewinds it with a negative chunk_bytes"""
     if os.path.isfile(file_location):
         # File already exists - return 0 bytes downloaded
         return (file_location, 0)
@@ -92,177 +579,206 @@ async def download_file_async(session, url, file_location, headers={}, enable_pr
     if directory and not os.path.exists(directory):
         os.makedirs(directory, exist_ok=True)
 
+    loop = asyncio.get_event_loop()
+    part_location = file_location + PART_SUFFIX
     bytes_downloaded = 0
+    remaining = None  # Bytes left when this call started, the total reported to progress_callback
+    started = time.perf_counter()
+
+    # The part and its journal are read and written on worker threads, the loop is shared by every download
+    async def start_over():
+        nonlocal bytes_downloaded
+        if bytes_downloaded and progress_callback:
+            progress_callback(-bytes_downloaded, None)
+        bytes_downloaded = 0
+        await loop.run_in_executor(None, remove_partial_download, file_location)
+
+    def received(chunk_bytes):
+        nonlocal bytes_downloaded
+        bytes_downloaded += chunk_bytes
+        if progress_callback:
+            progress_callback(chunk_bytes, remaining)
 
     for attempt in range(max_retries):
+        offset, range_headers = await loop.run_in_executor(None, _resumable_offset, file_location, url, segments > 1)
+        if not offset and bytes_downloaded:
+            await start_over()
         try:
-            async with session.get(url, headers=headers, ssl=False) as response:
-                response.raise_for_status()
-                
-                total = None
-                if 'content-length' in response.headers:
-                    total = int(response.headers['content-length'])
-
-                # Use aiofiles for async file writing
-                async with aiofiles.open(file_location, 'wb') as f:
+            async with session.get(url, headers={**headers, **range_headers}, ssl=False) as response:
+                if response.status == 416 and offset:
+                    # Nothing left to download, or the part is longer than the file on the server now
+                    journal = await loop.run_in_executor(None, read_part_journal, file_location) or {}
+                    if journal.get('size') != offset:
+                        await start_over()
+                        continue
+                else:
+                    response.raise_for_status()
+
+                if response.status == 206:
+                    # Content-Range: bytes <first>-<last>/<size>, the server has to resume where the part ends
+                    content_range = re.match(r'bytes (\d+)-\d+/(\d+|\*)', response.headers.get('content-range', ''))
+                    if not content_range or int(content_range.group(1)) != offset:
+                        await start_over()
+                        continue
+                    size = int(content_range.group(2)) if content_range.group(2) != '*' else None
+                elif response.status == 416:
+                    size = offset
+                else:
+                    # A full response: no part yet, or If-Range found that the file has changed since
+                    if offset:
+                        await start_over()
+                    offset = 0
+                    size = int(response.headers['content-length']) if 'content-length' in response.headers else None
+
+                journal = await loop.run_in_executor(None, _open_part_journal, file_location, url, offset, size,
+                                                     response.headers.get('etag'), response.headers.get('last-modified'))
+                if remaining is None:
+                    if journal and journal.get('pending'):
+                        remaining = sum(end - start for start, end in journal['pending'])
+                    else:
+                        remaining = size - offset if size is not None else None
+                total = remaining
+
+                segmented = segments > 1 and journal and size and (
+                    'pending' in journal and response.status == 206 or
+                    response.status == 200 and size >= 2 * SEGMENT_MIN_SIZE and
+                    response.headers.get('accept-ranges', '').lower() == 'bytes')
+                if segmented:
+                    await _download_segments(session, url, headers, file_location, journal, segments, received, response)
+                else:
+                    # Chunks are gathered in one buffer and written in few large writes, off the event loop
+                    bar = None
                     if enable_progress_bar and total:
-                        # Create indented progress bar with proper formatting
-                        import sys
-                        from io import StringIO
-                        
-                        class IndentedOutput:
-                            def __init__(self, indent_level):
-                                self.indent_level = indent_level
-                                
-                            def write(self, text):
-                                # Add indentation to each line
-                                lines = text.split('\n')
-                                indented_lines = []
-                                for line in lines:
-                                    if line.strip():  # Only indent non-empty lines
-                                        indented_lines.append(' ' * self.indent_level + line)
-                                    else:
-                                        indented_lines.append(line)
-                                sys.stdout.write('\n'.join(indented_lines))
-                                
-                            def flush(self):
-                                sys.stdout.flush()
-                        
                         bar = tqdm(
-                            total=total, 
-                            unit='B', 
-                            unit_scale=True, 
-                            unit_divisor=1024, 
-                            initial=0, 
+                            total=total,
+                            unit='B',
+                            unit_scale=True,
+                            unit_divisor=1024,
+                            initial=0,
                             miniters=1,
                             leave=False,
-                            file=IndentedOutput(indent_level)
+                            file=_IndentedOutput(indent_level)
                         )
-                        
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-                            bar.update(len(chunk))
-                            bytes_downloaded += len(chunk)
-                        bar.close()
-                    else:
-                        async for chunk in response.content.iter_chunked(8192):
-                            await f.write(chunk)
-                            bytes_downloaded += len(chunk)
-
-                # Handle artwork resizing if needed
+                    writer = await loop.run_in_executor(None, PartWriter, file_location, offset, size, journal, buffer_size,
+                                                        bar.update if bar else None)
+                    try:
+                        if response.status != 416:
+                            async for chunk in response.content.iter_chunked(chunk_size):
+                                await writer.write(chunk)
+                                bytes_downloaded += len(chunk)
+                                if progress_callback:
+                                    progress_callback(len(chunk), total)
+                        await writer.flush()
+                    finally:
+                        await loop.run_in_executor(None, writer.close)
+                        if bar:
+                            bar.close()
+                    if size is not None and writer.position != size:
+                        raise aiohttp.ClientPayloadError(f'Connection closed after {writer.position} of {size} bytes')
+
+                await loop.run_in_executor(None, _complete_part, file_location)
+
+                # Handle artwork resizing if needed, off the loop as it would hold up every other transfer
                 if artwork_settings and artwork_settings.get('should_resize', False):
-                    new_resolution = artwork_settings.get('resolution', 1400)
-                    new_format = artwork_settings.get('format', 'jpeg')
-                    if new_format == 'jpg': new_format = 'jpeg'
-                    new_compression = artwork_settings.get('compression', 'low')
-                    if new_compression == 'low':
-                        new_compression = 90
-                    elif new_compression == 'high':
-                        new_compression = 70
-                    if new_format == 'png': new_compression = None
-                    with Image.open(file_location) as im:
-                        im = im.resize((new_resolution, new_resolution), Image.Resampling.BICUBIC)
-                        im.save(file_location, new_format, quality=new_compression)
-                
+                    await loop.run_in_executor(None, resize_artwork, file_location, artwork_settings)
+
+                metrics.transfer_seconds.observe(time.perf_counter() - started, kind=kind)
+                metrics.transfer_bytes_total.inc(bytes_downloaded, kind=kind)
                 return (file_location, bytes_downloaded)
                 
+        except RangeIgnoredError:
+            await start_over()  # The file changed while its ranges were downloaded
+            continue
         except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            await loop.run_in_executor(None, _record_part_offset, file_location)
             if attempt < max_retries - 1:
                 await asyncio.sleep(2 ** attempt)  # Exponential backoff
                 continue
             else:
-                # Clean up partial file on final failure
-                if os.path.isfile(file_location):
-                    try:
-                        os.remove(file_location)
-                    except:
-                        pass
+                # Keep the part, the next download of this file continues it
                 raise e
         except KeyboardInterrupt:
-            if os.path.isfile(file_location):
-                print(f'\tDeleting partially downloaded file "{str(file_location)}"')
-                silentremove(file_location)
+            if os.path.isfile(part_location):
+                _record_part_offset(file_location)
+                print(f'\tKeeping partially downloaded file "{str(part_location)}" to resume later')
             raise KeyboardInterrupt
+        except BaseException:
+            # Cancelled, by asyncio or by progress_callback, don't leave a partial file behind
+            remove_partial_download(file_location)
+            silentremove(file_location)
+            raise
 
-def download_file(url, file_location, headers={}, enable_progress_bar=False, indent_level=0, artwork_settings=None):
-    """Synchronous wrapper for the async download function for backward compatibility"""
-    if os.path.isfile(file_location):
-        return None
+async def stream_to_process_async(session, url, args, headers={}, max_retries=3, progress_callback=None):
+    """Download url into the stdin of the command args, e.g. an ffmpeg reading pipe:0 - returns bytes_downloaded
 
-    # Create directory structure if it doesn't exist
-    directory = os.path.dirname(file_location)
-    if directory and not os.path.exists(directory):
-        os.makedirs(directory, exist_ok=True)
+    Writes wait for the process to catch up, so the download never runs ahead of it. A network error restarts the
+    command and the download, a failing command raises subprocess.CalledProcessError. progress_callback works as
+    in download_file_async and is rewound before every restart or error."""
+    import subprocess
+    bytes_downloaded = 0
 
-    r = r_session.get(url, stream=True, headers=headers, verify=False)
+    def rewind():
+        nonlocal bytes_downloaded
+        if bytes_downloaded and progress_callback:
+            progress_callback(-bytes_downloaded, None)
+        bytes_downloaded = 0
 
-    total = None
-    if 'content-length' in r.headers:
-        total = int(r.headers['content-length'])
+    for attempt in range(max_retries):
+        rewind()
+        process = await asyncio.create_subprocess_exec(*args, stdin=asyncio.subprocess.PIPE,
+                                                       stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        # Read stderr while writing, a full stderr pipe would stall the process and with it the download
+        stderr_task = asyncio.ensure_future(process.stderr.read())
+        try:
+            try:
+                async with session.get(url, headers=headers, ssl=False) as response:
+                    response.raise_for_status()
+                    total = int(response.headers['content-length']) if 'content-length' in response.headers else None
+                    async for chunk in response.content.iter_chunked(65536):
+                        process.stdin.write(chunk)
+                        await process.stdin.drain()
+                        bytes_downloaded += len(chunk)
+                        if progress_callback:
+                            progress_callback(len(chunk), total)
+                process.stdin.close()
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # The process exited early, its return code and stderr tell why
+            returncode = await process.wait()
+            stderr = await stderr_task
+            if returncode:
+                rewind()
+                raise subprocess.CalledProcessError(returncode, args, stderr=stderr)
+            return bytes_downloaded
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            process.kill()
+            await process.wait()
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+                continue
+            rewind()
+            raise
+        except BaseException:
+            # Cancelled, by asyncio or by progress_callback, don't leave the process running
+            if process.returncode is None:
+                process.kill()
+            raise
+        finally:
+            stderr_task.cancel()
 
-    try:
-        with open(file_location, 'wb') as f:
-            if enable_progress_bar and total:
-                # Create indented progress bar with proper formatting
-                import sys
-                from io import StringIO
-                
-                class IndentedOutput:
-                    def __init__(self, indent_level):
-                        self.indent_level = indent_level
-                        
-                    def write(self, text):
-                        # Add indentation to each line
-                        lines = text.split('\n')
-                        indented_lines = []
-                        for line in lines:
-                            if line.strip():  # Only indent non-empty lines
-                                indented_lines.append(' ' * self.indent_level + line)
-                            else:
-                                indented_lines.append(line)
-                        sys.stdout.write('\n'.join(indented_lines))
-                        
-                    def flush(self):
-                        sys.stdout.flush()
-                
-                bar = tqdm(
-                    total=total, 
-                    unit='B', 
-                    unit_scale=True, 
-                    unit_divisor=1024, 
-                    initial=0, 
-                    miniters=1,
-                    leave=False,
-                    file=IndentedOutput(indent_level)
-                )
-                for chunk in r.iter_content(chunk_size=1024):
-                    if chunk:  # filter out keep-alive new chunks
-                        f.write(chunk)
-                        bar.update(len(chunk))
-                bar.close()
-            else:
-                [f.write(chunk) for chunk in r.iter_content(chunk_size=1024) if chunk]
-        if artwork_settings and artwork_settings.get('should_resize', False):
-            new_resolution = artwork_settings.get('resolution', 1400)
-            new_format = artwork_settings.get('format', 'jpeg')
-            if new_format == 'jpg': new_format = 'jpeg'
-            new_compression = artwork_settings.get('compression', 'low')
-            if new_compression == 'low':
-                new_compression = 90
-            elif new_compression == 'high':
-                new_compression = 70
-            if new_format == 'png': new_compression = None
-            with Image.open(file_location) as im:
-                im = im.resize((new_resolution, new_resolution), Image.Resampling.BICUBIC)
-                im.save(file_location, new_format, quality=new_compression)
-    except KeyboardInterrupt:
-        if os.path.isfile(file_location):
-            print(f'\tDeleting partially downloaded file "{str(file_location)}"')
-            silentremove(file_location)
-        raise KeyboardInterrupt
-    
-    # Return the file location on successful download
-    return file_location
+def download_file(url, file_location, headers={}, enable_progress_bar=False, indent_level=0, artwork_settings=None, progress_callback=None, segments=1, kind='file'):
+    """download_file_async on the shared SessionLoop, for code that is not async - returns the file location, or None
+    when the file already exists"""
+    if os.path.isfile(file_location):
+        return None
+
+    async def download():
+        session = await session_loop.get_session()
+        return await download_file_async(session, url, file_location, headers=headers, enable_progress_bar=enable_progress_bar,
+                                         indent_level=indent_level, artwork_settings=artwork_settings,
+                                         progress_callback=progress_callback, segments=segments, kind=kind)
+
+    session_loop = get_session_loop()
+    return session_loop.run(download())[0]
 
 # root mean square code by Charlie Clark: https://code.activestate.com/recipes/577630-comparing-two-images/
 def compare_images(image_1, image_2):
@@ -281,16 +797,7 @@ def silentremove(filename):
             raise
 
 def read_temporary_setting(settings_location, module, root_setting=None, setting=None, global_mode=False):
-    temporary_settings = pickle.load(open(settings_location, 'rb'))
-    module_settings = temporary_settings['modules'][module] if module in temporary_settings['modules'] else None
-    
-    if module_settings:
-        if global_mode:
-            session = module_settings
-        else:
-            session = module_settings['sessions'][module_settings['selected']]
-    else:
-        session = None
+    session = get_session_store(settings_location).read(module, global_mode)
 
     if session and root_setting:
         if setting:
@@ -303,24 +810,7 @@ def read_temporary_setting(settings_location, module, root_setting=None, setting
         return session
 
 def set_temporary_setting(settings_location, module, root_setting, setting=None, value=None, global_mode=False):
-    temporary_settings = pickle.load(open(settings_location, 'rb'))
-    module_settings = temporary_settings['modules'][module] if module in temporary_settings['modules'] else None
-
-    if module_settings:
-        if global_mode:
-            session = module_settings
-        else:
-            session = module_settings['sessions'][module_settings['selected']]
-    else:
-        session = None
-
-    if not session:
-        raise Exception('Module does not use temporary settings')
-    if setting:
-        session[root_setting][setting] = value
-    else:
-        session[root_setting] = value
-    pickle.dump(temporary_settings, open(settings_location, 'wb'))
+    get_session_store(settings_location).update(module, root_setting, setting, value, global_mode)
 
 create_temp_filename = lambda : f'temp/{os.urandom(16).hex()}'
 